@@ -11,6 +11,8 @@
 -- DO NOT CHANGE THESE UNLESS YOU ARE THE SERVER ADMINISTRATOR. It will stop sending the results to the server.
 local version = nil
 local botURL = nil
+-- Submission format (see utility/wire.py on the server), raised by the /hello check when the server supports it
+local wireFormat = 1
 --------------------------------------------------------------------------------------------------
 
 -- luacheck: globals GAMESTATE PREFSMAN THEME SL PLAYER_1 PLAYER_2 STATSMAN CRYPTMAN PROFILEMAN IniFile NETWORK IsHumanPlayer FormatPercentScore CalculateExScore GetTimingWindow GetWorstJudgment BinaryToHex clamp Trace ToEnumShortString ivalues MESSAGEMAN
@@ -177,23 +179,214 @@ end
 
 --------------------------------------------------------------------------------------------------
 
-local function sendData(data, botURL, callback)
-    -- Check data size before sending
-    local dataSize = string.len(data)
-    debugPrint("Sending data of size: " .. dataSize .. " bytes to " .. botURL)
+-- Request compression
+-- The game has no compression functions for Lua, so request bodies are compressed here: a zlib
+-- stream (Content-Encoding: deflate) using LZ77 matches and the fixed Huffman codes. The result
+-- JSON repeats the same keys for every scatterplot point, which compresses well even without
+-- dynamic codes. Lua 5.1 has no bit operators, bits are packed with arithmetic instead.
+
+local compressMinSize = 2048      -- smaller bodies are sent as they are
+local compressMaxChain = 8        -- earlier positions tried per match, trades speed for size
+local compressionEnabled = true   -- turned off for the session if the server rejects a compressed body
+
+local deflateTables = nil
+
+local function reverseBits(code, bits)
+    local result = 0
+    for _ = 1, bits do
+        result = result * 2 + code % 2
+        code = math.floor(code / 2)
+    end
+    return result
+end
+
+local function buildDeflateTables()
+    local t = { litCode = {}, litBits = {}, lenSymbol = {}, lenExtra = {}, lenBase = {},
+        distSymbol = {}, distExtra = {}, distBase = {}, pow2 = {}, char = {} }
+
+    -- Fixed literal/length codes (RFC 1951 3.2.6), stored bit reversed since they go out LSB first
+    for symbol = 0, 287 do
+        local code, bits
+        if symbol < 144 then
+            code, bits = 0x30 + symbol, 8
+        elseif symbol < 256 then
+            code, bits = 0x190 + symbol - 144, 9
+        elseif symbol < 280 then
+            code, bits = symbol - 256, 7
+        else
+            code, bits = 0xC0 + symbol - 280, 8
+        end
+        t.litCode[symbol] = reverseBits(code, bits)
+        t.litBits[symbol] = bits
+    end
+
+    local lengthBase = { 3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 15, 17, 19, 23, 27, 31, 35, 43, 51, 59, 67, 83, 99, 115,
+        131, 163, 195, 227, 258 }
+    local lengthExtra = { 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 0 }
+    for index = 1, #lengthBase do
+        local last = index < #lengthBase and lengthBase[index + 1] - 1 or 258
+        for length = lengthBase[index], last do
+            t.lenSymbol[length] = 256 + index
+            t.lenExtra[length] = lengthExtra[index]
+            t.lenBase[length] = lengthBase[index]
+        end
+    end
+
+    local distBase = { 1, 2, 3, 4, 5, 7, 9, 13, 17, 25, 33, 49, 65, 97, 129, 193, 257, 385, 513, 769, 1025, 1537,
+        2049, 3073, 4097, 6145, 8193, 12289, 16385, 24577 }
+    for index = 1, #distBase do
+        local extra = index <= 4 and 0 or math.floor((index - 3) / 2)
+        local last = index < #distBase and distBase[index + 1] - 1 or 32768
+        for distance = distBase[index], last do
+            -- Distance codes are all 5 bits
+            t.distSymbol[distance] = reverseBits(index - 1, 5)
+            t.distExtra[distance] = extra
+            t.distBase[distance] = distBase[index]
+        end
+    end
+
+    for bits = 0, 31 do
+        t.pow2[bits] = 2 ^ bits
+    end
+    for byte = 0, 255 do
+        t.char[byte] = string.char(byte)
+    end
+    return t
+end
+
+-- zlib stream (RFC 1950) of a string
+local function deflate(data)
+    deflateTables = deflateTables or buildDeflateTables()
+    local t = deflateTables
+    local litCode, litBits, pow2, char = t.litCode, t.litBits, t.pow2, t.char
+
+    local n = string.len(data)
+    local b = {}
+    for offset = 1, n, 4096 do
+        local last = math.min(offset + 4095, n)
+        local slice = { string.byte(data, offset, last) }
+        for k = 1, #slice do
+            b[offset + k - 1] = slice[k]
+        end
+    end
+
+    local out, outCount = { "\120\1" }, 1   -- CMF/FLG: deflate, 32K window, no dictionary
+    local bitBuffer, bitCount = 0, 0
+    local function writeBits(value, bits)
+        bitBuffer = bitBuffer + value * pow2[bitCount]
+        bitCount = bitCount + bits
+        while bitCount >= 8 do
+            local byte = bitBuffer % 256
+            outCount = outCount + 1
+            out[outCount] = char[byte]
+            bitBuffer = (bitBuffer - byte) / 256
+            bitCount = bitCount - 8
+        end
+    end
+
+    writeBits(1, 1) -- BFINAL, everything goes into one block
+    writeBits(1, 2) -- BTYPE 01, fixed Huffman codes
+
+    local head, previous = {}, {}
+    local i = 1
+    while i <= n do
+        local bestLength, bestDistance = 0, 0
+        if i + 2 <= n then
+            local hash = (b[i] * 256 + b[i + 1]) * 256 + b[i + 2]
+            local candidate = head[hash]
+            local maxLength = math.min(258, n - i + 1)
+            local chain = compressMaxChain
+            while candidate and chain > 0 and i - candidate <= 32768 do
+                if b[candidate + bestLength] == b[i + bestLength] then
+                    local length = 0
+                    while length < maxLength and b[candidate + length] == b[i + length] do
+                        length = length + 1
+                    end
+                    if length > bestLength then
+                        bestLength, bestDistance = length, i - candidate
+                        if length == maxLength then break end
+                    end
+                end
+                candidate = previous[candidate]
+                chain = chain - 1
+            end
+            previous[i] = head[hash]
+            head[hash] = i
+        end
+
+        if bestLength >= 3 then
+            local symbol = t.lenSymbol[bestLength]
+            writeBits(litCode[symbol], litBits[symbol])
+            if t.lenExtra[bestLength] > 0 then
+                writeBits(bestLength - t.lenBase[bestLength], t.lenExtra[bestLength])
+            end
+            writeBits(t.distSymbol[bestDistance], 5)
+            if t.distExtra[bestDistance] > 0 then
+                writeBits(bestDistance - t.distBase[bestDistance], t.distExtra[bestDistance])
+            end
+            -- Positions inside the match can still start later matches
+            for j = i + 1, math.min(i + bestLength - 1, n - 2) do
+                local hash = (b[j] * 256 + b[j + 1]) * 256 + b[j + 2]
+                previous[j] = head[hash]
+                head[hash] = j
+            end
+            i = i + bestLength
+        else
+            writeBits(litCode[b[i]], litBits[b[i]])
+            i = i + 1
+        end
+    end
+    writeBits(litCode[256], litBits[256]) -- end of block
+    if bitCount > 0 then
+        writeBits(0, 8 - bitCount)
+    end
+
+    -- Adler-32 of the uncompressed data, big endian
+    local s1, s2 = 1, 0
+    for k = 1, n do
+        s1 = (s1 + b[k]) % 65521
+        s2 = (s2 + s1) % 65521
+    end
+    out[outCount + 1] = char[math.floor(s2 / 256)] .. char[s2 % 256] .. char[math.floor(s1 / 256)] .. char[s1 % 256]
+    return table.concat(out)
+end
+
+-- Body and headers for a JSON request, compressed if that makes it smaller
+local function prepareBody(data)
+    local headers = { ["Content-Type"] = "application/json" }
+    if not compressionEnabled or string.len(data) < compressMinSize then
+        return data, headers
+    end
+
+    local ok, compressed = pcall(deflate, data)
+    if not ok then
+        debugPrint("Compression failed, sending uncompressed: " .. tostring(compressed))
+        return data, headers
+    end
+    if string.len(compressed) >= string.len(data) then
+        return data, headers
+    end
+    headers["Content-Encoding"] = "deflate"
+    return compressed, headers
+end
+
+--------------------------------------------------------------------------------------------------
 
-    if dataSize > 1048576 then -- 1MB limit
-        debugPrint("Warning: Data size is very large (" .. math.floor(dataSize / 1024) .. "KB), this might cause issues")
+local function postBody(body, headers, botURL, callback)
+    local bodySize = string.len(body)
+    debugPrint("Sending " .. (headers["Content-Encoding"] and "compressed " or "") .. "data of size: " ..
+        bodySize .. " bytes to " .. botURL)
+
+    if bodySize > 1048576 then -- 1MB limit
+        debugPrint("Warning: Data size is very large (" .. math.floor(bodySize / 1024) .. "KB), this might cause issues")
     end
 
     -- Send HTTP POST request
     NETWORK:HttpRequest {
         url = botURL,
         method = "POST",
-        body = data,
-        headers = {
-            ["Content-Type"] = "application/json"
-        },
+        body = body,
+        headers = headers,
         onResponse = function(response)
             local code = response.statusCode or 0
             local response_body = response.body or ""
@@ -216,10 +409,59 @@ local function sendData(data, botURL, callback)
     }
 end
 
+-- Send a JSON string, compressed when possible. Falls back to plain requests for the rest of the
+-- session if the server cannot read the compressed body (415, any other status is about the content).
+local function sendData(data, botURL, callback, body, headers)
+    if not body then
+        body, headers = prepareBody(data)
+    end
+    if not headers["Content-Encoding"] then
+        return postBody(body, headers, botURL, callback)
+    end
+
+    postBody(body, headers, botURL, function(code, response)
+        if code == 415 then
+            debugPrint("Server rejected the compressed body (" .. tostring(response) .. "), sending uncompressed")
+            compressionEnabled = false
+            return postBody(data, { ["Content-Type"] = "application/json" }, botURL, callback)
+        end
+        if callback then
+            callback(code, response)
+        end
+    end)
+end
+
+--------------------------------------------------------------------------------------------------
+
+-- Chunks that fail for a temporary reason are retried: after each round the server is asked
+-- which chunks it has (/chunk/status) and only the missing ones are sent again.
+local chunkRetryRounds = 3  -- retry rounds before the submission fails
+local chunkRetryDelay = 1   -- seconds before the first retry round, doubled every round
+
+local function isRetryable(code)
+    return code == 0 or code == 408 or code == 429 or code >= 500
+end
+
+local function urlEncode(value)
+    return (tostring(value):gsub("[^%w%-_%.~]", function(c) return string.format("%%%02X", string.byte(c)) end))
+end
+
+-- Run fn after a delay, with an actor of the current screen as the timer
+local delayedCalls = 0
+local function after(actor, seconds, fn)
+    if not actor then
+        return fn()
+    end
+    delayedCalls = delayedCalls + 1
+    local name = "DiscordLeaderboardDelay" .. delayedCalls
+    actor:addcommand(name, function() fn() end)
+    actor:sleep(seconds):queuecommand(name)
+end
+
 --------------------------------------------------------------------------------------------------
 
 -- Send data in chunks for large datasets
-local function sendDataInChunks(data, botURL, callback)
+local function sendDataInChunks(data, botURL, callback, timer)
     local dataSize = string.len(data)
     debugPrint("Total data size: " .. dataSize .. " bytes")
 
@@ -229,13 +471,21 @@ local function sendDataInChunks(data, botURL, callback)
         return sendData(data, botURL .. "/send", callback)
     end
 
+    -- Compressed, even long songs usually fit in one request. The body is reused if chunking
+    -- turns out not to be possible, so the data is never compressed twice.
+    local body, headers = prepareBody(data)
+    if string.len(body) < 500000 then
+        debugPrint("Compressed data size is manageable (" .. string.len(body) .. " bytes), sending normally")
+        return sendData(data, botURL .. "/send", callback, body, headers)
+    end
+
     debugPrint("Data is large, attempting to send in chunks")
 
     -- Parse the JSON to extract large arrays
     local decoded = JsonDecode(data)
     if not decoded then
         debugPrint("Failed to parse data for chunking, sending normally")
-        return sendData(data, botURL .. "/send", callback)
+        return sendData(data, botURL .. "/send", callback, body, headers)
     end
 
     local scatterplotData = decoded.scatterplotData
@@ -249,9 +499,10 @@ local function sendDataInChunks(data, botURL, callback)
         needsChunking = true
     end
 
+    -- Format 2 bodies end up here, their points are packed strings instead of arrays
     if not needsChunking then
         debugPrint("No large arrays found, sending normally")
-        return sendData(data, botURL .. "/send", callback)
+        return sendData(data, botURL .. "/send", callback, body, headers)
     end
 
     -- Remove large arrays from main payload
@@ -285,96 +536,122 @@ local function sendDataInChunks(data, botURL, callback)
     debugPrint("Sending " ..
         scatterChunks .. " scatterplot chunks and " .. lifebarChunks .. " lifebar chunks first, then main data")
 
-    local chunksToSend = scatterChunks + lifebarChunks
-    local chunksCompleted = 0
-    local hasError = false
-
-    local function checkAllChunksSent()
-        chunksCompleted = chunksCompleted + 1
-        debugPrint("Chunk completed: " .. chunksCompleted .. "/" .. chunksToSend)
-
-        if chunksCompleted >= chunksToSend and not hasError then
-            debugPrint("All chunks sent successfully, now sending main data")
-            sendData(mainData, sendURL, callback)
+    -- Build every chunk up front, chunks that did not arrive are sent again from here
+    local chunks = {}
+    local function addChunks(chunkType, points, count)
+        for i = 1, count do
+            local chunk = {}
+            for j = (i - 1) * chunkSize + 1, math.min(i * chunkSize, #points) do
+                table.insert(chunk, points[j])
+            end
+            table.insert(chunks, {
+                chunkType = chunkType,
+                index = i,
+                size = #chunk,
+                body = encode({
+                    hash = decoded.hash,
+                    api_key = decoded.api_key,
+                    chunkType = chunkType,
+                    chunkIndex = i,
+                    totalChunks = count,
+                    data = chunk
+                })
+            })
         end
     end
+    if scatterplotData then
+        addChunks("scatterplot", scatterplotData, scatterChunks)
+    end
+    if lifebarInfo then
+        addChunks("lifebar", lifebarInfo, lifebarChunks)
+    end
+
+    local hasError = false
+    local sendRound
 
-    local function handleChunkError(code, body, chunkType, chunkIndex)
+    local function handleChunkError(code, message)
         if not hasError then
             hasError = true
-            debugPrint("Failed to send " ..
-                chunkType .. " chunk " .. chunkIndex .. ": " .. tostring(code) .. " - " .. tostring(body))
+            debugPrint(message .. " (" .. tostring(code) .. ")")
             if callback then
-                callback(code, "Failed to send " .. chunkType .. " chunk " .. chunkIndex .. ": " .. tostring(body))
+                callback(code, message)
             end
         end
     end
 
-    -- Send scatterplot chunks first
-    if scatterplotData then
-        for i = 1, scatterChunks do
-            local startIdx = (i - 1) * chunkSize + 1
-            local endIdx = math.min(i * chunkSize, #scatterplotData)
-            local chunk = {}
-            for j = startIdx, endIdx do
-                table.insert(chunk, scatterplotData[j])
+    -- Ask the server which chunks arrived and send the rest again. Without an answer the chunks
+    -- that failed in the last round are resent.
+    local function resendMissing(round, lastFailed)
+        local statusURL = chunkURL .. "/status?api_key=" .. urlEncode(decoded.api_key) .. "&hash=" .. urlEncode(decoded.hash)
+        NETWORK:HttpRequest {
+            url = statusURL,
+            method = "GET",
+            onResponse = function(response)
+                local missing = lastFailed
+                local status = response and response.statusCode == 200 and JsonDecode(response.body or "")
+                if type(status) == "table" and type(status.received) == "table" then
+                    local received = {}
+                    for chunkType, indices in pairs(status.received) do
+                        received[chunkType] = {}
+                        for _, index in ipairs(indices) do
+                            received[chunkType][index] = true
+                        end
+                    end
+                    missing = {}
+                    for _, chunk in ipairs(chunks) do
+                        if not (received[chunk.chunkType] and received[chunk.chunkType][chunk.index]) then
+                            table.insert(missing, chunk)
+                        end
+                    end
+                end
+                debugPrint("Chunk status: " .. #missing .. " of " .. #chunks .. " chunks missing")
+                sendRound(missing, round + 1)
             end
+        }
+    end
 
-            local chunkData = encode({
-                hash = decoded.hash,
-                api_key = decoded.api_key,
-                chunkType = "scatterplot",
-                chunkIndex = i,
-                totalChunks = scatterChunks,
-                data = chunk
-            })
-
-            debugPrint("Sending scatterplot chunk " .. i .. "/" .. scatterChunks .. " (" .. #chunk .. " points)")
-            sendData(chunkData, chunkURL, function(code, body)
-                if code == 200 then
-                    checkAllChunksSent()
-                else
-                    handleChunkError(code, body, "scatterplot", i)
-                end
-            end)
+    sendRound = function(toSend, round)
+        if #toSend == 0 then
+            debugPrint("All chunks sent successfully, now sending main data")
+            return sendData(mainData, sendURL, callback)
         end
-    end
 
-    -- Send lifebar chunks
-    if lifebarInfo then
-        for i = 1, lifebarChunks do
-            local startIdx = (i - 1) * chunkSize + 1
-            local endIdx = math.min(i * chunkSize, #lifebarInfo)
-            local chunk = {}
-            for j = startIdx, endIdx do
-                table.insert(chunk, lifebarInfo[j])
-            end
+        local remaining = #toSend
+        local roundFailed = {}
+        local lastCode, lastBody
+        for _, chunk in ipairs(toSend) do
+            debugPrint("Sending " .. chunk.chunkType .. " chunk " .. chunk.index .. " (" .. chunk.size ..
+                " points), attempt " .. round)
+            sendData(chunk.body, chunkURL, function(code, body)
+                if hasError then return end
+                if code ~= 200 then
+                    if not isRetryable(code) then
+                        return handleChunkError(code, "Failed to send " .. chunk.chunkType .. " chunk " .. chunk.index ..
+                            ": " .. tostring(body))
+                    end
+                    table.insert(roundFailed, chunk)
+                    lastCode, lastBody = code, body
+                end
 
-            local chunkData = encode({
-                hash = decoded.hash,
-                api_key = decoded.api_key,
-                chunkType = "lifebar",
-                chunkIndex = i,
-                totalChunks = lifebarChunks,
-                data = chunk
-            })
+                remaining = remaining - 1
+                if remaining > 0 then return end
 
-            debugPrint("Sending lifebar chunk " .. i .. "/" .. lifebarChunks .. " (" .. #chunk .. " points)")
-            sendData(chunkData, chunkURL, function(code, body)
-                if code == 200 then
-                    checkAllChunksSent()
+                if #roundFailed == 0 then
+                    debugPrint("All chunks sent successfully, now sending main data")
+                    sendData(mainData, sendURL, callback)
+                elseif round > chunkRetryRounds then
+                    handleChunkError(lastCode, "Failed to send " .. #roundFailed .. " chunks after " .. round ..
+                        " attempts: " .. tostring(lastBody))
                 else
-                    handleChunkError(code, body, "lifebar", i)
+                    local delay = chunkRetryDelay * 2 ^ (round - 1)
+                    debugPrint(#roundFailed .. " chunks failed, checking which arrived in " .. delay .. "s")
+                    after(timer, delay, function() resendMissing(round, roundFailed) end)
                 end
             end)
         end
     end
 
-    -- If no chunks to send, send main data immediately
-    if chunksToSend == 0 then
-        debugPrint("No chunks to send, sending main data immediately")
-        sendData(mainData, sendURL, callback)
-    end
+    sendRound(chunks, 1)
 end
 
 --------------------------------------------------------------------------------------------------
@@ -414,6 +691,52 @@ end
 
 --------------------------------------------------------------------------------------------------
 
+-- Format 2 points: integer columns in thousandths, x delta encoded, scatter colors as indices
+-- into a palette with one entry per judgement color. About a fifth of the size of format 1.
+
+local function toThousandths(value)
+    return math.floor(value * 1000 + 0.5)
+end
+
+local function columnarPoints(points, withColors)
+    local xs, ys, js, palette, paletteIndex = {}, {}, {}, {}, {}
+    local lastX = 0
+    for i, point in ipairs(points) do
+        local x = toThousandths(point.x)
+        xs[i] = x - lastX
+        lastX = x
+        ys[i] = toThousandths(point.y)
+
+        if withColors then
+            local c = point.color
+            local key = c[1] .. "," .. c[2] .. "," .. c[3] .. "," .. c[4]
+            if not paletteIndex[key] then
+                table.insert(palette, "[" .. key .. "]")
+                paletteIndex[key] = #palette - 1
+            end
+            js[i] = paletteIndex[key]
+        end
+    end
+
+    local columns = '{"x":[' .. table.concat(xs, ",") .. '],"y":[' .. table.concat(ys, ",") .. ']'
+    if withColors then
+        columns = columns .. ',"j":[' .. table.concat(js, ",") .. '],"palette":[' .. table.concat(palette, ",") .. ']'
+    end
+    return columns .. "}"
+end
+
+-- Pick the newest format from the "formats" list of a /hello response
+local function negotiateFormat(decoded)
+    if type(decoded) == "table" and type(decoded.formats) == "table" then
+        for _, format in ipairs(decoded.formats) do
+            if format == 2 then return 2 end
+        end
+    end
+    return 1
+end
+
+--------------------------------------------------------------------------------------------------
+
 local function getScatterplotData(player, GraphWidth, GraphHeight)
     local pn = ToEnumShortString(player)
     local mods = SL[pn].ActiveModifiers
@@ -587,15 +910,20 @@ local function SongResultData(player, APIKey, style, gameMode)
 
 
     local scatterplotData, worst_window = getScatterplotData(player, 1000, 200)
-    local scatterplotDataJson = encode(scatterplotData)
-
     local lifebarInfo = GetLifebarData(player, 1000, 200)
-    local lifebarInfoJson = encode(lifebarInfo)
+
+    local pointsJson
+    if wireFormat == 2 then
+        pointsJson = string.format('"format": 2, "scatter": %s, "lifebar": %s',
+            columnarPoints(scatterplotData, true), columnarPoints(lifebarInfo, false))
+    else
+        pointsJson = string.format('"scatterplotData": %s, "lifebarInfo": %s', encode(scatterplotData), encode(lifebarInfo))
+    end
 
 
     -- Prepare JSON data
     local jsonData = string.format(
-        '{"api_key": "%s","songName": "%s","artist": "%s","pack": "%s","length": "%s","stepartist": "%s","difficulty": "%s", "description": "%s", "itgScore": "%s","exScore": "%s","grade": "%s", "hash": "%s", "scatterplotData": %s, "lifebarInfo": %s, "worstWindow": %s, "style": "%s", "mods": "%s", "radar": %s, "gameMode": "%s", "version": "%s"}',
+        '{"api_key": "%s","songName": "%s","artist": "%s","pack": "%s","length": "%s","stepartist": "%s","difficulty": "%s", "description": "%s", "itgScore": "%s","exScore": "%s","grade": "%s", "hash": "%s", %s, "worstWindow": %s, "style": "%s", "mods": "%s", "radar": %s, "gameMode": "%s", "version": "%s"}',
         APIKey,
         songInfo.name,
         songInfo.artist,
@@ -608,8 +936,7 @@ local function SongResultData(player, APIKey, style, gameMode)
         resultInfo.exscore,
         resultInfo.grade,
         songInfo.hash,
-        scatterplotDataJson,
-        lifebarInfoJson,
+        pointsJson,
         ("%.4f"):format(worst_window),
         style,
         songInfo.modifiers,
@@ -669,12 +996,17 @@ local function CourseResultData(player, APIKey, style, gameMode)
 
 
     local lifebarInfo = GetLifebarData(player, 1000, 200) --table
-    local lifebarInfoJson = encode(lifebarInfo)           --string
+    local lifebarInfoJson                                 --string
+    if wireFormat == 2 then
+        lifebarInfoJson = '"format": 2, "lifebar": ' .. columnarPoints(lifebarInfo, false)
+    else
+        lifebarInfoJson = '"lifebarInfo": ' .. encode(lifebarInfo)
+    end
 
 
     -- Prepare JSON data
     local jsonData = string.format(
-        '{"api_key": "%s", "courseName": "%s", "pack": "%s", "entries": %s, "hash": "%s", "scripter": "%s", "difficulty": "%s", "description": "%s", "itgScore": "%s", "exScore": "%s", "grade": "%s", "lifebarInfo": %s, "style": "%s", "mods": "%s", "radar": %s, "gameMode": "%s", "version": "%s"}',
+        '{"api_key": "%s", "courseName": "%s", "pack": "%s", "entries": %s, "hash": "%s", "scripter": "%s", "difficulty": "%s", "description": "%s", "itgScore": "%s", "exScore": "%s", "grade": "%s", %s, "style": "%s", "mods": "%s", "radar": %s, "gameMode": "%s", "version": "%s"}',
         APIKey,
         courseInfo.name,
         courseInfo.pack,
@@ -758,7 +1090,7 @@ u["ScreenEvaluationStage"] = Def.ActorFrame {
                     label:settext("❌ DiscordLeaderboard: Submission Failed.")
                     errLabel:settext("Error: " .. tostring(code) .. ". Response: " .. tostring(body))
                 end
-            end)
+            end, self)
         end
     end,
     LoadFont("Common Normal") .. {
@@ -867,7 +1199,7 @@ u["ScreenEvaluationNonstop"] = Def.ActorFrame {
                     label:settext("❌ DiscordLeaderboard: Submission Failed.")
                     errLabel:settext("Error: " .. tostring(code) .. ". Response: " .. tostring(body))
                 end
-             end)
+            end, self)
         end
     end,
     LoadFont("Common Normal") .. {
@@ -944,6 +1276,7 @@ u["ScreenTitleMenu"] = Def.ActorFrame {
 
                 local decoded = JsonDecode((response and response.body) or "")
                 local versionReceived = decoded and decoded.status or nil
+                wireFormat = negotiateFormat(decoded)
 
                 if versionReceived ~= version then
                     ok = false
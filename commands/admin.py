@@ -1,11 +1,26 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import sqlite3
 
 from utility.library import extract_data_from_row, extract_course_data_from_row
 from utility.embeds import embedded_score
-from utility.config import database
+from utility.database import db
+from utility.payloads import fetch_payload
+from utility.schema import listing_columns
+from utility.search import search_filter
+from utility import metrics
+
+
+def toggle_results_channel(conn, server_id, channel_id):
+    """Set or unset a results channel. Returns True if it was set before."""
+    c = conn.cursor()
+    c.execute('SELECT 1 FROM CHANNELS WHERE serverID = ? AND channelID = ?', (server_id, channel_id))
+    channel_was_set = c.fetchone() is not None
+    if channel_was_set:
+        c.execute('DELETE FROM CHANNELS WHERE serverID = ? AND channelID = ?', (server_id, channel_id))
+    else:
+        c.execute('INSERT INTO CHANNELS (serverID, channelID) VALUES (?, ?)', (server_id, channel_id))
+    return channel_was_set
 
 
 class AdminCog(commands.Cog):
@@ -26,8 +41,10 @@ class AdminCog(commands.Cog):
     `/enable - Enables submitting scores.`
     `/score - Recall score result from database.`
     `/breakdown - More in depth breakdown of a score.`
+    `/progress - Shows how your EX score on a chart improved over time.`
     `/compare - Compare two users' scores.`
     `/usethischannel - (Un)Sets the current channel as the results channel. You may use it in multiple channels. (Admin only).`
+    `/stats - Shows internal bot statistics. (Admin only).`
     """
         await Interaction.response.send_message(message, ephemeral=True)
 
@@ -46,17 +63,11 @@ class AdminCog(commands.Cog):
         channel_id = str(Interaction.channel.id)
 
         try:
-            conn = sqlite3.connect(database)
-            c = conn.cursor()
-            c.execute('SELECT 1 FROM CHANNELS WHERE serverID = ? AND channelID = ?', (server_id, channel_id))
-            if c.fetchone():
-                c.execute('DELETE FROM CHANNELS WHERE serverID = ? AND channelID = ?', (server_id, channel_id))
+            channel_was_set = await db.write(toggle_results_channel, server_id, channel_id)
+            if channel_was_set:
                 await Interaction.response.send_message(f'This channel has been unset as the results channel.', ephemeral=True)
             else:
-                c.execute('INSERT INTO CHANNELS (serverID, channelID) VALUES (?, ?)', (server_id, channel_id))
                 await Interaction.response.send_message(f'This channel has been set as the results channel.', ephemeral=True)
-            conn.commit()
-            conn.close()
         except Exception as e:
             await Interaction.response.send_message(f"An error occurred: {e}")
 
@@ -67,6 +78,20 @@ class AdminCog(commands.Cog):
         else:
             await Interaction.response.send_message("An error occurred while trying to run this command.", ephemeral=True)
 
+    #================================================================================================
+    # ADMIN COMMAND: Internal statistics
+    #================================================================================================
+
+    @app_commands.command(name="stats", description="Shows internal bot statistics. (Admin only)")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def stats(self, Interaction: discord.Interaction):
+        embed = discord.Embed(title="Bot Statistics", color=discord.Color.dark_grey())
+        # Some metrics query their tables, collect them off the event loop
+        for name, values in (await db.run(metrics.snapshot)).items():
+            value = "\n".join(f"{key}: {val}" for key, val in values.items())
+            embed.add_field(name=name, value=f"```{value}```" if value else "-", inline=False)
+        await Interaction.response.send_message(embed=embed, ephemeral=True)
+
     #================================================================================================
     # ADMIN COMMAND: Delete score
     #================================================================================================
@@ -88,14 +113,10 @@ class AdminCog(commands.Cog):
         if ispump:
             tableType += '_PUMP'
 
-        query = 'SELECT * FROM ' + tableType + ' WHERE 1=1'
+        query = 'SELECT ' + listing_columns(tableType) + ' FROM ' + tableType + ' WHERE 1=1'
 
         params = []
 
-        name_column = "courseName" if iscourse else "songName"
-        if song:
-            query += f" AND {name_column} LIKE ?"
-            params.append(f"%{song}%")
         if user:
             query += " AND userID = ?"
             params.append(str(user.id))
@@ -106,13 +127,11 @@ class AdminCog(commands.Cog):
         if difficulty:
             query += " AND difficulty = ?"
             params.append(str(difficulty))
-        if pack:
-            query += " AND pack LIKE ?"
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-        c.execute(query, params)
-        results = c.fetchall()
-        conn.close()
+        search_sql, search_params = search_filter(tableType, song, pack)
+        query += search_sql
+        params.extend(search_params)
+
+        results = await db.fetchall(query, params)
 
         if not results:
             await Interaction.response.send_message("No scores found matching the criteria.", ephemeral=True)
@@ -126,11 +145,11 @@ class AdminCog(commands.Cog):
             options = []
             for index, row in enumerate(results):
                 if iscourse:
-                    label = f"{row[1]} - {row[4]} [{row[5]}]"
-                    description = f" EX Score: {row[8]:.2f}%, Pack: {row[2]}"
+                    label = f"{row['courseName']} - {row['scripter']} [{row['difficulty']}]"
+                    description = f" EX Score: {row['exScore']:.2f}%, Pack: {row['pack']}"
                 else:
-                    label = f"{row[1]} - {row[2]} [{row[4]}]"
-                    description = f" EX Score: {row[6]:.2f}%, Pack: {row[3]}"
+                    label = f"{row['songName']} - {row['artist']} [{row['difficulty']}]"
+                    description = f" EX Score: {row['exScore']:.2f}%, Pack: {row['pack']}"
                 options.append(discord.SelectOption(label=label, description=description, value=str(index)))
 
             class DeleteScoreSelect(discord.ui.Select):
@@ -141,10 +160,9 @@ class AdminCog(commands.Cog):
                     selected_index = int(self.values[0])
                     selected_row = results[selected_index]
                     if iscourse:
-                        data = extract_course_data_from_row(selected_row)
+                        data = extract_course_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
                     else:
-                        data = extract_data_from_row(selected_row)
-                    hash_index = 10
+                        data = extract_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
 
                     embed, file = embedded_score(data, str(user.id), "Selected Score to Delete", discord.Color.red())
 
@@ -153,12 +171,7 @@ class AdminCog(commands.Cog):
                             super().__init__(label="Delete", style=discord.ButtonStyle.danger)
 
                         async def callback(self, button_interaction: discord.Interaction):
-                            conn = sqlite3.connect(database)
-                            c = conn.cursor()
-                            c.execute(f"DELETE FROM {tableType} WHERE hash = ? AND userID = ?", (selected_row[hash_index], str(user.id)))
-                            deleted_rows = c.rowcount
-                            conn.commit()
-                            conn.close()
+                            deleted_rows = await db.execute(f"DELETE FROM {tableType} WHERE hash = ? AND userID = ?", (selected_row['hash'], str(user.id)))
                             if deleted_rows > 0:
                                 await button_interaction.response.send_message(f"Successfully deleted the selected score.", ephemeral=True)
                             else:
@@ -183,11 +196,9 @@ class AdminCog(commands.Cog):
         else:
             selected_row = results[0]
             if iscourse:
-                data = extract_course_data_from_row(selected_row)
-                hash_index = 10
+                data = extract_course_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
             else:
-                data = extract_data_from_row(selected_row)
-                hash_index = 10
+                data = extract_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
             embed, file = embedded_score(data, str(user.id), "Selected Score to Delete", discord.Color.red())
 
             class ConfirmDeleteButton(discord.ui.Button):
@@ -195,12 +206,7 @@ class AdminCog(commands.Cog):
                     super().__init__(label="Delete", style=discord.ButtonStyle.danger)
 
                 async def callback(self, button_interaction: discord.Interaction):
-                    conn = sqlite3.connect(database)
-                    c = conn.cursor()
-                    c.execute(f"DELETE FROM {tableType} WHERE hash = ? AND userID = ?", (selected_row[hash_index], str(user.id)))
-                    deleted_rows = c.rowcount
-                    conn.commit()
-                    conn.close()
+                    deleted_rows = await db.execute(f"DELETE FROM {tableType} WHERE hash = ? AND userID = ?", (selected_row['hash'], str(user.id)))
                     if deleted_rows > 0:
                         await button_interaction.response.send_message(f"Successfully deleted the selected score.", ephemeral=True)
                     else:
@@ -1,7 +1,6 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import sqlite3
 import secrets
 import os
 import io
@@ -10,7 +9,8 @@ import zipfile
 from datetime import datetime, timedelta
 from pathlib import Path
 
-from utility.config import database
+from utility.database import db
+from utility.accounts import accounts
 from utility.version import APP_VERSION
 from utility.library import extract_domain
 
@@ -93,22 +93,30 @@ def file_pack(api_key: str, bot_url: str) -> discord.File:
 def generate_and_store_api_key(user_id):
     while True:
         api_key = secrets.token_urlsafe(20)[:20]
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-        c.execute('SELECT 1 FROM USERS WHERE APIKey = ?', (api_key,))
-        if not c.fetchone():
-            conn.close()
-            break
-        conn.close()
+        with db.reader() as conn:
+            c = conn.cursor()
+            c.execute('SELECT 1 FROM USERS WHERE APIKey = ?', (api_key,))
+            if not c.fetchone():
+                break
 
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-    c.execute('INSERT OR REPLACE INTO USERS (DiscordUser, APIKey) VALUES (?, ?)', (user_id, api_key))
-    conn.commit()
-    conn.close()
+    with db.writer() as conn:
+        c = conn.cursor()
+        c.execute('INSERT OR REPLACE INTO USERS (DiscordUser, APIKey) VALUES (?, ?)', (user_id, api_key))
+    accounts.set_key(user_id, api_key)
 
     return api_key
-    
+
+
+def toggle_update_notifications(conn, user_id):
+    """Flip the update notification setting. Returns the new setting, None if the user is not registered."""
+    c = conn.cursor()
+    c.execute('SELECT updateNotification FROM USERS WHERE DiscordUser = ?', (user_id,))
+    row = c.fetchone()
+    if not row:
+        return None
+    new_setting = not row[0]
+    c.execute('UPDATE USERS SET updateNotification = ? WHERE DiscordUser = ?', (new_setting, user_id))
+    return new_setting
 
 
 class APIKeysCog(commands.Cog):
@@ -134,24 +142,20 @@ class APIKeysCog(commands.Cog):
         user_id = str(Interaction.user.id)
         
         if reset_key:
-            api_key = generate_and_store_api_key(user_id)
+            api_key = await db.run(generate_and_store_api_key, user_id)
             pack_file = file_pack(api_key, bot_url)
             await Interaction.response.send_message('Your API Key has been reset. Check your DM for the files and instructions.', ephemeral=True)
 
             await Interaction.user.send(registration_message + f"\nYour new API Key: `{api_key}`", file=pack_file)
 
         else:
-            conn = sqlite3.connect(database)
-            c = conn.cursor()
-            c.execute('SELECT APIKey FROM USERS WHERE DiscordUser = ?', (user_id,))
-            row = c.fetchone()
-            conn.close()
+            row = await db.fetchone('SELECT APIKey FROM USERS WHERE DiscordUser = ?', (user_id,))
 
             if row and row[0]:
                 await Interaction.response.send_message('You are already registered. Use the command with reset_key = True to reset your API Key.', ephemeral=True)
                 return
 
-            api_key = generate_and_store_api_key(user_id)
+            api_key = await db.run(generate_and_store_api_key, user_id)
             pack_file = file_pack(api_key, bot_url)
 
             await Interaction.user.send(registration_message + f"\nYour API Key: `{api_key}`", file=pack_file)
@@ -170,11 +174,7 @@ class APIKeysCog(commands.Cog):
 
         user_id = str(Interaction.user.id)
 
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-        c.execute('SELECT APIKey FROM USERS WHERE DiscordUser = ?', (user_id,))
-        row = c.fetchone()
-        conn.close()
+        row = await db.fetchone('SELECT APIKey FROM USERS WHERE DiscordUser = ?', (user_id,))
 
         if not row or not row[0]:
             await Interaction.response.send_message('You are not registered yet. Use the /register command first.', ephemeral=True)
@@ -213,11 +213,8 @@ class APIKeysCog(commands.Cog):
             disabled_until = current_time + timedelta(minutes=mins, hours=hours, days=days)
             disabled_until = disabled_until.strftime(os.getenv('DATE_FORMAT'))
 
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-        c.execute('UPDATE USERS SET submitDisabled = ? WHERE DiscordUser = ?', (disabled_until, user_id))
-        conn.commit()
-        conn.close()
+        await db.execute('UPDATE USERS SET submitDisabled = ? WHERE DiscordUser = ?', (disabled_until, user_id))
+        accounts.set_submit_disabled(user_id, disabled_until)
 
         await interaction.response.send_message(f"Submitting scores has been disabled until {disabled_until}", ephemeral=True)
 
@@ -233,11 +230,8 @@ class APIKeysCog(commands.Cog):
 
         user_id = str(interaction.user.id)
 
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-        c.execute('UPDATE USERS SET submitDisabled = ? WHERE DiscordUser = ?', ('enabled', user_id))
-        conn.commit()
-        conn.close()
+        await db.execute('UPDATE USERS SET submitDisabled = ? WHERE DiscordUser = ?', ('enabled', user_id))
+        accounts.set_submit_disabled(user_id, 'enabled')
 
         await interaction.response.send_message("Submitting scores has been enabled.", ephemeral=True)
 
@@ -253,22 +247,12 @@ class APIKeysCog(commands.Cog):
 
         user_id = str(interaction.user.id)
 
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-        c.execute('SELECT updateNotification FROM USERS WHERE DiscordUser = ?', (user_id,))
-        row = c.fetchone()
+        new_setting = await db.write(toggle_update_notifications, user_id)
 
-        if not row:
+        if new_setting is None:
             await interaction.response.send_message('You are not registered yet. Use the /register command first.', ephemeral=True)
             return
 
-        current_setting = row[0]
-        new_setting = not current_setting
-
-        c.execute('UPDATE USERS SET updateNotification = ? WHERE DiscordUser = ?', (new_setting, user_id))
-        conn.commit()
-        conn.close()
-
         status = "enabled" if new_setting else "disabled"
         await interaction.response.send_message(f"Update notifications have been {status}.", ephemeral=True)
 
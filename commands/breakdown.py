@@ -2,11 +2,13 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 from discord.ui import View
-import sqlite3
 
 from utility.library import extract_data_from_row, extract_course_data_from_row
 from utility.embeds import embedded_breakdown
-from utility.config import database
+from utility.database import db
+from utility.payloads import fetch_payload
+from utility.schema import listing_columns
+from utility.search import search_filter
 
 
 class ScoreButton(discord.ui.Button):
@@ -74,14 +76,10 @@ class BreakdownCog(commands.Cog):
         if ispump:
             tableType += '_PUMP'
 
-        query = 'SELECT * FROM ' + tableType + ' WHERE 1=1'
+        query = 'SELECT ' + listing_columns(tableType) + ' FROM ' + tableType + ' WHERE 1=1'
 
         params = []
 
-        name_column = "courseName" if iscourse else "songName"
-        if song:
-            query += f" AND {name_column} LIKE ?"
-            params.append(f"%{song}%")
         if user:
             query += " AND userID = ?"
             params.append(str(user.id))
@@ -92,15 +90,11 @@ class BreakdownCog(commands.Cog):
         if difficulty:
             query += " AND difficulty = ?"
             params.append(str(difficulty))
-        if pack:
-            query += " AND pack LIKE ?"
-            params.append(f"%{pack}%")
+        search_sql, search_params = search_filter(tableType, song, pack)
+        query += search_sql
+        params.extend(search_params)
 
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-        c.execute(query, params)
-        results = c.fetchall()
-        conn.close()
+        results = await db.fetchall(query, params)
 
         if not results:
             await interaction.response.send_message("No scores found matching the criteria.", ephemeral=private)
@@ -111,10 +105,11 @@ class BreakdownCog(commands.Cog):
                 await interaction.response.send_message("Too many results to pick from. Please be more specific.", ephemeral=True)
                 return
 
+            # Course options use the same label as /course and /deletescore
             options = [
                 discord.SelectOption(
-                    label=f"{row[1]} - {row[2]} [{row[4]}]",
-                    description=f" EX Score: {row[6]:.2f}%, Pack: {row[3]}",
+                    label=f"{row['courseName']} - {row['scripter']} [{row['difficulty']}]" if iscourse else f"{row['songName']} - {row['artist']} [{row['difficulty']}]",
+                    description=f" EX Score: {row['exScore']:.2f}%, Pack: {row['pack']}",
                     value=str(index)
                 )
                 for index, row in enumerate(results)
@@ -130,10 +125,10 @@ class BreakdownCog(commands.Cog):
                     selected_index = int(self.values[0])
                     selected_row = results[selected_index]
                     if iscourse:
-                        data = extract_course_data_from_row(selected_row)
+                        data = extract_course_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
                         data['isCourse'] = iscourse
                     else:
-                        data = extract_data_from_row(selected_row)
+                        data = extract_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
                     data['gameMode'] = 'pump' if ispump else 'itg'
                     embed, file = embedded_breakdown(data, str(user.id), "Selected Score", discord.Color.red() if failed else discord.Color.dark_grey())
 
@@ -150,10 +145,10 @@ class BreakdownCog(commands.Cog):
 
             selected_row = results[0]
             if iscourse:
-                data = extract_course_data_from_row(selected_row)
+                data = extract_course_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
                 data['isCourse'] = iscourse
             else:
-                data = extract_data_from_row(selected_row)
+                data = extract_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
             data['gameMode'] = 'pump' if ispump else 'itg'
             embed, file = embedded_breakdown(data, str(user.id), "Selected Score", discord.Color.red() if failed else discord.Color.dark_grey())
             view = View()
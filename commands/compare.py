@@ -1,9 +1,9 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import sqlite3
 
-from utility.config import database
+from utility.database import db
+from utility.search import search_filter
 
 
 async def compare_logic(interaction: discord.Interaction, page: int, order, private, results, user_one_id, user_two_id):
@@ -77,9 +77,6 @@ class CompareCog(commands.Cog):
         user_one_id = str(user_one.id)
         user_two_id = str(user_two.id)
 
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-
         if order == "asc_ex":
             order_by = "s1.exScore ASC"
         elif order == "desc_ex":
@@ -113,18 +110,14 @@ class CompareCog(commands.Cog):
         if difficulty:
             query += " AND s1.difficulty = ? AND s2.difficulty = ?"
             params.extend([str(difficulty), str(difficulty)])
-        if pack:
-            query += " AND s1.pack LIKE ? AND s2.pack LIKE ?"
-            params.extend([f"%{pack}%", f"%{pack}%"])
-        if song_name:
-            query += " AND s1.songName LIKE ? AND s2.songName LIKE ?"
-            params.extend([f"%{song_name}%", f"%{song_name}%"])
+        # Both scores are for the same hash, so filtering one side by name/pack is enough
+        search_sql, search_params = search_filter(tableType, song_name, pack, alias='s1')
+        query += search_sql
+        params.extend(search_params)
 
         query += f" ORDER BY {order_by}"
 
-        c.execute(query, params)
-        common_scores = c.fetchall()
-        conn.close()
+        common_scores = await db.fetchall(query, params)
 
         if not common_scores:
             await interaction.response.send_message("No common scores found between the two users.", ephemeral=private)
@@ -0,0 +1,104 @@
+import asyncio
+
+import discord
+from discord.ext import commands
+from discord import app_commands
+
+from utility.database import db
+from utility.history import fetch_progress
+from utility.plot import build_plot_attachment, create_progress_plot
+from utility.schema import listing_columns
+from utility.search import search_filter
+
+
+async def send_progress(interaction: discord.Interaction, row, user: discord.User, tableType: str, private: bool):
+    plays = await db.run(fetch_progress, str(user.id), tableType, row['hash'])
+    if not plays:
+        await interaction.followup.send("No play history recorded for this chart yet.", ephemeral=private)
+        return
+
+    # Plotting is CPU bound, keep it off the event loop
+    file = await asyncio.to_thread(build_plot_attachment, create_progress_plot, 'progress.png', plays)
+
+    passes = [ex_score for _, ex_score, failed in plays if not failed]
+    embed = discord.Embed(title=f"{row['songName']} [{row['difficulty']}]", description=f"{row['artist']}\n{row['pack']}", color=discord.Color.dark_grey())
+    embed.add_field(name="Player", value=f"<@!{user.id}>", inline=True)
+    embed.add_field(name="Plays", value=f"{len(plays)} ({len(plays) - len(passes)} failed)", inline=True)
+    if passes:
+        embed.add_field(name="First / Best", value=f"{passes[0]:.2f}% / {max(passes):.2f}%", inline=True)
+    embed.set_image(url="attachment://progress.png")
+
+    await interaction.followup.send(embed=embed, file=file, ephemeral=private, allowed_mentions=discord.AllowedMentions.none())
+
+
+class ProgressCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    #================================================================================================
+    # EX score progression on a chart
+    #================================================================================================
+
+    @app_commands.command(name="progress", description="Show how your EX score on a chart improved over time.")
+    async def progress(self, interaction: discord.Interaction, song: str, isdouble: bool = False, ispump: bool = False, user: discord.User = None, difficulty: int = 0, pack: str = "", private: bool = False):
+        if interaction.guild is None:
+            await interaction.response.send_message("This command can only be used in a server.")
+            return
+
+        tableType = ''
+        if isdouble:
+            tableType += 'DOUBLES'
+        else:
+            tableType += 'SINGLES'
+        if ispump:
+            tableType += '_PUMP'
+
+        if user is None:
+            user = interaction.user
+
+        query = 'SELECT ' + listing_columns(tableType) + ' FROM ' + tableType + ' WHERE userID = ?'
+        params = [str(user.id)]
+        if difficulty:
+            query += " AND difficulty = ?"
+            params.append(str(difficulty))
+        search_sql, search_params = search_filter(tableType, song, pack)
+        query += search_sql
+        params.extend(search_params)
+
+        results = await db.fetchall(query, params)
+
+        if not results:
+            await interaction.response.send_message("No scores found matching the criteria.", ephemeral=private)
+            return
+
+        if len(results) > 1:
+            if len(results) > 25:
+                await interaction.response.send_message("Too many results to pick from. Please be more specific.", ephemeral=True)
+                return
+            options = [
+                discord.SelectOption(
+                    label=f"{row['songName']} - {row['artist']} [{row['difficulty']}]",
+                    description=f" EX Score: {row['exScore']:.2f}%, Pack: {row['pack']}",
+                    value=str(index)
+                )
+                for index, row in enumerate(results)
+            ]
+
+            class ProgressSelect(discord.ui.Select):
+                def __init__(self):
+                    super().__init__(placeholder="Choose a chart...", options=options)
+
+                async def callback(self, interaction: discord.Interaction):
+                    await interaction.response.defer(ephemeral=private)
+                    await send_progress(interaction, results[int(self.values[0])], user, tableType, private)
+
+            view = discord.ui.View()
+            view.add_item(ProgressSelect())
+            await interaction.response.send_message("Multiple charts found. Please select one:", view=view, ephemeral=True)
+        else:
+            await interaction.response.defer(ephemeral=private)
+            await send_progress(interaction, results[0], user, tableType, private)
+
+
+async def setup(bot):
+    await bot.add_cog(ProgressCog(bot))
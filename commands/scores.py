@@ -2,11 +2,13 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 from discord.ui import View
-import sqlite3
 
 from utility.library import extract_data_from_row, extract_course_data_from_row
 from utility.embeds import embedded_score, get_top_scores
-from utility.config import database
+from utility.database import db
+from utility.payloads import fetch_payload
+from utility.schema import listing_columns
+from utility.search import search_filter
 
 
 class BreakdownButton(discord.ui.Button):
@@ -72,13 +74,10 @@ class ScoresCog(commands.Cog):
         if ispump:
             tableType += '_PUMP'
 
-        query = 'SELECT * FROM ' + tableType + ' WHERE 1=1'
+        query = 'SELECT ' + listing_columns(tableType) + ' FROM ' + tableType + ' WHERE 1=1'
 
         params = []
 
-        if song:
-            query += " AND songName LIKE ?"
-            params.append(f"%{song}%")
         if user:
             query += " AND userID = ?"
             params.append(str(user.id))
@@ -89,15 +88,11 @@ class ScoresCog(commands.Cog):
         if difficulty:
             query += " AND difficulty = ?"
             params.append(str(difficulty))
-        if pack:
-            query += " AND pack LIKE ?"
-            params.append(f"%{pack}%")
+        search_sql, search_params = search_filter(tableType, song, pack)
+        query += search_sql
+        params.extend(search_params)
 
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-        c.execute(query, params)
-        results = c.fetchall()
-        conn.close()
+        results = await db.fetchall(query, params)
 
         if not results:
             await interaction.response.send_message("No scores found matching the criteria.", ephemeral=private)
@@ -109,8 +104,8 @@ class ScoresCog(commands.Cog):
                 return
             options = [
                 discord.SelectOption(
-                    label=f"{row[1]} - {row[2]} [{row[4]}]",
-                    description=f" EX Score: {row[6]:.2f}%, Pack: {row[3]}",
+                    label=f"{row['songName']} - {row['artist']} [{row['difficulty']}]",
+                    description=f" EX Score: {row['exScore']:.2f}%, Pack: {row['pack']}",
                     value=str(index)
                 )
                 for index, row in enumerate(results)
@@ -125,14 +120,14 @@ class ScoresCog(commands.Cog):
 
                     selected_index = int(self.values[0])
                     selected_row = results[selected_index]
-                    data = extract_data_from_row(selected_row)
+                    data = extract_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
 
                     if isdouble:
                         data['style'] = 'double'
                     data['gameMode'] = 'pump' if ispump else 'itg'
 
                     embed, file = embedded_score(data, str(user.id), "Selected Score", discord.Color.red() if failed else discord.Color.dark_grey())
-                    top_scores_message = get_top_scores(selected_row, interaction, 3, tableType)
+                    top_scores_message = await get_top_scores(selected_row, interaction, 3, tableType)
                     embed.add_field(name="Top Server Scores", value=top_scores_message, inline=False)
 
                     view = View()
@@ -147,13 +142,13 @@ class ScoresCog(commands.Cog):
             await interaction.response.defer(ephemeral=private)
 
             selected_row = results[0]
-            data = extract_data_from_row(selected_row)
+            data = extract_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
 
             if isdouble:
                 data['style'] = 'double'
             embed, file = embedded_score(data, str(user.id), "Selected Score", discord.Color.red() if failed else discord.Color.dark_grey())
 
-            top_scores_message = get_top_scores(selected_row, interaction, 3, tableType)
+            top_scores_message = await get_top_scores(selected_row, interaction, 3, tableType)
             embed.add_field(name="Top Server Scores", value=top_scores_message, inline=False)
 
             view = View()
@@ -179,13 +174,10 @@ class ScoresCog(commands.Cog):
         if failed:
             tableType += 'FAILS'
 
-        query = 'SELECT * FROM ' + tableType + ' WHERE 1=1'
+        query = 'SELECT ' + listing_columns(tableType) + ' FROM ' + tableType + ' WHERE 1=1'
 
         params = []
 
-        if name:
-            query += " AND courseName LIKE ?"
-            params.append(f"%{name}%")
         if user:
             query += " AND userID = ?"
             params.append(str(user.id))
@@ -196,15 +188,11 @@ class ScoresCog(commands.Cog):
         if difficulty:
             query += " AND difficulty = ?"
             params.append(str(difficulty))
-        if pack:
-            query += " AND pack LIKE ?"
-            params.append(f"%{pack}%")
+        search_sql, search_params = search_filter(tableType, name, pack)
+        query += search_sql
+        params.extend(search_params)
 
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-        c.execute(query, params)
-        results = c.fetchall()
-        conn.close()
+        results = await db.fetchall(query, params)
 
         if not results:
             await interaction.response.send_message("No scores found matching the criteria.", ephemeral=private)
@@ -215,10 +203,12 @@ class ScoresCog(commands.Cog):
                 await interaction.response.send_message("Too many results to pick from. Please be more specific.", ephemeral=True)
                 return
 
+            # Courses are labelled like in /deletescore (name - scripter [difficulty]). The song layout
+            # used before put pack and entries in the label and failed on the description column.
             options = [
                 discord.SelectOption(
-                    label=f"{row[1]} - {row[2]} [{row[4]}]",
-                    description=f" EX Score: {row[6]:.2f}%, Pack: {row[3]}",
+                    label=f"{row['courseName']} - {row['scripter']} [{row['difficulty']}]",
+                    description=f" EX Score: {row['exScore']:.2f}%, Pack: {row['pack']}",
                     value=str(index)
                 )
                 for index, row in enumerate(results)
@@ -231,13 +221,13 @@ class ScoresCog(commands.Cog):
                 async def callback(self, interaction: discord.Interaction):
                     selected_index = int(self.values[0])
                     selected_row = results[selected_index]
-                    data = extract_course_data_from_row(selected_row)
+                    data = extract_course_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
 
                     if isdouble:
                         data['style'] = 'double'
 
                     embed, file = embedded_score(data, str(user.id), "Selected Score", discord.Color.red() if failed else discord.Color.dark_grey())
-                    top_scores_message = get_top_scores(selected_row, interaction, 3, tableType)
+                    top_scores_message = await get_top_scores(selected_row, interaction, 3, tableType)
                     embed.add_field(name="Top Server Scores", value=top_scores_message, inline=False)
 
                     await interaction.response.send_message(content=None, embed=embed, file=file, ephemeral=private)
@@ -247,12 +237,12 @@ class ScoresCog(commands.Cog):
             await interaction.response.send_message("Multiple scores found. Please select one:", view=view, ephemeral=True)
         else:
             selected_row = results[0]
-            data = extract_course_data_from_row(selected_row)
+            data = extract_course_data_from_row(selected_row, await db.run(fetch_payload, tableType, selected_row['rowid']))
             if isdouble:
                 data['style'] = 'double'
             embed, file = embedded_score(data, str(user.id), "Selected Score", discord.Color.red() if failed else discord.Color.dark_grey())
 
-            top_scores_message = get_top_scores(selected_row, interaction, 3, tableType)
+            top_scores_message = await get_top_scores(selected_row, interaction, 3, tableType)
             embed.add_field(name="Top Server Scores", value=top_scores_message, inline=False)
 
             await interaction.response.send_message(content=None, embed=embed, file=file, ephemeral=private)
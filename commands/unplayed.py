@@ -1,9 +1,9 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import sqlite3
 
-from utility.config import database
+from utility.database import db
+from utility.search import search_filter
 
 
 async def unplayed_logic(interaction: discord.Interaction, page: int, order, private, results, user_two_id):
@@ -66,9 +66,6 @@ class UnplayedCog(commands.Cog):
             await interaction.response.send_message("This command can only be used in a server.")
             return
 
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-
         user_one_id = str(interaction.user.id)
         user_two_id = str(user_two.id) if user_two else None
 
@@ -96,9 +93,9 @@ class UnplayedCog(commands.Cog):
             if difficulty:
                 query += " AND s2.difficulty = ?"
                 params.append(str(difficulty))
-            if pack:
-                query += " AND s2.pack LIKE ?"
-                params.append(f"%{pack}%")
+            search_sql, search_params = search_filter(tableType, pack=pack, alias='s2')
+            query += search_sql
+            params.extend(search_params)
         else:
             query = ('SELECT DISTINCT s1.songName, s1.artist, s1.pack, s1.difficulty FROM ' + tableType +
                      ' s1 LEFT JOIN ' + tableType + ' s2 ON s1.hash = s2.hash AND s2.userID = ? WHERE s2.userID IS NULL AND s1.userID != ?')
@@ -106,15 +103,13 @@ class UnplayedCog(commands.Cog):
             if difficulty:
                 query += " AND s1.difficulty = ?"
                 params.append(str(difficulty))
-            if pack:
-                query += " AND s1.pack LIKE ?"
-                params.append(f"%{pack}%")
+            search_sql, search_params = search_filter(tableType, pack=pack, alias='s1')
+            query += search_sql
+            params.extend(search_params)
 
         query += f" ORDER BY {order_by}"
 
-        c.execute(query, params)
-        common_scores = c.fetchall()
-        conn.close()
+        common_scores = await db.fetchall(query, params)
 
         if not common_scores:
             await interaction.response.send_message("No unplayed scores were found based on the criteria.", ephemeral=private)
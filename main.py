@@ -1,11 +1,13 @@
 from datetime import datetime, timedelta
+from concurrent.futures import TimeoutError as FutureTimeout
 import discord
 from discord.ext import commands
-import sqlite3
 from flask import Flask, request, jsonify
 import threading
 import asyncio
+import hmac
 import os
+import signal
 import sys
 import logging
 import time
@@ -15,9 +17,27 @@ load_dotenv()
 from commands.api_keys import file_pack, registration_message
 from utility.library import *
 from utility.plot import *
-from utility.config import database
+from utility.database import db
+from utility.schema import (normal_schema, course_schema, tables_normal, tables_courses, ensure_indexes,
+                            song_submission_keys, course_submission_keys, submission_table)
+from utility.search import ensure_search_index
 from utility.embeds import embedded_score
+from utility.payloads import ensure_payload_table
+from utility.migrations import run_migrations
+from utility.submissions import save_score
+from utility.accounts import accounts
+from utility.guilds import (ensure_guild_members_table, add_member, remove_member, remove_guild, sync_guild,
+                            reconcile_guilds, guild_top_scores, announcement_channels)
+from utility.ingest import submission_writer, QueueFull
+from utility.server import ingest_server, BodyError
+from utility.backup import start_backup_scheduler
+from utility.history import ensure_history_table, record_play, start_history_retention
+from utility.judgements import compute_breakdown
+from utility.wire import SUPPORTED_FORMATS, FORMAT_COLUMNAR, decode_submission
+from utility.chunks import chunk_manager, ChunkError, start_chunk_cleanup
+from utility.backfill import run_backfill, UserLookup, MAX_RECORDS as BACKFILL_MAX_RECORDS
 from utility.version import APP_VERSION
+from utility.metrics import watch_event_loop
 
 
 version = APP_VERSION
@@ -65,6 +85,9 @@ intents.message_content = True  # Enable the message content intent
 # Sync commands on bot startup
 #================================================================================================
 
+use_flask = os.getenv('INGEST_SERVER', 'aiohttp').lower() == 'flask'
+
+
 class LeaderboardBot(commands.Bot):
     async def setup_hook(self):
         extensions = [
@@ -74,10 +97,26 @@ class LeaderboardBot(commands.Bot):
             'commands.compare',
             'commands.unplayed',
             'commands.breakdown',
+            'commands.progress',
         ]
         for ext in extensions:
             await self.load_extension(ext)
 
+        # Reports how long the loop gets blocked, see /stats
+        self.loop_watchdog = asyncio.create_task(watch_event_loop(logger=logger))
+
+        if not use_flask:
+            await ingest_server.start()
+        # docker stop sends SIGTERM, shut down cleanly so in-flight submissions are not lost
+        try:
+            self.loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+        except NotImplementedError:
+            pass
+
+    async def close(self):
+        await ingest_server.stop()
+        await super().close()
+
 client = LeaderboardBot(command_prefix='!', intents=intents)
 
 @client.event
@@ -89,8 +128,32 @@ async def on_ready():
     except Exception as e:
         print(f"An error occurred while syncing commands: {e}")
 
+    # Member lists are copied on the loop, the sync itself runs on the database threads
+    members_by_guild = {guild.id: [member.id for member in guild.members] for guild in client.guilds}
+    await db.run(reconcile_guilds, members_by_guild, logger)
     await send_update_notification()
 
+
+#================================================================================================
+# Keep GUILD_MEMBERS in sync
+#================================================================================================
+
+@client.event
+async def on_member_join(member):
+    await db.run(add_member, member.guild.id, member.id)
+
+@client.event
+async def on_member_remove(member):
+    await db.run(remove_member, member.guild.id, member.id)
+
+@client.event
+async def on_guild_join(guild):
+    await db.run(sync_guild, guild.id, [member.id for member in guild.members])
+
+@client.event
+async def on_guild_remove(guild):
+    await db.run(remove_guild, guild.id)
+
 #================================================================================================
 # Database
 #================================================================================================
@@ -98,119 +161,72 @@ async def on_ready():
 
 # Initialize database
 def init_db():
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
+    with db.writer() as conn:
+        c = conn.cursor()
 
-    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'CONFIG'")
-    config_table_exists = c.fetchone() is not None
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'CONFIG'")
+        config_table_exists = c.fetchone() is not None
 
-    c.execute('''CREATE TABLE IF NOT EXISTS CONFIG
-                    (version TEXT PRIMARY KEY,
-              updateNotificationSent BOOL DEFAULT 0)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS CONFIG
+                        (version TEXT PRIMARY KEY,
+                  updateNotificationSent BOOL DEFAULT 0)''')
 
-    if not config_table_exists:
-        c.execute('INSERT INTO CONFIG (version) VALUES (?)', (version,))
+        if not config_table_exists:
+            c.execute('INSERT INTO CONFIG (version) VALUES (?)', (version,))
 
-    c.execute('''CREATE TABLE IF NOT EXISTS USERS
-                 (DiscordUser TEXT PRIMARY KEY, APIKey TEXT, submitDisabled TEXT DEFAULT 'enabled', updateNotification BOOL DEFAULT 1)''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS CHANNELS
-                 (serverID TEXT, channelID TEXT, PRIMARY KEY (serverID, channelID))''')
-    
+        c.execute('''CREATE TABLE IF NOT EXISTS USERS
+                     (DiscordUser TEXT PRIMARY KEY, APIKey TEXT, submitDisabled TEXT DEFAULT 'enabled', updateNotification BOOL DEFAULT 1)''')
+        # Keys missing from the account cache are looked up by APIKey
+        c.execute('CREATE INDEX IF NOT EXISTS idx_USERS_APIKey ON USERS (APIKey)')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS CHANNELS
+                     (serverID TEXT, channelID TEXT, PRIMARY KEY (serverID, channelID))''')
 
-    normal_schema = '''
-                 (userID TEXT, songName TEXT, artist TEXT, pack TEXT, difficulty INTEGER,
-                  itgScore REAL, exScore REAL, grade TEXT, length TEXT, stepartist TEXT, hash TEXT,
-                  scatter JSON, life JSON, worstWindow TEXT, date TEXT, mods TEXT, description TEXT, prevBestEx REAL, radar JSON)
-                  '''
-    course_schema = '''
-                 (userID TEXT, courseName TEXT, pack TEXT, entries TEXT, scripter TEXT, difficulty INTEGER,
-                  description TEXT, itgScore REAL, exScore REAL, grade TEXT, hash TEXT,
-                  life JSON, date TEXT, mods TEXT, prevBestEx REAL, radar JSON)
-                  '''
-
-    tables_normal = [
-        'SINGLES', 'SINGLESFAILS', 'DOUBLES', 'DOUBLESFAILS',
-        'SINGLES_PUMP', 'SINGLESFAILS_PUMP', 'DOUBLES_PUMP', 'DOUBLESFAILS_PUMP'
-    ]
-    tables_courses = [
-        'COURSESSINGLES', 'COURSESSINGLESFAILS', 'COURSESDOUBLES', 'COURSESDOUBLESFAILS',
-        'COURSESSINGLES_PUMP', 'COURSESSINGLESFAILS_PUMP', 'COURSESDOUBLES_PUMP', 'COURSESDOUBLESFAILS_PUMP'
-    ]
 
-    for table in tables_normal:
-        c.execute(f'CREATE TABLE IF NOT EXISTS {table} {normal_schema}')
-    for table in tables_courses:
-        c.execute(f'CREATE TABLE IF NOT EXISTS {table} {course_schema}')
+        for table in tables_normal:
+            c.execute(f'CREATE TABLE IF NOT EXISTS {table} {normal_schema}')
+        for table in tables_courses:
+            c.execute(f'CREATE TABLE IF NOT EXISTS {table} {course_schema}')
 
+        ensure_indexes(conn, logger)
+        ensure_search_index(conn, logger)
+        ensure_payload_table(conn)
+        ensure_history_table(conn)
+        ensure_guild_members_table(conn)
 
-    conn.commit()
-    conn.close()
 
 init_db()
 
 
 #================================================================================================
-# Database cleanup tasks on startup
-# This stuff here is cleaning up shit from the previous version(s).
+# Database migrations on startup
+# This stuff here is cleaning up shit from the previous version(s), see utility/migrations.py.
 #================================================================================================
 
-# Remove unnecessary precision from scatterplot and lifebar data
-# Add updateNotification column to USERS table if it doesn't exist
-def update_140():
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
+# Heavy data migrations run in the background unless BACKGROUND_MIGRATIONS=false
+run_migrations(logger, background=os.getenv('BACKGROUND_MIGRATIONS', 'true').lower() != 'false')
 
-    c.execute(f"ALTER TABLE USERS ADD COLUMN updateNotification BOOL DEFAULT 1")
-    c.execute(f"ALTER TABLE CONFIG ADD COLUMN updateNotificationSent BOOL DEFAULT 0")
-    conn.commit()
-    
+# Set version in the database to match the current version of the bot. 
+# This is used to determine if future updates need to run any cleanup 
+# tasks and what order to apply them in.
+with db.writer() as conn:
+    c = conn.cursor()
     c.execute('SELECT version FROM CONFIG')
     row = c.fetchone()
-    
-    if not row:
-        from utility.squash_db_precision import backup_and_squash
-        c.execute('DELETE FROM CONFIG')
-        c.execute('INSERT INTO CONFIG (version, updateNotificationSent) VALUES (?, ?)', (version, 0))
-        conn.commit()
-        conn.close()
-        logger.info(f"Updating database version to {version}")
-        logger.info(f"Squashing and compacting database. This might take a while...")
-        backup_and_squash(database, logger, decimal_places=3, compact=True)
+    if row[0] != version:
+        c.execute('UPDATE CONFIG SET version = ?, updateNotificationSent = 0', (version,))
         logger.info(f"Database has been updated to version {version}")
-    conn.close()
-
-conn = sqlite3.connect(database)
-c = conn.cursor()
-c.execute('SELECT version FROM CONFIG')
-row = c.fetchone()
-if not row or row[0] is None:
-    update_140()
-
-# The Version is now set and if someone skipped an update,
-# they can update to the latest version straight up.
-# Thinking aloud, something like this?
-# while true:
-#   if version == "whatever":
-#       update_whatever()
-#   elif version == "whatever2":
-#       update_whatever2()
-#   else:
-#       break
 
-# Set version in the database to match the current version of the bot. 
-# This is used to determine if future updates need to run any cleanup 
-# tasks and what order to apply them in.
-conn = sqlite3.connect(database)
-c = conn.cursor()
-c.execute('SELECT version FROM CONFIG')
-row = c.fetchone()
-if row[0] != version:
-    c.execute('DELETE FROM CONFIG')
-    c.execute('INSERT INTO CONFIG (version, updateNotificationSent) VALUES (?, ?)', (version, 0))
-    conn.commit()
-    logger.info(f"Database has been updated to version {version}")
-conn.close()
+logger.info(f"Loaded {accounts.load()} API keys")
+
+
+def claim_update_notification(conn):
+    c = conn.cursor()
+
+    c.execute('UPDATE CONFIG SET updateNotificationSent = 1 WHERE version = ?', (version,))
+
+    c.execute("SELECT DiscordUser, APIKey FROM USERS WHERE APIKey IS NOT NULL AND APIKey != '' AND updateNotification = 1")
+    return c.fetchall()
 
 
 async def send_update_notification():
@@ -219,23 +235,10 @@ async def send_update_notification():
         logger.warning("Skipping update notifications because BOT_URL is not configured.")
         return
 
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
-    c.execute('SELECT updateNotificationSent FROM CONFIG')
-    notif_sent = c.fetchone()
-    conn.close()
+    notif_sent = await db.fetchone('SELECT updateNotificationSent FROM CONFIG')
 
     if notif_sent and not notif_sent[0]:
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-
-        c.execute('UPDATE CONFIG SET updateNotificationSent = 1 WHERE version = ?', (version,))
-        conn.commit()
-
-        c.execute("SELECT DiscordUser, APIKey FROM USERS WHERE APIKey IS NOT NULL AND APIKey != '' AND updateNotification = 1")
-        users_to_notify = c.fetchall()
-        conn.close()
+        users_to_notify = await db.write(claim_update_notification)
 
         for user_id, api_key in users_to_notify:
             try:
@@ -260,31 +263,66 @@ async def send_update_notification():
 #================================================================================================
 
 
-# Flask route to receive external data
-@app.route('/send', methods=['POST'])
-def send_message():
-    data = request.json
+# PB decision, payload, submission cooldown and the announcement data. Runs inside the batched
+# write transaction of the submission writer.
+def store_submission(conn, tableType, user_id, data, date, isPB, submit_disabled, expired):
+    c = conn.cursor()
+    existing_ex_score = 0
+    channel_results = []
+
+    saved = save_score(conn, tableType, user_id, data, date)
+    record_play(conn, tableType, user_id, data)
+    if saved is None:
+        isPB = False
+    else:
+        score_rowid, existing_ex_score, position = saved
+        logger.info(f"Stored score {score_rowid} in {tableType}, position {position} on the chart")
+
+    # The temporary disable of the user has run out
+    if expired:
+        c.execute('UPDATE USERS SET submitDisabled = ? WHERE DiscordUser = ?', ('enabled', user_id))
+
+    if isPB and submit_disabled == 'enabled':
+        channel_results = announcement_channels(conn, user_id)
+
+    return isPB, existing_ex_score, channel_results
 
+
+# Receive a score. Returns (response body, status, Discord announcement or None), the
+# announcement is a coroutine function to run on the bot loop. Shared by both HTTP servers.
+def process_submission(data):
     client_version = data.get('version')
     if not client_version or client_version != version:
-        return jsonify({'status': 'Incorrect version of Module used. Version needed: ' + version}), 400
+        return {'status': 'Incorrect version of Module used. Version needed: ' + version}, 400, None
 
     api_key = data.get('api_key')
 
     # Check if the request contains an API key
     if not api_key:
-        return jsonify({'status': 'Submission is missing API Key.'}), 402
+        return {'status': 'Submission is missing API Key.'}, 402, None
 
-    # Check if the API key exists in the database and fetch DiscordUser and submitDisabled
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-    c.execute('SELECT DiscordUser, submitDisabled FROM USERS WHERE APIKey = ?', (api_key,))
-    result = c.fetchone()
-    conn.close()
-    if not result:
-        return jsonify({'status': 'API Key has not been found in database.'}), 403
+    # Check if the API key exists and fetch DiscordUser and submitDisabled (cached, see utility/accounts.py)
+    account = accounts.lookup(api_key)
+    if not account:
+        return {'status': 'API Key has not been found in database.'}, 403, None
+
+    user_id, submit_disabled, disabled_until = account
+
+    # A temporary /disable that has run out is switched back on together with the score write
+    expired = disabled_until is not None and datetime.now() > disabled_until
+    if expired:
+        submit_disabled = 'enabled'
 
-    user_id, submit_disabled = result
+    # Format 2 sends the points as columns (see utility/wire.py), decode them into the usual fields
+    wire_format = data.get('format', 1)
+    if wire_format not in SUPPORTED_FORMATS:
+        return {'status': f'Unsupported submission format {wire_format}. Update module to the latest version.'}, 400, None
+    if wire_format == FORMAT_COLUMNAR:
+        try:
+            decode_submission(data)
+        except ValueError as e:
+            logger.error(f"Malformed format 2 submission: {e}")
+            return {'status': f'Submission has malformed point data: {e}'}, 400, None
 
     # Handle chunked data reconstruction
     if data.get('isChunked'):
@@ -302,26 +340,20 @@ def send_message():
         
         if error:
             logger.error(f"Chunk reconstruction failed: {error}")
-            return jsonify({'status': f'Chunk reconstruction failed: {error}'}), 400
+            return {'status': f'Chunk reconstruction failed: {error}'}, 400, None
         
         # Add reconstructed data to the main data object
         if scatter_data is not None:
             data['scatterplotData'] = scatter_data
-            logger.info(f"Reconstructed scatterplot data: {len(scatter_data)} points")
+            logger.info(f"Reconstructed scatterplot data: {len(scatter_data['x'])} points")
         
         if lifebar_data is not None:
             data['lifebarInfo'] = lifebar_data
-            logger.info(f"Reconstructed lifebar data: {len(lifebar_data)} points")
+            logger.info(f"Reconstructed lifebar data: {len(lifebar_data['x'])} points")
 
     # Check if the request contains all required data
-    required_keys_song = [
-        'songName', 'artist', 'pack', 'length', 'stepartist', 'difficulty', 'description',
-        'itgScore', 'exScore', 'grade', 'hash', 'worstWindow', 'style', 'mods', 'radar', 'gameMode'
-    ]
-    required_keys_course = [
-        'courseName', 'pack', 'entries', 'hash', 'scripter', 'itgScore', 'description',
-        'exScore', 'grade', 'style', 'mods', 'difficulty', 'radar', 'gameMode'
-    ]
+    required_keys_song = list(song_submission_keys)
+    required_keys_course = list(course_submission_keys)
     
     # For songs, also require scatterplotData and lifebarInfo (unless reconstructed from chunks)
     if data.get('songName'):
@@ -360,326 +392,119 @@ def send_message():
         # client.loop
         # )
         logger.error("Submission missing required data")
-        return jsonify({'status': 'Submission is missing data. Update module to the latest version.'}), 400
+        return {'status': 'Submission is missing data. Update module to the latest version.'}, 400, None
     
     # Limit valid submissions to ITL Online 2026 if the environment variable is set 
     pack_name = data.get('pack') or ''
     if os.getenv('ITL2026_ONLY', '').lower() == 'true' and 'itl online 2026' not in pack_name.lower():
         logger.info(f"Rejected non-ITL submission for pack: {pack_name}")
-        return jsonify({'status': 'Only ITL Online 2026 submissions are accepted.'}), 403
-
-    isPB = True
-    tableType = ''
+        return {'status': 'Only ITL Online 2026 submissions are accepted.'}, 403, None
 
-    if data.get('courseName'):
-        tableType += 'COURSES'
-    if data.get('style') == 'double':
-        tableType += 'DOUBLES'
-    else:
-        tableType += 'SINGLES'
-    if data.get('grade') == 'Grade_Failed':
-        tableType += 'FAILS'
-        isPB = False
-    
-    if data.get('gameMode') == 'pump':
-        tableType += '_PUMP'
+    tableType = submission_table(data)
+    isPB = 'FAILS' not in tableType
     
     # Reduce precision of scatter plot and lifebar data to 3 decimal places before storing
     data['scatterplotData'] = reduce_precision(data.get('scatterplotData'), 3)
     data['lifebarInfo'] = reduce_precision(data.get('lifebarInfo'), 3)
 
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
-    # Check if the entry is already present via the hash and user ID
-    fetchExisting = 'SELECT exScore FROM ' + tableType + ' WHERE hash = ? AND userID = ?'
+    # Judgement counts and timing stats for /breakdown, computed once here instead of on every recall
+    if not data.get('courseName'):
+        data['judgements'], data['timingStats'] = compute_breakdown(data.get('scatterplotData'), data.get('worstWindow'))
 
-    c.execute(fetchExisting, (data.get('hash'), user_id))
-    existing_entry = c.fetchone()
+    date = datetime.now().strftime(os.getenv('DATE_FORMAT'))
 
-    # Compare the ex score
-    existing_ex_score = float(existing_entry[0]) if existing_entry else 0
-    new_ex_score = float(data.get('exScore'))
-    
-    if existing_entry and new_ex_score > existing_ex_score:
-        if data.get('courseName'):
-            updateExisting = 'UPDATE ' + tableType + ' SET itgScore = ?, exScore = ?, grade = ?, life = ?, date = ?, mods = ?, prevBestEx = ?, radar = ? WHERE hash = ? AND userID = ?'
-            c.execute(updateExisting,
-                      (data.get('itgScore'), 
-                       new_ex_score,
-                       data.get('grade'), 
-                       str(data.get('lifebarInfo')), 
-                       datetime.now().strftime(os.getenv('DATE_FORMAT')),
-                       data.get('mods'),
-                       existing_ex_score,
-                       str(data.get('radar')),
-                       data.get('hash'),
-                       user_id))
-            conn.commit()
-
-        else:
-            updateExisting = 'UPDATE ' + tableType + ' SET itgScore = ?, exScore = ?, grade = ?, scatter = ?, life = ?, worstWindow = ?, date = ?, mods = ?, length = ?, prevBestEx = ?, radar = ? WHERE hash = ? AND userID = ?'
-            c.execute(updateExisting, 
-                      (data.get('itgScore'), 
-                       new_ex_score,
-                       data.get('grade'), 
-                       str(data.get('scatterplotData')), 
-                       str(data.get('lifebarInfo')), 
-                       data.get('worstWindow'), 
-                       datetime.now().strftime(os.getenv('DATE_FORMAT')),
-                       data.get('mods'),
-                       data.get('length'), # I was sending the wrong value lmao
-                       existing_ex_score,
-                       str(data.get('radar')),
-                       data.get('hash'),
-                       user_id))
-            conn.commit()
-
-
-    elif new_ex_score > existing_ex_score:
-        if data.get('courseName'):
-            insertNew = 'INSERT INTO ' + tableType + ' (userID, courseName, pack, entries, scripter, itgScore, exScore, grade, hash, life, date, mods, difficulty, description, prevBestEx, radar) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
-            c.execute(insertNew,
-                      (user_id, 
-                       data.get('courseName'), 
-                       data.get('pack'), 
-                       str(data.get('entries')), 
-                       data.get('scripter'), 
-                       data.get('itgScore'), 
-                       new_ex_score, 
-                       data.get('grade'), 
-                       data.get('hash'), 
-                       str(data.get('lifebarInfo')), 
-                       datetime.now().strftime(os.getenv('DATE_FORMAT')),
-                       data.get('mods'),
-                       data.get('difficulty'),
-                       data.get('description'),
-                       '0',
-                       str(data.get('radar'))
-                       ))
-                       
-            conn.commit()
-        else:
-            insertNew = 'INSERT INTO ' + tableType + ' (userID, songName, artist, pack, difficulty, itgScore, exScore, grade, length, stepartist, hash, scatter, life, worstWindow, date, mods, description, prevBestEx, radar) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
-            c.execute(insertNew,
-                      (user_id, 
-                       data.get('songName'), 
-                       data.get('artist'), 
-                       data.get('pack'), 
-                       data.get('difficulty'), 
-                       data.get('itgScore'), 
-                       new_ex_score, 
-                       data.get('grade'), 
-                       data.get('length'), 
-                       data.get('stepartist'), 
-                       data.get('hash'), 
-                       str(data.get('scatterplotData')), 
-                       str(data.get('lifebarInfo')), 
-                       data.get('worstWindow'), 
-                       datetime.now().strftime(os.getenv('DATE_FORMAT')),
-                       data.get('mods'),
-                       data.get('description'),
-                       '0',
-                       str(data.get('radar'))
-                       ))
-            
-            conn.commit()
-    else:
-        isPB = False
+    # The write runs on the submission writer thread, batched with other pending submissions
+    try:
+        future = submission_writer.submit(store_submission, tableType, user_id, data, date, isPB, submit_disabled, expired)
+    except QueueFull:
+        logger.warning("Submission queue is full, rejecting submission")
+        return {'status': 'Server is busy. Please try again in a moment.'}, 503, None
 
-    # Check if submit_disabled is a date and time and if it is past that time and date
-    if submit_disabled != 'enabled' and submit_disabled != 'disabled':
+    try:
         try:
-            disabled_until = datetime.strptime(submit_disabled, os.getenv('DATE_FORMAT'))
-            if datetime.now() > disabled_until:
-                submit_disabled = 'enabled'
-                conn = sqlite3.connect(database)
-                c = conn.cursor()
-                c.execute('UPDATE USERS SET submitDisabled = ? WHERE DiscordUser = ?', ('enabled', user_id))
-                conn.commit()
-        except ValueError:
-            pass
+            result = future.result(timeout=30)
+        except FutureTimeout:
+            # Not written yet: drop the job so a retry cannot store (and announce) the play twice.
+            # A job that is already running is part of the open transaction, wait for its commit.
+            if future.cancel():
+                logger.warning("Submission was not written within 30s, asking the client to retry")
+                return {'status': 'Server is busy. Please try again in a moment.'}, 503, None
+            result = future.result()
+        isPB, existing_ex_score, channel_results = result
+    except Exception as e:
+        logger.error(f"Storing submission failed: {e}")
+        return {'status': 'Submission could not be stored. Please try again.'}, 500, None
+
+    if expired:
+        accounts.set_submit_disabled(user_id, 'enabled')
 
     if isPB and submit_disabled == 'enabled':
+        posts = announcement_posts(tableType, user_id, data, date, existing_ex_score, channel_results)
+        if posts:
+            return {'status': 'Submission has been successfully inserted.'}, 200, post_announcements(posts)
 
-        data['date'] = datetime.now().strftime(os.getenv('DATE_FORMAT'))
-        data['prevBestEx'] = existing_ex_score
-        if data.get('courseName'):
-            color = discord.Color.purple()
-        elif data.get('style') == 'double':
-            color = discord.Color.blue()
-        else:
-            color = discord.Color.green()
-        
-        embed, file = embedded_score(data, user_id, "New (Server) Personal Best!", color)
+    return {'status': 'Submission has been successfully inserted.'}, 200, None
 
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-        
-        channel_results = []
-        for guild in client.guilds:
-            if guild.get_member(int(user_id)):
-
-                c.execute('SELECT channelID FROM CHANNELS WHERE serverID = ?', (str(guild.id),))
-                channel_results.extend([channel[0] for channel in c.fetchall()])
-
-        getTopScores = f'SELECT userID, exScore FROM {tableType} WHERE hash = ? ORDER BY exScore DESC'
-        c.execute(getTopScores, (data.get('hash'),))
-        top_scores = c.fetchall()
-
-
-        embed.add_field(name="Top Server Scores", value="", inline=False)
-        for channel_id in channel_results:
-            channel = client.get_channel(int(channel_id))
-
-            # Filter the top scores to include only members of the current guild
-            top_selected_scores = [(uid, ex_score) for uid, ex_score in top_scores if channel.guild.get_member(int(uid))][:3]
-
-            # Format the top 3 scores
-            top_scores_message = ""
-            for idx, (uid, ex_score) in enumerate(top_selected_scores, start=1):
-                top_scores_message += f"{idx}. <@!{uid}>, EX Score: {float(ex_score):.2f}%\n"
-            
-            embed.set_field_at(index=-1, name="Top Server Scores", value=top_scores_message, inline=False)
-            channel_file = clone_discord_file(file)
-            
-            asyncio.run_coroutine_threadsafe(
-                channel.send(embed=embed, file=channel_file, allowed_mentions=discord.AllowedMentions.none()), client.loop
-            )
-
-    conn.close()
-    return jsonify({'status': 'Submission has been successfully inserted.'}), 200
-
-# Global storage for pending chunks with threading support
-from collections import defaultdict
-
-class ChunkManager:
-    def __init__(self):
-        self.chunks = {}
-        self.lock = threading.RLock()
-        self.chunk_timestamps = {}
-        self.cleanup_interval = 300  # 5 minutes timeout
-        
-    def store_chunk(self, user_id, hash_key, chunk_type, chunk_index, chunk_data, total_chunks):
-        """Store a chunk with thread safety"""
-        composite_key = f"{user_id}:{hash_key}"
-        
-        with self.lock:
-            current_time = time.time()
-            
-            # Initialize storage for this user+hash combination
-            if composite_key not in self.chunks:
-                self.chunks[composite_key] = {
-                    'scatterplot': {},
-                    'lifebar': {},
-                    'total_chunks': {'scatterplot': 0, 'lifebar': 0}
-                }
-                self.chunk_timestamps[composite_key] = current_time
-            
-            # Update timestamp
-            self.chunk_timestamps[composite_key] = current_time
-            
-            # Store total chunks info
-            self.chunks[composite_key]['total_chunks'][chunk_type] = total_chunks
-            
-            # Store the chunk
-            self.chunks[composite_key][chunk_type][chunk_index] = chunk_data
-            
-            received_count = len(self.chunks[composite_key][chunk_type])
-            return received_count, total_chunks
-    
-    def get_and_remove_chunks(self, user_id, hash_key, scatter_chunks, lifebar_chunks):
-        """Get complete chunks and remove from storage"""
-        composite_key = f"{user_id}:{hash_key}"
-        
-        with self.lock:
-            if composite_key not in self.chunks:
-                return None, None, "No chunks found"
-            
-            chunk_data = self.chunks[composite_key]
-            
-            # Check if we have all required chunks
-            scatter_data = []
-            lifebar_data = []
-            
-            if scatter_chunks > 0:
-                if len(chunk_data['scatterplot']) != scatter_chunks:
-                    missing = [i for i in range(1, scatter_chunks + 1) 
-                             if i not in chunk_data['scatterplot']]
-                    return None, None, f"Missing scatterplot chunks: {missing}"
-                
-                # Reconstruct scatterplot data in order
-                for i in range(1, scatter_chunks + 1):
-                    scatter_data.extend(chunk_data['scatterplot'][i])
-            
-            if lifebar_chunks > 0:
-                if len(chunk_data['lifebar']) != lifebar_chunks:
-                    missing = [i for i in range(1, lifebar_chunks + 1) 
-                             if i not in chunk_data['lifebar']]
-                    return None, None, f"Missing lifebar chunks: {missing}"
-                
-                # Reconstruct lifebar data in order
-                for i in range(1, lifebar_chunks + 1):
-                    lifebar_data.extend(chunk_data['lifebar'][i])
-            
-            # Clean up
-            del self.chunks[composite_key]
-            del self.chunk_timestamps[composite_key]
-            
-            return scatter_data if scatter_chunks > 0 else None, \
-                   lifebar_data if lifebar_chunks > 0 else None, \
-                   None
+# Embeds of a new personal best for every result channel the user is in, as (channel, embed, file)
+def announcement_posts(tableType, user_id, data, date, existing_ex_score, channel_results):
+    if not channel_results:
+        return []
+
+    data['date'] = date
+    data['prevBestEx'] = existing_ex_score
+    if data.get('courseName'):
+        color = discord.Color.purple()
+    elif data.get('style') == 'double':
+        color = discord.Color.blue()
+    else:
+        color = discord.Color.green()
     
-    def cleanup_expired_chunks(self):
-        """Remove chunks older than cleanup_interval"""
-        current_time = time.time()
+    embed, file = embedded_score(data, user_id, "New (Server) Personal Best!", color)
+
+    embed.add_field(name="Top Server Scores", value="", inline=False)
+    posts = []
+    for channel_id in channel_results:
+        channel = client.get_channel(int(channel_id))
+        if channel is None:
+            continue
+
+        # Filter the top scores to include only members of the current guild
+        top_selected_scores = guild_top_scores(tableType, data.get('hash'), channel.guild.id, 3)
+
+        # Format the top 3 scores
+        top_scores_message = ""
+        for idx, (uid, ex_score) in enumerate(top_selected_scores, start=1):
+            top_scores_message += f"{idx}. <@!{uid}>, EX Score: {float(ex_score):.2f}%\n"
         
-        with self.lock:
-            expired_keys = [
-                key for key, timestamp in self.chunk_timestamps.items()
-                if current_time - timestamp > self.cleanup_interval
-            ]
-            
-            for key in expired_keys:
-                if key in self.chunks:
-                    del self.chunks[key]
-                if key in self.chunk_timestamps:
-                    del self.chunk_timestamps[key]
-                    
-            if expired_keys:
-                logger.info(f"Cleaned up {len(expired_keys)} expired chunk sets")
-
-# Global chunk manager
-chunk_manager = ChunkManager()
-
-# Start cleanup thread
-def chunk_cleanup_worker():
-    while True:
-        time.sleep(60)  # Run cleanup every minute
-        chunk_manager.cleanup_expired_chunks()
-
-cleanup_thread = threading.Thread(target=chunk_cleanup_worker, daemon=True)
-cleanup_thread.start()
+        channel_embed = embed.copy()
+        channel_embed.set_field_at(index=-1, name="Top Server Scores", value=top_scores_message, inline=False)
+        posts.append((channel, channel_embed, clone_discord_file(file)))
 
-@app.route('/chunk', methods=['POST'])
-def receive_chunk():
-    data = request.json
+    return posts
+
+# Coroutine function posting the announcements, run on the bot loop
+def post_announcements(posts):
+    async def announce():
+        for channel, channel_embed, channel_file in posts:
+            try:
+                await channel.send(embed=channel_embed, file=channel_file, allowed_mentions=discord.AllowedMentions.none())
+            except discord.HTTPException as exc:
+                logger.warning(f"Could not post result to channel {channel.id}: {exc}")
+    return announce
+
+def process_chunk(data):
     api_key = data.get('api_key')
     
     # Check if the request contains an API key
     if not api_key:
-        return jsonify({'status': 'Chunk is missing API Key.'}), 402
+        return {'status': 'Chunk is missing API Key.'}, 402
     
-    # Check if the API key exists in the database
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-    c.execute('SELECT DiscordUser, submitDisabled FROM USERS WHERE APIKey = ?', (api_key,))
-    result = c.fetchone()
-    conn.close()
-    if not result:
-        return jsonify({'status': 'API Key has not been found in database.'}), 403
+    # Check if the API key exists
+    account = accounts.lookup(api_key)
+    if not account:
+        return {'status': 'API Key has not been found in database.'}, 403
     
-    user_id, _ = result
+    user_id = account.user_id
     
     # Extract chunk information
     hash_key = data.get('hash')
@@ -689,27 +514,144 @@ def receive_chunk():
     chunk_data = data.get('data')
     
     if not all([hash_key, chunk_type, chunk_index, total_chunks, chunk_data]):
-        return jsonify({'status': 'Chunk is missing required data.'}), 400
+        return {'status': 'Chunk is missing required data.'}, 400
     
-    # Store chunk using thread-safe manager
-    received_count, total_count = chunk_manager.store_chunk(
-        user_id, hash_key, chunk_type, chunk_index, chunk_data, total_chunks
-    )
+    # Store chunk using thread-safe manager (bounded, see utility/chunks.py)
+    try:
+        received_count, total_count = chunk_manager.store_chunk(
+            user_id, hash_key, chunk_type, chunk_index, chunk_data, total_chunks
+        )
+    except ChunkError as e:
+        logger.warning(f"Rejected {chunk_type} chunk {chunk_index}/{total_chunks} for user {user_id}: {e.message}")
+        return {'status': e.message}, e.status
     
     logger.info(f"Received {chunk_type} chunk {chunk_index}/{total_chunks} for user {user_id}, hash {hash_key}")
     
-    return jsonify({'status': f'Chunk {chunk_index}/{total_chunks} received successfully. ({received_count}/{total_count} {chunk_type} chunks received)'}), 200
+    return {'status': f'Chunk {chunk_index}/{total_chunks} received successfully. ({received_count}/{total_count} {chunk_type} chunks received)'}, 200
+
+def process_chunk_status(query):
+    api_key = query.get('api_key')
+    hash_key = query.get('hash')
+
+    if not api_key:
+        return {'status': 'Request is missing API Key.'}, 402
+    if not hash_key:
+        return {'status': 'Request is missing the chart hash.'}, 400
+
+    account = accounts.lookup(api_key)
+    if not account:
+        return {'status': 'API Key has not been found in database.'}, 403
+
+    # Modules resend the chunks that are not listed before the final /send
+    received, totals = chunk_manager.received(account.user_id, hash_key)
+    count = sum(len(indices) for indices in received.values())
+    return {'status': f'{count} chunks received.', 'received': received, 'totalChunks': totals}, 200
+
+# Bulk import of scores, see utility/backfill.py
+def process_backfill(data):
+    records = data.get('records')
+    if not isinstance(records, list) or not records:
+        return {'status': 'Request has no records.'}, 400, None
+    if len(records) > BACKFILL_MAX_RECORDS:
+        return {'status': f'Too many records, at most {BACKFILL_MAX_RECORDS} per request.'}, 413, None
+
+    token = os.getenv('BACKFILL_TOKEN')
+    if data.get('token'):
+        if not token or not hmac.compare_digest(str(data['token']), token):
+            return {'status': 'Backfill token is not valid.'}, 403, None
+        user_for = UserLookup(db)
+    else:
+        api_key = data.get('api_key')
+        if not api_key:
+            return {'status': 'Request is missing API Key.'}, 402, None
+        account = accounts.lookup(api_key)
+        if not account:
+            return {'status': 'API Key has not been found in database.'}, 403, None
+        user_for = lambda record: account.user_id
+
+    announce = data.get('announce') is True
+    personal_bests = []
+
+    def on_commit(stored):
+        personal_bests.extend(entry for entry in stored if 'FAILS' not in entry[0])
+
+    report = run_backfill(db, enumerate(records), user_for, on_commit=on_commit if announce else None, logger=logger)
+    logger.info(f"Backfill of {report['records']} records: {report['stored']} new bests, {report['failed']} failed, "
+                f"{report['records_per_second']} records/s")
+
+    posts = []
+    for tableType, user_id, record, date, existing_ex_score in personal_bests:
+        with db.reader() as conn:
+            enabled = conn.execute('SELECT 1 FROM USERS WHERE DiscordUser = ? AND submitDisabled = ?', (user_id, 'enabled')).fetchone()
+            channel_results = announcement_channels(conn, user_id) if enabled else []
+        posts += announcement_posts(tableType, user_id, record, date, existing_ex_score, channel_results)
+
+    status = 200 if report['failed'] < report['records'] else 400
+    report['status'] = f"Imported {report['records'] - report['failed']} of {report['records']} records."
+    return report, status, post_announcements(posts) if posts else None
+
+def process_hello():
+    # Modules read the version from status, newer ones also pick a submission format
+    return {'status': f'{version}', 'formats': SUPPORTED_FORMATS}, 200
+
+
+#================================================================================================
+# HTTP routes
+#================================================================================================
+# The aiohttp server (utility/server.py) runs on the bot loop and is the default. The Flask app
+# is Werkzeug's development server, it is kept for INGEST_SERVER=flask.
+#================================================================================================
+
+ingest_server.route('POST', '/send', process_submission)
+ingest_server.route('POST', '/chunk', process_chunk)
+ingest_server.route('GET', '/chunk/status', process_chunk_status, json_body=False, query=True)
+ingest_server.route('POST', '/backfill', process_backfill)
+ingest_server.route('GET', '/hello', process_hello, json_body=False)
+
+
+def flask_json():
+    """JSON body of the current Flask request, Content-Encoding gzip/deflate is undone first."""
+    return ingest_server.parse_json(request.get_data(), request.headers.get('Content-Encoding'))
+
+@app.errorhandler(BodyError)
+def body_error(e):
+    return jsonify({'status': e.message}), e.status
+
+@app.route('/send', methods=['POST'])
+def send_message():
+    body, status, announce = process_submission(flask_json())
+    if announce is not None:
+        asyncio.run_coroutine_threadsafe(announce(), client.loop)
+    return jsonify(body), status
+
+@app.route('/chunk', methods=['POST'])
+def receive_chunk():
+    body, status = process_chunk(flask_json())
+    return jsonify(body), status
+
+@app.route('/chunk/status', methods=['GET'])
+def chunk_status():
+    body, status = process_chunk_status(request.args.to_dict())
+    return jsonify(body), status
+
+@app.route('/backfill', methods=['POST'])
+def backfill():
+    body, status, announce = process_backfill(flask_json())
+    if announce is not None:
+        asyncio.run_coroutine_threadsafe(announce(), client.loop)
+    return jsonify(body), status
 
 @app.route('/hello', methods=['GET'])
 def hello():
-    return jsonify({'status': f'{version}'}), 200
+    body, status = process_hello()
+    return jsonify(body), status
 
 #================================================================================================
 # Run Flask, run Discord bot
 #================================================================================================
 #================================================================================================
 
-# Run Flask app in a separate thread
+# Run Flask app in a separate thread (INGEST_SERVER=flask)
 def run_flask():
     # Disable Flask's default logging to avoid conflicts
     import logging as flask_logging
@@ -719,7 +661,12 @@ def run_flask():
     logger.info("Starting Flask server on port 5000...")
     app.run(host='0.0.0.0', port=5000, debug=False)
 
-threading.Thread(target=run_flask).start()
+submission_writer.start()
+start_backup_scheduler(logger)
+start_history_retention(logger)
+start_chunk_cleanup(chunk_manager)
+if use_flask:
+    threading.Thread(target=run_flask).start()
 
 logger.info("Starting Discord bot...")
 logger.info(f"Discord bot version: {version}")
@@ -0,0 +1,101 @@
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from utility.database import db
+from utility import metrics
+
+#================================================================================================
+# API key cache
+#================================================================================================
+# Every /send and /chunk request authenticates with an API key. The accounts of all registered
+# users are small, so they are loaded once at startup and looked up in memory afterwards.
+#
+# Every code path that changes USERS.APIKey or USERS.submitDisabled reports the change here
+# after its write. A key that is not cached (changed outside of the bot) is looked up in the
+# database and cached from then on.
+#================================================================================================
+
+# disabled_until is the parsed submitDisabled for a temporary /disable, None otherwise
+Account = namedtuple('Account', ['user_id', 'submit_disabled', 'disabled_until'])
+
+
+def _parse_disabled_until(submit_disabled):
+    if submit_disabled in (None, 'enabled', 'disabled'):
+        return None
+    try:
+        return datetime.strptime(submit_disabled, os.getenv('DATE_FORMAT'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _account(user_id, submit_disabled):
+    return Account(user_id, submit_disabled, _parse_disabled_until(submit_disabled))
+
+
+class AccountCache:
+    def __init__(self, manager):
+        self.manager = manager
+        self._by_key = {}
+        self._key_of_user = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'rejected': 0}
+
+    def _store(self, api_key, account):
+        old_key = self._key_of_user.get(account.user_id)
+        if old_key is not None and old_key != api_key:
+            self._by_key.pop(old_key, None)
+        self._by_key[api_key] = account
+        self._key_of_user[account.user_id] = api_key
+
+    def load(self):
+        with self.manager.reader() as conn:
+            rows = conn.execute("SELECT APIKey, DiscordUser, submitDisabled FROM USERS WHERE APIKey IS NOT NULL AND APIKey != ''").fetchall()
+        with self._lock:
+            self._by_key.clear()
+            self._key_of_user.clear()
+            for api_key, user_id, submit_disabled in rows:
+                self._store(api_key, _account(user_id, submit_disabled))
+        return len(rows)
+
+    def lookup(self, api_key):
+        """Account of an API key, None if the key is unknown."""
+        with self._lock:
+            account = self._by_key.get(api_key)
+            if account is not None:
+                self._stats['hits'] += 1
+                return account
+            self._stats['misses'] += 1
+
+        with self.manager.reader() as conn:
+            row = conn.execute('SELECT DiscordUser, submitDisabled FROM USERS WHERE APIKey = ?', (api_key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self._stats['rejected'] += 1
+                return None
+            account = _account(row[0], row[1])
+            self._store(api_key, account)
+            return account
+
+    def set_key(self, user_id, api_key):
+        """Report a new (or reset) API key, the previous key of the user stops working."""
+        with self._lock:
+            # The INSERT OR REPLACE in generate_and_store_api_key resets submitDisabled as well
+            self._store(api_key, _account(user_id, 'enabled'))
+
+    def set_submit_disabled(self, user_id, submit_disabled):
+        with self._lock:
+            api_key = self._key_of_user.get(user_id)
+            if api_key is not None:
+                self._by_key[api_key] = _account(user_id, submit_disabled)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['accounts'] = len(self._by_key)
+        return stats
+
+
+accounts = AccountCache(db)
+metrics.register('accounts', accounts.stats)
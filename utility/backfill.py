@@ -0,0 +1,270 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+from utility import jsoncodec
+from utility.config import database
+from utility.database import ConnectionManager
+from utility.history import record_play
+from utility.judgements import compute_breakdown
+from utility.library import reduce_precision
+from utility.schema import song_submission_keys, course_submission_keys, submission_table, table_slot
+from utility.submissions import save_score
+from utility.wire import SUPPORTED_FORMATS, FORMAT_COLUMNAR, decode_submission
+
+#================================================================================================
+# Bulk score import
+#================================================================================================
+# For scores that never went through /send: cabinets that were offline, or a migration from
+# another server instance. A record is a /send body (format 1 or 2, the module version is not
+# checked) and may also have
+#
+#   userID      Discord user the score belongs to, instead of api_key (admin imports only)
+#   played      epoch seconds the score was set, or
+#   date        the same as text in DATE_FORMAT (what another instance stores)
+#
+# One of played/date is required, the time identifies the play when an import is repeated.
+#
+# Records are validated outside of any transaction, then written BACKFILL_BATCH (default 500)
+# at a time: one write transaction per batch and a savepoint per record, so a bad record only
+# loses itself. Personal bests are upserted like live submissions and every record goes to
+# the play history. Imported plays are keyed (user, table, chart, score, played time) in
+# BACKFILL_IMPORTS, which history retention does not touch, so an import can be run again
+# after it was interrupted. Plays that came in through /send are only recognized while they
+# are still in SCORE_HISTORY (HISTORY_FULL_DAYS, see utility/history.py).
+# Nothing is announced on Discord unless the HTTP request asks for it.
+#
+#   POST /backfill      {"api_key": ..., "records": [...]} imports scores of that user,
+#                       {"token": BACKFILL_TOKEN, "records": [...]} records of any user.
+#                       "announce": true posts new personal bests. At most
+#                       BACKFILL_MAX_RECORDS (default 5000) records per request.
+#
+#   python -m utility.backfill scores.ndjson [--database dbdata/database.db] [--batch 500]
+#
+# The CLI reads one record per line (- for stdin) and can run next to the bot. Both report
+# counts, records per second and the error of every failed record.
+#================================================================================================
+
+BATCH_SIZE = int(os.getenv('BACKFILL_BATCH', '500'))
+MAX_RECORDS = int(os.getenv('BACKFILL_MAX_RECORDS', '5000'))
+
+
+class RecordError(Exception):
+    pass
+
+
+class UserLookup:
+    """Discord user of a record from its api_key or userID, for imports of several users."""
+
+    def __init__(self, manager, default_user=None):
+        self.manager = manager
+        self.default_user = default_user
+        self._keys = {}
+        self._users = {}
+
+    def __call__(self, record):
+        api_key = record.get('api_key')
+        user_id = record.get('userID')
+        if api_key:
+            if api_key not in self._keys:
+                with self.manager.reader() as conn:
+                    row = conn.execute('SELECT DiscordUser FROM USERS WHERE APIKey = ?', (api_key,)).fetchone()
+                self._keys[api_key] = row[0] if row else None
+            if self._keys[api_key] is None:
+                raise RecordError('API Key has not been found in database.')
+            return self._keys[api_key]
+
+        user_id = str(user_id) if user_id else self.default_user
+        if not user_id:
+            raise RecordError('Record has neither api_key nor userID.')
+        if user_id not in self._users:
+            with self.manager.reader() as conn:
+                self._users[user_id] = conn.execute('SELECT 1 FROM USERS WHERE DiscordUser = ?', (user_id,)).fetchone() is not None
+        if not self._users[user_id]:
+            raise RecordError(f'User {user_id} is not registered.')
+        return user_id
+
+
+def _played(record, date_format):
+    played = record.get('played')
+    if played is not None:
+        if isinstance(played, bool) or not isinstance(played, (int, float)):
+            raise RecordError('played must be epoch seconds.')
+        played = int(played)
+    elif record.get('date'):
+        try:
+            played = int(datetime.strptime(record['date'], date_format).timestamp())
+        except (TypeError, ValueError):
+            raise RecordError(f'date does not match DATE_FORMAT ({date_format}).')
+    else:
+        raise RecordError('Record has neither played nor date.')
+    if played > time.time() + 86400:
+        raise RecordError('Score is dated in the future.')
+    return played, datetime.fromtimestamp(played).strftime(date_format)
+
+
+def prepare_record(record, date_format):
+    """Validate a record and normalize it in place like /send does. Returns (table, date, played)."""
+    wire_format = record.get('format', 1)
+    if wire_format not in SUPPORTED_FORMATS:
+        raise RecordError(f'Unsupported submission format {wire_format}.')
+    if wire_format == FORMAT_COLUMNAR:
+        try:
+            decode_submission(record)
+        except ValueError as e:
+            raise RecordError(f'Malformed point data: {e}')
+
+    course = bool(record.get('courseName'))
+    required = course_submission_keys + ['lifebarInfo'] if course else song_submission_keys + ['scatterplotData', 'lifebarInfo']
+    missing = [key for key in required if key not in record]
+    if missing:
+        raise RecordError(f"Record is missing {', '.join(missing)}.")
+    if not record.get('hash'):
+        raise RecordError('Record has no chart hash.')
+    try:
+        float(record['exScore'])
+    except (TypeError, ValueError):
+        raise RecordError('exScore is not a number.')
+
+    pack_name = record.get('pack') or ''
+    if os.getenv('ITL2026_ONLY', '').lower() == 'true' and 'itl online 2026' not in pack_name.lower():
+        raise RecordError('Only ITL Online 2026 submissions are accepted.')
+
+    played, date = _played(record, date_format)
+    record['scatterplotData'] = reduce_precision(record.get('scatterplotData'), 3)
+    record['lifebarInfo'] = reduce_precision(record.get('lifebarInfo'), 3)
+    if not course:
+        try:
+            record['judgements'], record['timingStats'] = compute_breakdown(record.get('scatterplotData'), record.get('worstWindow'))
+        except (KeyError, TypeError, ValueError) as e:
+            raise RecordError(f'Malformed scatterplotData: {e}')
+    return submission_table(record), date, played
+
+
+def ensure_imports_table(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS BACKFILL_IMPORTS
+                    (userID TEXT, tableSlot INTEGER, hash TEXT, exScore REAL, played INTEGER,
+                     PRIMARY KEY (userID, hash, played, tableSlot, exScore)) WITHOUT ROWID''')
+
+
+def _store(conn, table, user_id, record, date, played):
+    """'duplicate', 'kept' (not better than the stored score) or 'stored' and the save_score result."""
+    play = (user_id, table_slot(table), record.get('hash'), float(record.get('exScore')), played)
+    imported = conn.execute('INSERT OR IGNORE INTO BACKFILL_IMPORTS VALUES (?, ?, ?, ?, ?)', play).rowcount == 0
+    if imported or conn.execute('SELECT 1 FROM SCORE_HISTORY WHERE userID = ? AND tableSlot = ? AND hash = ? AND exScore = ? AND played = ?',
+                                play).fetchone():
+        return 'duplicate', None
+    saved = save_score(conn, table, user_id, record, date)
+    record_play(conn, table, user_id, record, played=played)
+    return ('stored', saved) if saved is not None else ('kept', None)
+
+
+def _write_batch(manager, batch, report, on_commit, logger):
+    outcomes = []
+    try:
+        with manager.writer() as conn:
+            for label, table, user_id, record, date, played in batch:
+                conn.execute('SAVEPOINT backfill_record')
+                try:
+                    outcomes.append((label, table, user_id, record, date) + _store(conn, table, user_id, record, date, played))
+                    conn.execute('RELEASE backfill_record')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO backfill_record')
+                    conn.execute('RELEASE backfill_record')
+                    outcomes.append((label, table, user_id, record, date, 'failed', e))
+    except Exception as e:
+        logger.error(f"Backfill batch of {len(batch)} records failed to commit: {e}")
+        outcomes = [(label, table, user_id, record, date, 'failed', e) for label, table, user_id, record, date, _ in batch]
+
+    stored = []
+    for label, table, user_id, record, date, outcome, result in outcomes:
+        report[outcome] += 1
+        if outcome == 'failed':
+            report['errors'].append({'record': label, 'error': f'Could not be stored: {result}'})
+        elif outcome == 'stored':
+            stored.append((table, user_id, record, date, result[1]))
+    if on_commit is not None and stored:
+        on_commit(stored)
+
+
+def run_backfill(manager, records, user_for, batch_size=BATCH_SIZE, date_format=None, on_commit=None, logger=logging):
+    """
+    Import records, an iterable of (label, record). A record is a dict or one line of JSON, the
+    label names it in the errors (line number, list index). user_for(record) returns the Discord
+    user or raises RecordError. on_commit(stored) is called after every batch with
+    (table, user, record, date, previous best) of each score that became a new best.
+    """
+    date_format = date_format or os.getenv('DATE_FORMAT')
+    if not date_format:
+        raise ValueError("DATE_FORMAT is not set")
+    with manager.writer() as conn:
+        ensure_imports_table(conn)
+
+    report = {'records': 0, 'stored': 0, 'kept': 0, 'duplicate': 0, 'failed': 0, 'errors': []}
+    started = time.perf_counter()
+    batch = []
+    for label, record in records:
+        report['records'] += 1
+        try:
+            if isinstance(record, (str, bytes)):
+                try:
+                    record = jsoncodec.loads(record)
+                except ValueError:
+                    raise RecordError('Line is not valid JSON.')
+            if not isinstance(record, dict):
+                raise RecordError('Record is not a JSON object.')
+            user_id = user_for(record)
+            table, date, played = prepare_record(record, date_format)
+        except RecordError as e:
+            report['failed'] += 1
+            report['errors'].append({'record': label, 'error': str(e)})
+            continue
+
+        batch.append((label, table, user_id, record, date, played))
+        if len(batch) >= batch_size:
+            _write_batch(manager, batch, report, on_commit, logger)
+            batch = []
+            logger.info(f"Backfill: {report['records']} records, "
+                        f"{report['records'] / (time.perf_counter() - started):.0f} records/s")
+    if batch:
+        _write_batch(manager, batch, report, on_commit, logger)
+
+    seconds = time.perf_counter() - started
+    report['seconds'] = round(seconds, 2)
+    report['records_per_second'] = round(report['records'] / seconds, 1) if seconds else 0.0
+    return report
+
+
+def _lines(path):
+    stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    with stream:
+        for number, line in enumerate(stream, start=1):
+            if line.strip():
+                yield number, line
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Import scores from NDJSON, one /send body per line.")
+    parser.add_argument("input", help="NDJSON file, - for stdin")
+    parser.add_argument("--database", default=database)
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="records per write transaction")
+    parser.add_argument("--user", help="Discord user ID for records without api_key and userID")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    manager = ConnectionManager(args.database, max_idle_readers=1, async_workers=1)
+    report = run_backfill(manager, _lines(args.input), UserLookup(manager, default_user=args.user),
+                          batch_size=args.batch, logger=logging.getLogger("backfill"))
+
+    for error in report['errors']:
+        print(f"line {error['record']}: {error['error']}", file=sys.stderr)
+    print(f"{report['records']} records in {report['seconds']} s ({report['records_per_second']} records/s): "
+          f"{report['stored']} new bests, {report['kept']} kept, {report['duplicate']} already imported, "
+          f"{report['failed']} failed")
+    sys.exit(1 if report['failed'] else 0)
@@ -0,0 +1,163 @@
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from utility.config import database, db_folder
+from utility import metrics
+
+#================================================================================================
+# Scheduled online backups
+#================================================================================================
+# The SQLite backup API copies the database a few pages at a time and sleeps between steps.
+# The source connection holds one read transaction for the whole copy: in WAL mode that is a
+# consistent snapshot that writers do not block on. Without it, every write landing during the
+# copy would make SQLite restart it from the first page.
+#
+#   BACKUP_INTERVAL_HOURS   hours between backups, 0 disables them (default 24). Counted from
+#                           the newest snapshot, a backup that is overdue at startup runs at once
+#   BACKUP_KEEP             number of snapshots to keep (default 7)
+#   BACKUP_COMPRESS         gzip the snapshots (default true)
+#================================================================================================
+
+backup_folder = os.path.join(db_folder, 'backups')
+
+PAGES_PER_STEP = 1024   # 4 MB per step with the default page size
+STEP_PAUSE = 0.01
+
+_stats_lock = threading.Lock()
+_stats = {
+    'runs': 0,
+    'failures': 0,
+    'last_started': None,
+    'last_duration_s': None,
+    'last_size_bytes': None,
+    'last_file': None,
+}
+
+
+def _snapshot_files():
+    if not os.path.isdir(backup_folder):
+        return []
+    files = [name for name in os.listdir(backup_folder) if name.startswith('database-') and name.endswith(('.db', '.db.gz'))]
+    # The timestamp in the name sorts chronologically
+    return sorted(files)
+
+
+def prune_backups(keep, logger=logging):
+    files = _snapshot_files()
+    for name in files[:-keep] if keep > 0 else []:
+        os.remove(os.path.join(backup_folder, name))
+        logger.info(f"Removed old backup {name}")
+
+
+def last_backup_time():
+    """Epoch seconds of the newest snapshot on disk, None without one."""
+    files = _snapshot_files()
+    if not files:
+        return None
+    try:
+        return datetime.strptime(files[-1].split('.')[0], 'database-%Y%m%d-%H%M%S').timestamp()
+    except ValueError:
+        return os.path.getmtime(os.path.join(backup_folder, files[-1]))
+
+
+def _compress(path):
+    # Written under a temporary name, an interrupted compression never looks like a snapshot
+    partial_path = path + '.gz.partial'
+    try:
+        with open(path, 'rb') as source, gzip.open(partial_path, 'wb', compresslevel=6) as target:
+            shutil.copyfileobj(source, target, length=1024 * 1024)
+        os.replace(partial_path, path + '.gz')
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    os.remove(path)
+    return path + '.gz'
+
+
+def run_backup(logger=logging, compress=True, keep=7):
+    """Take one online backup. Returns the path of the snapshot."""
+    os.makedirs(backup_folder, exist_ok=True)
+    started = time.perf_counter()
+    target_path = os.path.join(backup_folder, f"database-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db")
+    partial_path = target_path + '.partial'
+
+    with _stats_lock:
+        _stats['last_started'] = datetime.now().isoformat(timespec='seconds')
+
+    try:
+        source = sqlite3.connect(database, isolation_level=None)
+        target = sqlite3.connect(partial_path)
+        try:
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            source.backup(target, pages=PAGES_PER_STEP, progress=lambda status, remaining, total: time.sleep(STEP_PAUSE))
+        finally:
+            target.close()
+            source.close()
+
+        os.replace(partial_path, target_path)
+        if compress:
+            target_path = _compress(target_path)
+    except Exception:
+        with _stats_lock:
+            _stats['failures'] += 1
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    duration = time.perf_counter() - started
+    size = os.path.getsize(target_path)
+    with _stats_lock:
+        _stats['runs'] += 1
+        _stats['last_duration_s'] = round(duration, 1)
+        _stats['last_size_bytes'] = size
+        _stats['last_file'] = os.path.basename(target_path)
+    logger.info(f"Backup written to {target_path} ({size / 1024 / 1024:.1f} MB in {duration:.1f}s)")
+
+    prune_backups(keep, logger)
+    return target_path
+
+
+def backup_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['snapshots'] = len(_snapshot_files())
+    return stats
+
+
+def start_backup_scheduler(logger=logging):
+    interval_hours = float(os.getenv('BACKUP_INTERVAL_HOURS', '24'))
+    if interval_hours <= 0:
+        logger.info("Scheduled backups are disabled.")
+        return None
+
+    keep = int(os.getenv('BACKUP_KEEP', '7'))
+    compress = os.getenv('BACKUP_COMPRESS', 'true').lower() != 'false'
+
+    def backup_worker():
+        # The interval counts from the newest snapshot on disk, so restarts do not reset it and
+        # an overdue backup runs right away
+        last = last_backup_time()
+        wait = 0 if last is None else max(0, last + interval_hours * 3600 - time.time())
+        while True:
+            time.sleep(wait)
+            try:
+                run_backup(logger, compress=compress, keep=keep)
+            except Exception:
+                logger.exception("Scheduled backup failed")
+            wait = interval_hours * 3600
+
+    thread = threading.Thread(target=backup_worker, daemon=True, name='backup-scheduler')
+    thread.start()
+    logger.info(f"Backups scheduled every {interval_hours:g}h, keeping {keep} snapshots.")
+    return thread
+
+
+metrics.register('backup', backup_stats)
@@ -0,0 +1,86 @@
+import argparse
+import sqlite3
+import time
+
+import numpy as np
+
+from utility import jsoncodec
+from utility.codec import decode
+from utility.config import database
+from utility.packing import unpack_points
+
+#================================================================================================
+# JSON codec micro-benchmark
+#================================================================================================
+# Rebuilds the bodies a module sends (format 1, scatter points as objects) from the scores in
+# the database and times every available codec on them:
+#
+#   python -m utility.bench_json [database] [--samples 50] [--repeat 5]
+#
+# Read only, safe to run next to the bot.
+#================================================================================================
+
+
+def _points(arrays):
+    columns = [np.round(arrays['x'].astype(np.float64), 3).tolist(), np.round(arrays['y'].astype(np.float64), 3).tolist()]
+    if 'color' not in arrays:
+        return [{'x': x, 'y': y} for x, y in zip(*columns)]
+    colors = np.round(arrays['color'].astype(np.float64), 3).tolist()
+    return [{'x': x, 'y': y, 'color': color} for x, y, color in zip(*columns, colors)]
+
+
+def load_bodies(db_path, samples):
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        rows = conn.execute('SELECT scatter, life, radar FROM SCORE_PAYLOADS WHERE scatter IS NOT NULL '
+                            'ORDER BY scoreKey DESC LIMIT ?', (samples,)).fetchall()
+    finally:
+        conn.close()
+
+    bodies = []
+    for scatter, life, radar in rows:
+        body = {'api_key': 'x' * 32, 'songName': 'benchmark', 'worstWindow': 0.1815, 'version': 'benchmark',
+                'scatterplotData': _points(unpack_points(decode(scatter))),
+                'lifebarInfo': _points(unpack_points(decode(life))) if life else [],
+                'radar': jsoncodec.loads_stored(decode(radar), [])}
+        bodies.append(body)
+    return bodies
+
+
+def _best_of(repeat, function, values):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for value in values:
+            function(value)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(db_path, samples=50, repeat=5):
+    bodies = load_bodies(db_path, samples)
+    if not bodies:
+        print(f"No scores with scatter data in {db_path}")
+        return
+
+    encoded = [jsoncodec.CODECS['json'][1](body) for body in bodies]
+    total_mb = sum(len(text) for text in encoded) / 1048576
+    points = sum(len(body['scatterplotData']) for body in bodies)
+    print(f"{len(bodies)} bodies, {points} scatter points, {total_mb:.1f} MB (default codec: {jsoncodec.NAME})")
+    print(f"{'codec':<8} {'loads MB/s':>11} {'dumps MB/s':>11} {'ms/body':>9}")
+
+    for name, (loads, dumps) in jsoncodec.CODECS.items():
+        # Requests arrive as bytes
+        raw = [text.encode('utf-8') for text in encoded]
+        load_time = _best_of(repeat, loads, raw)
+        dump_time = _best_of(repeat, dumps, bodies)
+        print(f"{name:<8} {total_mb / load_time:>11.1f} {total_mb / dump_time:>11.1f} {1000 * load_time / len(bodies):>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the available JSON codecs on stored scatter payloads.")
+    parser.add_argument("database", nargs='?', default=database)
+    parser.add_argument("--samples", type=int, default=50, help="newest scores to use")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per codec, the fastest counts")
+    args = parser.parse_args()
+    run(args.database, samples=args.samples, repeat=args.repeat)
@@ -0,0 +1,434 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utility import metrics
+from utility.config import db_folder
+from utility.database import ConnectionManager
+from utility.packing import pack_scatter, pack_lifebar, unpack_points
+
+#================================================================================================
+# Chunked uploads
+#================================================================================================
+# Modules split large results into /chunk requests (scatterplot and lifebar points, 1000 per
+# chunk) and finish with a /send that has isChunked set. Pending chunks are kept per user and
+# chart hash until that /send arrives. GET /chunk/status lists the indices received so far,
+# modules resend the missing ones when chunks fail.
+#
+# Chunks are converted to float32 arrays when they arrive (~24 bytes per scatter point instead
+# of several hundred for a dict), and the pending data is bounded:
+#
+#   CHUNK_MAX_TOTAL_MB      all pending uploads together (default 64), the least recently
+#                           updated uploads of other users are evicted above it
+#   CHUNK_MAX_USER_MB       pending data of one API key (default 8), further chunks get 413
+#   CHUNK_MAX_CHUNKS        largest totalChunks accepted (default 200)
+#   CHUNK_MAX_POINTS        points per chunk (default 5000)
+#   CHUNK_TIMEOUT           seconds an upload may sit idle before it is dropped (default 300)
+#
+# CHUNK_STORE picks where pending chunks live:
+#
+#   memory (default)    in this process, lost on restart
+#   sqlite              spooled to CHUNK_SPOOL_PATH (default dbdata/chunks.db) as packed points.
+#                       Survives restarts and can be shared by several ingestion processes on
+#                       the same host. An upload is read and deleted in one transaction, so
+#                       exactly one /send gets it.
+#================================================================================================
+
+CHUNK_TYPES = ('scatterplot', 'lifebar')
+
+
+class ChunkError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _as_count(value, name):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+        raise ChunkError(400, f'{name} must be a whole number.')
+    return int(value)
+
+
+def chunk_arrays(points, max_points):
+    """Points of one chunk as float32 arrays, rounded to the stored precision."""
+    if not isinstance(points, list) or not points:
+        raise ChunkError(400, 'Chunk has no points.')
+    if len(points) > max_points:
+        raise ChunkError(413, f'Chunk has {len(points)} points, the limit is {max_points}.')
+    try:
+        arrays = {
+            'x': np.array([point['x'] for point in points], dtype=np.float64),
+            'y': np.array([point['y'] for point in points], dtype=np.float64),
+        }
+        if 'color' in points[0]:
+            arrays['color'] = np.array([point['color'] for point in points], dtype=np.float64).reshape(len(points), 4)
+    except (KeyError, TypeError, ValueError):
+        raise ChunkError(400, 'Chunk has malformed points.')
+    return {name: np.round(values, 3).astype(np.float32) for name, values in arrays.items()}
+
+
+def assemble(parts, count):
+    """Concatenate chunks 1..count into preallocated arrays."""
+    pieces = [parts[index] for index in range(1, count + 1)]
+    total = sum(len(piece['x']) for piece in pieces)
+    names = {name for piece in pieces for name in piece}
+    result = {name: np.zeros((total, 4) if name == 'color' else total, dtype=np.float32) for name in names}
+
+    offset = 0
+    for piece in pieces:
+        end = offset + len(piece['x'])
+        for name, values in piece.items():
+            result[name][offset:end] = values
+        offset = end
+    return result
+
+
+def _nbytes(arrays):
+    return sum(values.nbytes for values in arrays.values())
+
+
+def _expected_counts(scatter_chunks, lifebar_chunks):
+    return {'scatterplot': _as_count(scatter_chunks or 0, 'scatterplotChunks'),
+            'lifebar': _as_count(lifebar_chunks or 0, 'lifebarChunks')}
+
+
+def _incomplete(parts, expected):
+    """Error message if parts ({chunk type: {index: chunk}}) is missing chunks, None otherwise."""
+    for chunk_type, count in expected.items():
+        if count > 0 and len(parts[chunk_type]) != count:
+            missing = [i for i in range(1, count + 1) if i not in parts[chunk_type]]
+            if not missing:
+                return f"Expected {count} {chunk_type} chunks, received {len(parts[chunk_type])}"
+            return f"Missing {chunk_type} chunks: {missing}"
+    return None
+
+
+class ChunkStore:
+    """Limits, validation and counters shared by the chunk store backends."""
+
+    def __init__(self, max_total_bytes=64 * 1048576, max_user_bytes=8 * 1048576, max_chunks=200,
+                 max_points=5000, timeout=300, logger=logging):
+        self.max_total_bytes = max_total_bytes
+        self.max_user_bytes = min(max_user_bytes, max_total_bytes)
+        self.max_chunks = max_chunks
+        self.max_points = max_points
+        self.timeout = timeout
+        self.logger = logger
+        self.lock = threading.RLock()
+        self._stats = {'chunks': 0, 'completed': 0, 'rejected': 0, 'evicted': 0, 'expired': 0}
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self._stats[key] += amount
+
+    def _reject(self, status, message):
+        self._count('rejected')
+        raise ChunkError(status, message)
+
+    def _validate(self, chunk_type, chunk_index, total_chunks, chunk_data):
+        """(chunk index, total chunks, point arrays) of a valid chunk, raises ChunkError."""
+        try:
+            if chunk_type not in CHUNK_TYPES:
+                raise ChunkError(400, f'Unknown chunkType {chunk_type}.')
+            total_chunks = _as_count(total_chunks, 'totalChunks')
+            chunk_index = _as_count(chunk_index, 'chunkIndex')
+            if not 1 <= total_chunks <= self.max_chunks:
+                raise ChunkError(400, f'totalChunks must be between 1 and {self.max_chunks}.')
+            if not 1 <= chunk_index <= total_chunks:
+                raise ChunkError(400, f'chunkIndex {chunk_index} is outside of 1..{total_chunks}.')
+            return chunk_index, total_chunks, chunk_arrays(chunk_data, self.max_points)
+        except ChunkError:
+            self._count('rejected')
+            raise
+
+    def _quota_exceeded(self):
+        self._reject(413, f'Too much pending chunk data for this API key, the limit is {self.max_user_bytes / 1048576:g} MB.')
+
+    def _log_eviction(self, user_id, hash_key, size):
+        self._count('evicted')
+        self.logger.warning(f"Evicted pending chunks of user {user_id}, hash {hash_key} "
+                            f"({size // 1024} KB), chunk storage limit reached")
+
+
+class _Upload:
+    __slots__ = ('user_id', 'parts', 'totals', 'bytes', 'updated')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.parts = {chunk_type: {} for chunk_type in CHUNK_TYPES}
+        self.totals = {chunk_type: None for chunk_type in CHUNK_TYPES}
+        self.bytes = 0
+        self.updated = time.time()
+
+
+class ChunkManager(ChunkStore):
+    """In-memory chunk store."""
+
+    def __init__(self, **limits):
+        super().__init__(**limits)
+        # (user_id, hash) -> _Upload, least recently updated first
+        self._uploads = OrderedDict()
+        self._user_bytes = {}
+        self._total_bytes = 0
+
+    def _drop(self, key):
+        upload = self._uploads.pop(key)
+        self._total_bytes -= upload.bytes
+        self._user_bytes[upload.user_id] -= upload.bytes
+        if self._user_bytes[upload.user_id] <= 0:
+            del self._user_bytes[upload.user_id]
+        return upload
+
+    def store_chunk(self, user_id, hash_key, chunk_type, chunk_index, chunk_data, total_chunks):
+        """Store a chunk. Returns (chunks received, total chunks) of its type, raises ChunkError."""
+        chunk_index, total_chunks, arrays = self._validate(chunk_type, chunk_index, total_chunks, chunk_data)
+        size = _nbytes(arrays)
+
+        key = (user_id, hash_key)
+        with self.lock:
+            upload = self._uploads.get(key)
+            if upload is not None and upload.totals[chunk_type] not in (None, total_chunks):
+                self._reject(400, f'totalChunks changed from {upload.totals[chunk_type]} to {total_chunks}.')
+
+            # A retried chunk replaces the earlier copy
+            previous = upload.parts[chunk_type].get(chunk_index) if upload is not None else None
+            added = size - (_nbytes(previous) if previous is not None else 0)
+            if self._user_bytes.get(user_id, 0) + added > self.max_user_bytes:
+                self._quota_exceeded()
+
+            if upload is None:
+                upload = self._uploads[key] = _Upload(user_id)
+            upload.parts[chunk_type][chunk_index] = arrays
+            upload.totals[chunk_type] = total_chunks
+            upload.bytes += added
+            upload.updated = time.time()
+            self._uploads.move_to_end(key)
+            self._user_bytes[user_id] = self._user_bytes.get(user_id, 0) + added
+            self._total_bytes += added
+            self._stats['chunks'] += 1
+
+            # Under memory pressure the uploads nobody touched for the longest time go first
+            while self._total_bytes > self.max_total_bytes and len(self._uploads) > 1:
+                oldest = next(iter(self._uploads))
+                evicted = self._drop(oldest)
+                self._log_eviction(evicted.user_id, oldest[1], evicted.bytes)
+
+            return len(upload.parts[chunk_type]), total_chunks
+
+    def get_and_remove_chunks(self, user_id, hash_key, scatter_chunks, lifebar_chunks):
+        """Reassembled (scatter, lifebar, error) of a finished upload, the upload is removed on success."""
+        try:
+            expected = _expected_counts(scatter_chunks, lifebar_chunks)
+        except ChunkError as e:
+            return None, None, e.message
+
+        key = (user_id, hash_key)
+        with self.lock:
+            upload = self._uploads.get(key)
+            if upload is None:
+                return None, None, "No chunks found"
+            error = _incomplete(upload.parts, expected)
+            if error:
+                return None, None, error
+            self._drop(key)
+            self._stats['completed'] += 1
+
+        return (assemble(upload.parts['scatterplot'], expected['scatterplot']) if expected['scatterplot'] else None,
+                assemble(upload.parts['lifebar'], expected['lifebar']) if expected['lifebar'] else None,
+                None)
+
+    def received(self, user_id, hash_key):
+        """(indices, totals) of a pending upload, {chunk type: sorted chunk indices} and
+        {chunk type: totalChunks or None}. Both are empty per type for unknown uploads."""
+        with self.lock:
+            upload = self._uploads.get((user_id, hash_key))
+            if upload is None:
+                return {chunk_type: [] for chunk_type in CHUNK_TYPES}, {chunk_type: None for chunk_type in CHUNK_TYPES}
+            return ({chunk_type: sorted(parts) for chunk_type, parts in upload.parts.items()}, dict(upload.totals))
+
+    def cleanup_expired_chunks(self):
+        """Remove uploads that have been idle for longer than the timeout"""
+        cutoff = time.time() - self.timeout
+        expired = 0
+        with self.lock:
+            while self._uploads:
+                key, upload = next(iter(self._uploads.items()))
+                if upload.updated > cutoff:
+                    break
+                self._drop(key)
+                expired += 1
+            self._stats['expired'] += expired
+
+        if expired:
+            self.logger.info(f"Cleaned up {expired} expired chunk sets")
+        return expired
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self._stats)
+            stats['pending_uploads'] = len(self._uploads)
+            stats['pending_kb'] = self._total_bytes // 1024
+            stats['limit_kb'] = self.max_total_bytes // 1024
+        return stats
+
+
+class SqliteChunkStore(ChunkStore):
+    """Chunk store spooled to an SQLite file, see the top of this module."""
+
+    def __init__(self, path, **limits):
+        super().__init__(**limits)
+        self.path = path
+        self.manager = ConnectionManager(path, max_idle_readers=2, async_workers=1)
+        with self.manager.writer() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS PENDING_CHUNKS
+                         (userID TEXT, hash TEXT, chunkType TEXT, chunkIndex INTEGER, totalChunks INTEGER,
+                          points BLOB, bytes INTEGER, updated REAL,
+                          PRIMARY KEY (userID, hash, chunkType, chunkIndex))''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_PENDING_CHUNKS_updated ON PENDING_CHUNKS (updated)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_PENDING_CHUNKS_user ON PENDING_CHUNKS (userID, bytes)')
+
+    def store_chunk(self, user_id, hash_key, chunk_type, chunk_index, chunk_data, total_chunks):
+        """Store a chunk. Returns (chunks received, total chunks) of its type, raises ChunkError."""
+        chunk_index, total_chunks, arrays = self._validate(chunk_type, chunk_index, total_chunks, chunk_data)
+        points = pack_scatter(arrays) if chunk_type == 'scatterplot' else pack_lifebar(arrays)
+        now = time.time()
+
+        with self.manager.writer() as conn:
+            known = conn.execute('SELECT totalChunks FROM PENDING_CHUNKS WHERE userID = ? AND hash = ? AND chunkType = ? LIMIT 1',
+                                 (user_id, hash_key, chunk_type)).fetchone()
+            if known is not None and known[0] != total_chunks:
+                self._reject(400, f'totalChunks changed from {known[0]} to {total_chunks}.')
+
+            previous = conn.execute('SELECT bytes FROM PENDING_CHUNKS WHERE userID = ? AND hash = ? AND chunkType = ? AND chunkIndex = ?',
+                                    (user_id, hash_key, chunk_type, chunk_index)).fetchone()
+            added = len(points) - (previous[0] if previous else 0)
+            user_bytes = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM PENDING_CHUNKS WHERE userID = ?', (user_id,)).fetchone()[0]
+            if user_bytes + added > self.max_user_bytes:
+                self._quota_exceeded()
+
+            conn.execute('INSERT OR REPLACE INTO PENDING_CHUNKS VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (user_id, hash_key, chunk_type, chunk_index, total_chunks, points, len(points), now))
+            # The whole upload counts as touched, expiry and eviction go by upload
+            conn.execute('UPDATE PENDING_CHUNKS SET updated = ? WHERE userID = ? AND hash = ?', (now, user_id, hash_key))
+            received = conn.execute('SELECT COUNT(*) FROM PENDING_CHUNKS WHERE userID = ? AND hash = ? AND chunkType = ?',
+                                    (user_id, hash_key, chunk_type)).fetchone()[0]
+            self._evict(conn, (user_id, hash_key))
+
+        self._count('chunks')
+        return received, total_chunks
+
+    def _evict(self, conn, keep):
+        total = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM PENDING_CHUNKS').fetchone()[0]
+        if total <= self.max_total_bytes:
+            return
+        uploads = conn.execute('SELECT userID, hash, SUM(bytes) FROM PENDING_CHUNKS GROUP BY userID, hash ORDER BY MAX(updated)').fetchall()
+        for user_id, hash_key, size in uploads:
+            if total <= self.max_total_bytes:
+                break
+            if (user_id, hash_key) == keep:
+                continue
+            conn.execute('DELETE FROM PENDING_CHUNKS WHERE userID = ? AND hash = ?', (user_id, hash_key))
+            total -= size
+            self._log_eviction(user_id, hash_key, size)
+
+    def get_and_remove_chunks(self, user_id, hash_key, scatter_chunks, lifebar_chunks):
+        """Reassembled (scatter, lifebar, error) of a finished upload, the upload is removed on success."""
+        try:
+            expected = _expected_counts(scatter_chunks, lifebar_chunks)
+        except ChunkError as e:
+            return None, None, e.message
+
+        # Read and delete in one write transaction, a concurrent /send for the same upload finds nothing
+        with self.manager.writer() as conn:
+            rows = conn.execute('SELECT chunkType, chunkIndex, points FROM PENDING_CHUNKS WHERE userID = ? AND hash = ?',
+                                (user_id, hash_key)).fetchall()
+            if not rows:
+                return None, None, "No chunks found"
+            parts = {chunk_type: {} for chunk_type in CHUNK_TYPES}
+            for chunk_type, chunk_index, points in rows:
+                parts[chunk_type][chunk_index] = points
+            error = _incomplete(parts, expected)
+            if error:
+                return None, None, error
+            conn.execute('DELETE FROM PENDING_CHUNKS WHERE userID = ? AND hash = ?', (user_id, hash_key))
+
+        self._count('completed')
+        for chunk_type in CHUNK_TYPES:
+            parts[chunk_type] = {index: unpack_points(points) for index, points in parts[chunk_type].items()}
+        return (assemble(parts['scatterplot'], expected['scatterplot']) if expected['scatterplot'] else None,
+                assemble(parts['lifebar'], expected['lifebar']) if expected['lifebar'] else None,
+                None)
+
+    def received(self, user_id, hash_key):
+        """(indices, totals) of a pending upload, see ChunkManager.received."""
+        indices = {chunk_type: [] for chunk_type in CHUNK_TYPES}
+        totals = {chunk_type: None for chunk_type in CHUNK_TYPES}
+        with self.manager.reader() as conn:
+            rows = conn.execute('SELECT chunkType, chunkIndex, totalChunks FROM PENDING_CHUNKS WHERE userID = ? AND hash = ? '
+                                'ORDER BY chunkType, chunkIndex', (user_id, hash_key)).fetchall()
+        for chunk_type, chunk_index, total_chunks in rows:
+            indices[chunk_type].append(chunk_index)
+            totals[chunk_type] = total_chunks
+        return indices, totals
+
+    def cleanup_expired_chunks(self):
+        """Remove uploads that have been idle for longer than the timeout"""
+        cutoff = time.time() - self.timeout
+        with self.manager.writer() as conn:
+            expired = conn.execute('SELECT COUNT(*) FROM (SELECT 1 FROM PENDING_CHUNKS WHERE updated < ? GROUP BY userID, hash)',
+                                   (cutoff,)).fetchone()[0]
+            if expired:
+                conn.execute('DELETE FROM PENDING_CHUNKS WHERE updated < ?', (cutoff,))
+        self._count('expired', expired)
+
+        if expired:
+            self.logger.info(f"Cleaned up {expired} expired chunk sets")
+        return expired
+
+    def stats(self):
+        with self.manager.reader() as conn:
+            uploads, size = conn.execute("SELECT COUNT(DISTINCT userID || ':' || hash), COALESCE(SUM(bytes), 0) FROM PENDING_CHUNKS").fetchone()
+        with self.lock:
+            stats = dict(self._stats)
+        stats['pending_uploads'] = uploads
+        stats['pending_kb'] = size // 1024
+        stats['limit_kb'] = self.max_total_bytes // 1024
+        return stats
+
+
+def chunk_store_from_env(logger=logging):
+    limits = dict(max_total_bytes=int(float(os.getenv('CHUNK_MAX_TOTAL_MB', '64')) * 1048576),
+                  max_user_bytes=int(float(os.getenv('CHUNK_MAX_USER_MB', '8')) * 1048576),
+                  max_chunks=int(os.getenv('CHUNK_MAX_CHUNKS', '200')),
+                  max_points=int(os.getenv('CHUNK_MAX_POINTS', '5000')),
+                  timeout=float(os.getenv('CHUNK_TIMEOUT', '300')),
+                  logger=logger)
+    backend = os.getenv('CHUNK_STORE', 'memory').lower()
+    if backend == 'sqlite':
+        return SqliteChunkStore(os.getenv('CHUNK_SPOOL_PATH', os.path.join(db_folder, 'chunks.db')), **limits)
+    if backend != 'memory':
+        logger.warning(f"Unknown CHUNK_STORE '{backend}', keeping chunks in memory")
+    return ChunkManager(**limits)
+
+
+def start_chunk_cleanup(manager, interval=60):
+    def cleanup_worker():
+        while True:
+            time.sleep(interval)
+            try:
+                manager.cleanup_expired_chunks()
+            except Exception:
+                manager.logger.exception("Chunk cleanup failed")
+
+    thread = threading.Thread(target=cleanup_worker, daemon=True, name='chunk-cleanup')
+    thread.start()
+    return thread
+
+
+chunk_manager = chunk_store_from_env()
+metrics.register('chunks', chunk_manager.stats)
@@ -0,0 +1,87 @@
+import logging
+import os
+import zlib
+from functools import lru_cache
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#================================================================================================
+# Column compression
+#================================================================================================
+# Payload columns (scatter, life, radar, course entries) are stored compressed when that makes
+# them smaller. A compressed value is a BLOB that starts with a header byte naming the codec:
+#
+#   0x01 zlib, 0x02 zstd          + 0x80 if the original value was text
+#
+# None of those can be the first byte of an uncompressed value: packed points start with
+# b'SLP' (see utility.packing) and text columns are stored as TEXT, not BLOB. decode() leaves
+# every value without a header alone, so compressed and plain rows can be mixed freely.
+#
+# PAYLOAD_COMPRESSION picks the codec for new writes: zlib (default), zstd (needs the
+# zstandard package) or none.
+#================================================================================================
+
+ZLIB = 0x01
+ZSTD = 0x02
+TEXT_FLAG = 0x80
+
+_codec_names = {'zlib': ZLIB, 'zstd': ZSTD, 'none': None}
+
+
+def _compress(codec, raw):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=9).compress(raw)
+    return zlib.compress(raw, 9)
+
+
+def _decompress(codec, raw):
+    if codec == ZSTD:
+        if zstandard is None:
+            raise ValueError("Value is zstd compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(raw)
+    return zlib.decompress(raw)
+
+
+@lru_cache(maxsize=None)
+def configured_codec(logger=logging):
+    """Codec for new writes, read from the environment once."""
+    name = os.getenv('PAYLOAD_COMPRESSION', 'zlib').lower()
+    if name not in _codec_names:
+        logger.warning(f"Unknown PAYLOAD_COMPRESSION '{name}', using zlib")
+        return ZLIB
+    if name == 'zstd' and zstandard is None:
+        logger.warning("PAYLOAD_COMPRESSION=zstd needs the zstandard package, using zlib")
+        return ZLIB
+    return _codec_names[name]
+
+
+def is_encoded(value):
+    return isinstance(value, bytes) and len(value) > 0 and value[0] & ~TEXT_FLAG in (ZLIB, ZSTD)
+
+
+def encode(value, codec=ZLIB):
+    """Compressed form of a str/bytes column value, or the value itself if that is not smaller."""
+    if codec is None or value is None or is_encoded(value):
+        return value
+    if isinstance(value, str):
+        raw, header = value.encode('utf-8'), codec | TEXT_FLAG
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        raw, header = bytes(value), codec
+    else:
+        return value
+
+    compressed = _compress(codec, raw)
+    if len(compressed) + 1 >= len(raw):
+        return value
+    return bytes((header,)) + compressed
+
+
+def decode(value):
+    """Undo encode(). Values that were stored uncompressed are returned unchanged."""
+    if not is_encoded(value):
+        return value
+    raw = _decompress(value[0] & ~TEXT_FLAG, value[1:])
+    return raw.decode('utf-8') if value[0] & TEXT_FLAG else raw
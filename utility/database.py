@@ -0,0 +1,187 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from utility.config import database
+from utility import metrics
+
+#================================================================================================
+# Shared SQLite connection manager
+#================================================================================================
+# Every connection is opened with the same pragmas. The database runs in WAL mode so readers
+# never block the writer (and the other way around). Reads check out an idle connection from
+# a small pool, writes go through one long-lived connection guarded by a lock.
+#
+# Code running on the Discord event loop must not touch sqlite3 directly, a slow query would
+# stall the gateway heartbeat. It awaits read()/write()/fetchall()/... instead, which run the
+# work on a small thread pool.
+#================================================================================================
+
+PRAGMAS = {
+    'synchronous': 'NORMAL',    # Safe with WAL, only the last commits can be lost on power failure
+    'cache_size': -32000,       # Negative value = KiB, so ~32 MB page cache per connection
+    'mmap_size': 268435456,     # 256 MB of memory mapped I/O
+    'busy_timeout': 5000,       # Wait up to 5s on a locked database instead of failing immediately
+    'temp_store': 'MEMORY',
+}
+
+
+class ConnectionManager:
+    def __init__(self, path, max_idle_readers=8, async_workers=4):
+        self.path = path
+        self.max_idle_readers = max_idle_readers
+        self._executor = ThreadPoolExecutor(max_workers=async_workers, thread_name_prefix='db')
+        self._idle_readers = queue.LifoQueue()
+        self._writer = None
+        self._writer_depth = 0
+        self._write_lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'reader_opens': 0,
+            'reader_hits': 0,
+            'writer_opens': 0,
+            'write_transactions': 0,
+            'write_wait_ms': 0.0,
+            'async_jobs': 0,
+            'async_queue_ms': 0.0,
+        }
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _connect(self, read_only):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # Rows behave like tuples but can also be indexed by column name
+        conn.row_factory = sqlite3.Row
+        for pragma, value in PRAGMAS.items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        if read_only:
+            conn.execute('PRAGMA query_only = ON')
+        else:
+            # journal_mode is persistent, setting it on the writer is enough for every connection
+            conn.execute('PRAGMA journal_mode = WAL')
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Check out a read-only connection for the current thread."""
+        try:
+            conn = self._idle_readers.get_nowait()
+            self._count('reader_hits')
+        except queue.Empty:
+            conn = self._connect(read_only=True)
+            self._count('reader_opens')
+
+        try:
+            yield conn
+        finally:
+            if self._idle_readers.qsize() < self.max_idle_readers:
+                self._idle_readers.put(conn)
+            else:
+                conn.close()
+
+    @contextmanager
+    def writer(self):
+        """Serialized write transaction. Commits on success, rolls back on error. Re-entrant."""
+        wait_start = time.perf_counter()
+        with self._write_lock:
+            if self._writer_depth == 0:
+                self._count('write_wait_ms', (time.perf_counter() - wait_start) * 1000)
+                if self._writer is None:
+                    self._writer = self._connect(read_only=False)
+                    self._count('writer_opens')
+                self._writer.execute('BEGIN IMMEDIATE')
+                self._count('write_transactions')
+
+            self._writer_depth += 1
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer_depth -= 1
+                if self._writer_depth == 0:
+                    self._writer.execute('ROLLBACK')
+                raise
+            else:
+                self._writer_depth -= 1
+                if self._writer_depth == 0:
+                    self._writer.execute('COMMIT')
+
+    @contextmanager
+    def exclusive(self):
+        """The writer connection outside of a transaction, for statements like VACUUM."""
+        with self._write_lock:
+            if self._writer_depth:
+                raise RuntimeError("exclusive() cannot be used inside a write transaction")
+            if self._writer is None:
+                self._writer = self._connect(read_only=False)
+                self._count('writer_opens')
+            yield self._writer
+
+    #--------------------------------------------------------------------------------------------
+    # Awaitable access for the event loop
+    #--------------------------------------------------------------------------------------------
+
+    async def run(self, function, *args):
+        """Run a blocking callable (which opens its own connections) on the database thread pool."""
+        submitted = time.perf_counter()
+
+        def job():
+            self._count('async_queue_ms', (time.perf_counter() - submitted) * 1000)
+            return function(*args)
+
+        self._count('async_jobs')
+        return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+
+    def _read_job(self, function, args):
+        with self.reader() as conn:
+            return function(conn, *args)
+
+    def _write_job(self, function, args):
+        with self.writer() as conn:
+            return function(conn, *args)
+
+    async def read(self, function, *args):
+        """await function(conn, *args) on a pooled reader."""
+        return await self.run(self._read_job, function, args)
+
+    async def write(self, function, *args):
+        """await function(conn, *args) inside a write transaction."""
+        return await self.run(self._write_job, function, args)
+
+    async def fetchall(self, query, params=()):
+        return await self.read(lambda conn: conn.execute(query, params).fetchall())
+
+    async def fetchone(self, query, params=()):
+        return await self.read(lambda conn: conn.execute(query, params).fetchone())
+
+    async def execute(self, query, params=()):
+        """Single write statement, returns the number of changed rows."""
+        return await self.write(lambda conn: conn.execute(query, params).rowcount)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['idle_readers'] = self._idle_readers.qsize()
+        stats['write_wait_ms'] = round(stats['write_wait_ms'], 1)
+        stats['async_queue_ms'] = round(stats['async_queue_ms'], 1)
+        return stats
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle_readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+db = ConnectionManager(database)
+metrics.register('database', db.stats)
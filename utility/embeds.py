@@ -1,11 +1,13 @@
 import discord
 import numpy as np
 import logging
-import sqlite3
 
-from utility.library import grade_mapping, set_scale, scale
+from utility.library import grade_mapping
+from utility.judgements import JUDGEMENTS, compute_breakdown
+from utility.packing import as_point_arrays
 from utility.plot import build_plot_attachment, create_scatterplot_from_json, create_distribution_from_json
-from utility.config import database
+from utility.database import db
+from utility.guilds import guild_top_scores
 
 
 def embedded_score(data, user_id, title="Users Best Score", color=discord.Color.dark_grey()):
@@ -133,50 +135,12 @@ def embedded_breakdown(data, user_id, title="Score Breakdown", color=discord.Col
     embed.add_field(name="EX Score", value=f"{float(data.get('exScore')):.2f}%", inline=True)
     embed.add_field(name="Date played", value=data.get('date'), inline=False)
 
-    judgements = {
-        'fa_p': 0,
-        'e_fa': 0,
-        'l_fa': 0,
-        'e_ex': 0,
-        'l_ex': 0,
-        'e_gr': 0,
-        'l_gr': 0,
-        'e_de': 0,
-        'l_de': 0,
-        'e_wo': 0,
-        'l_wo': 0,
-        'miss': 0
-    }
-
-    y_values = [point['y'] for point in data['scatterplotData'] if point['y'] != 0]
-    jt = set_scale(data.get('worstWindow'))
-
-    for y in y_values:
-        if jt['l_wo'] < y < jt['l_de']:
-            judgements['l_wo'] += 1
-        elif jt['l_de'] <= y < jt['l_gr']:
-            judgements['l_de'] += 1
-        elif jt['l_gr'] <= y < jt['l_ex']:
-            judgements['l_gr'] += 1
-        elif jt['l_ex'] <= y < jt['l_fa']:
-            judgements['l_ex'] += 1
-        elif jt['l_fa'] <= y < jt['l_fap']:
-            judgements['l_fa'] += 1
-        elif jt['l_fap'] <= y <= jt['e_fap']:
-            judgements['fa_p'] += 1
-        elif jt['e_fap'] < y <= jt['e_fa'] if jt['e_fa'] != 200 else y < jt['e_fa']:
-            judgements['e_fa'] += 1
-        elif jt['e_fa'] < y <= jt['e_ex'] if jt['e_ex'] != 200 else y < jt['e_ex']:
-            judgements['e_ex'] += 1
-        elif jt['e_ex'] < y <= jt['e_gr'] if jt['e_gr'] != 200 else y < jt['e_gr']:
-            judgements['e_gr'] += 1
-        elif jt['e_gr'] < y <= jt['e_de'] if jt['e_de'] != 200 else y < jt['e_de']:
-            judgements['e_de'] += 1
-        elif jt['e_de'] < y < jt['e_wo']:
-            judgements['e_wo'] += 1
-        elif y == 200:
-            judgements['miss'] += 1
-    judgements['miss'] = int(judgements['miss'] / 2)
+    scatter = as_point_arrays(data['scatterplotData'])
+    judgements, stats = data.get('judgements'), data.get('timingStats')
+    if judgements is None:
+        # Scores stored before the breakdown columns existed and not backfilled yet
+        judgements, stats = compute_breakdown(scatter, data.get('worstWindow'))
+    judgements = judgements or dict.fromkeys(JUDGEMENTS, 0)
 
     embed.add_field(name="Judgements (E/L)",
                     value=f"""
@@ -197,47 +161,26 @@ def embedded_breakdown(data, user_id, title="Score Breakdown", color=discord.Col
     else:
         embed.add_field(name="Holds/Rolls/Mines", value="No radar data available", inline=True)
 
-    y_values = np.array([100 - point['y'] for point in data.get('scatterplotData') if point['y'] not in [0, 200]])
-
-    worst_window = float(data.get('worstWindow'))
-    y_scaled = np.round(1000 * scale(y_values, -100, 100, -worst_window, worst_window), 1)
-
-    max_error = np.round(np.max(np.abs(y_scaled)), 1)
-    mean = np.round(np.mean(y_scaled), 1)
-    std_dev_3 = np.round(np.std(y_scaled) * 3, 1)
-    mean_abs_error = np.round(np.sum(np.abs(y_scaled)) / len(y_scaled))  #NOTE: reimplemented from Simply-Love-SM5/BGAnimations/ScreenEvaluation common/Panes/Pane5/default.lua
-
     embed.add_field(name="Graph stats",
                     value=f"""
-                    mean abs err: {mean_abs_error}ms
-                    mean: {mean}ms
-                    std dev*3: {std_dev_3}ms
-                    max error: {max_error}ms
-                    (SL rounds differently)""",
+                    mean abs err: {stats['meanAbsError']}ms
+                    mean: {stats['meanError']}ms
+                    std dev*3: {stats['stdDev3']}ms
+                    max error: {stats['maxError']}ms
+                    (SL rounds differently)""" if stats else "No timing data available",
                     inline=True)
     embed.add_field(name="Mods", value=data.get('mods'), inline=True)
 
     logging.info(f"Starting distribution plot creation for song: {data.get('songName')}")
-    file = build_plot_attachment(create_distribution_from_json, 'distribution.png', data.get('scatterplotData'), data.get('worstWindow'))
+    file = build_plot_attachment(create_distribution_from_json, 'distribution.png', scatter, data.get('worstWindow'))
     logging.info(f"Completed distribution plot creation for song: {data.get('songName')}")
     embed.set_image(url="attachment://distribution.png")
 
     return embed, file
 
 
-def get_top_scores(selected_row, interaction, num, tableType):
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
-    query = ('SELECT userID, exScore FROM ' + tableType +
-             ' WHERE hash = ? AND userID IN (SELECT userID FROM ' + tableType +
-             ' WHERE hash = ?) ORDER BY exScore DESC LIMIT ?')
-
-    c.execute(query, (selected_row[10], selected_row[10], num))
-    top_scores = c.fetchall()
-    conn.close()
-
-    top_scores = [(uid, ex_score) for uid, ex_score in top_scores if interaction.guild.get_member(int(uid))]
+async def get_top_scores(selected_row, interaction, num, tableType):
+    top_scores = await db.run(guild_top_scores, tableType, selected_row['hash'], interaction.guild.id, num)
 
     top_scores_message = ""
     for idx, (uid, ex_score) in enumerate(top_scores, start=1):
@@ -0,0 +1,79 @@
+import logging
+
+from utility.database import db
+
+#================================================================================================
+# Guild membership
+#================================================================================================
+# GUILD_MEMBERS mirrors which users are in which of the bot's servers, so leaderboards can be
+# limited to a server with a JOIN instead of asking discord.py about every row. It is kept up to
+# date by the member/guild events and fully reconciled against the gateway data on startup.
+#================================================================================================
+
+def ensure_guild_members_table(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS GUILD_MEMBERS
+                 (serverID TEXT, userID TEXT, PRIMARY KEY (serverID, userID)) WITHOUT ROWID''')
+    # Servers of one user, for picking the channels a PB is announced in
+    c.execute('CREATE INDEX IF NOT EXISTS idx_GUILD_MEMBERS_user ON GUILD_MEMBERS (userID, serverID)')
+
+
+def add_member(server_id, user_id):
+    with db.writer() as conn:
+        conn.execute('INSERT OR IGNORE INTO GUILD_MEMBERS (serverID, userID) VALUES (?, ?)', (str(server_id), str(user_id)))
+
+
+def remove_member(server_id, user_id):
+    with db.writer() as conn:
+        conn.execute('DELETE FROM GUILD_MEMBERS WHERE serverID = ? AND userID = ?', (str(server_id), str(user_id)))
+
+
+def remove_guild(server_id):
+    with db.writer() as conn:
+        conn.execute('DELETE FROM GUILD_MEMBERS WHERE serverID = ?', (str(server_id),))
+
+
+def sync_guild(server_id, member_ids):
+    """Make the stored members of one server match member_ids. Returns (added, removed)."""
+    server_id = str(server_id)
+    member_ids = {str(member_id) for member_id in member_ids}
+    with db.writer() as conn:
+        stored = {row[0] for row in conn.execute('SELECT userID FROM GUILD_MEMBERS WHERE serverID = ?', (server_id,))}
+        added = member_ids - stored
+        removed = stored - member_ids
+        conn.executemany('INSERT INTO GUILD_MEMBERS (serverID, userID) VALUES (?, ?)', [(server_id, user_id) for user_id in added])
+        conn.executemany('DELETE FROM GUILD_MEMBERS WHERE serverID = ? AND userID = ?', [(server_id, user_id) for user_id in removed])
+    return len(added), len(removed)
+
+
+def reconcile_guilds(members_by_guild, logger=logging):
+    """Startup sync against the member lists discord.py received, as {serverID: [userID, ...]}."""
+    server_ids = [str(server_id) for server_id in members_by_guild]
+    with db.writer() as conn:
+        placeholders = ', '.join('?' * len(server_ids))
+        c = conn.execute(f'DELETE FROM GUILD_MEMBERS WHERE serverID NOT IN ({placeholders})', server_ids)
+        left = c.rowcount
+
+    added = removed = 0
+    for server_id, member_ids in members_by_guild.items():
+        guild_added, guild_removed = sync_guild(server_id, member_ids)
+        added += guild_added
+        removed += guild_removed
+    logger.info(f"Guild members reconciled: {added} added, {removed + left} removed across {len(server_ids)} servers")
+
+
+def guild_top_scores(table_name, chart_hash, server_id, count):
+    """Best scores on a chart among the members of one server, as (userID, exScore)."""
+    # Walks idx_<table>_hash_ex best first and stops after `count` members
+    with db.reader() as conn:
+        return conn.execute(f'''SELECT s.userID, s.exScore FROM {table_name} AS s
+                                JOIN GUILD_MEMBERS AS m ON m.serverID = ? AND m.userID = s.userID
+                                WHERE s.hash = ? ORDER BY s.exScore DESC LIMIT ?''',
+                            (str(server_id), chart_hash, count)).fetchall()
+
+
+def announcement_channels(conn, user_id):
+    """Result channels of every server the user is in."""
+    return [row[0] for row in conn.execute('''SELECT c.channelID FROM CHANNELS AS c
+                                               JOIN GUILD_MEMBERS AS m ON m.serverID = c.serverID
+                                               WHERE m.userID = ?''', (str(user_id),))]
@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+import time
+
+from utility.database import db
+from utility.packing import pack_scatter
+from utility.schema import table_slot, is_course_table
+
+#================================================================================================
+# Play history
+#================================================================================================
+# The score tables only keep the best score per (user, chart). Every accepted submission is
+# also appended to SCORE_HISTORY, which is kept small: the score table is stored as its slot
+# number, the date as epoch seconds and the scatter only if HISTORY_SCATTER=true.
+#
+# Retention: plays younger than HISTORY_FULL_DAYS (default 90) are all kept. Older plays are
+# downsampled to the best play per user, chart and week, and lose their scatter.
+#================================================================================================
+
+WEEK = 7 * 24 * 3600
+
+
+def ensure_history_table(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS SCORE_HISTORY
+                 (userID TEXT, tableSlot INTEGER, hash TEXT, exScore REAL, itgScore REAL, grade TEXT,
+                  mods TEXT, played INTEGER, scatter BLOB)''')
+    # Progress of one user on one chart is a range scan over this index
+    c.execute('CREATE INDEX IF NOT EXISTS idx_SCORE_HISTORY_user_hash_played ON SCORE_HISTORY (userID, hash, played)')
+
+
+def record_play(conn, table_name, user_id, data, played=None):
+    scatter = None
+    if not is_course_table(table_name) and os.getenv('HISTORY_SCATTER', 'false').lower() == 'true':
+        scatter = pack_scatter(data.get('scatterplotData'))
+
+    conn.execute('''INSERT INTO SCORE_HISTORY (userID, tableSlot, hash, exScore, itgScore, grade, mods, played, scatter)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                 (user_id, table_slot(table_name), data.get('hash'), float(data.get('exScore')), data.get('itgScore'),
+                  data.get('grade'), data.get('mods'), int(played or time.time()), scatter))
+
+
+def fails_table(table_name):
+    """SINGLES_PUMP -> SINGLESFAILS_PUMP"""
+    if 'FAILS' in table_name:
+        return table_name
+    if table_name.endswith('_PUMP'):
+        return table_name[:-len('_PUMP')] + 'FAILS_PUMP'
+    return table_name + 'FAILS'
+
+
+def fetch_progress(user_id, table_name, chart_hash):
+    """(played, exScore, failed) of every recorded play on a chart, oldest first."""
+    passed_slot = table_slot(table_name)
+    failed_slot = table_slot(fails_table(table_name))
+    with db.reader() as conn:
+        rows = conn.execute('''SELECT played, exScore, tableSlot FROM SCORE_HISTORY
+                               WHERE userID = ? AND hash = ? AND tableSlot IN (?, ?) ORDER BY played''',
+                            (user_id, chart_hash, passed_slot, failed_slot)).fetchall()
+    return [(row[0], row[1], row[2] == failed_slot) for row in rows]
+
+
+def prune_history(full_days=90, logger=logging):
+    cutoff = int(time.time()) - full_days * 24 * 3600
+    with db.writer() as conn:
+        c = conn.cursor()
+        c.execute(f'''DELETE FROM SCORE_HISTORY WHERE played < ? AND rowid NOT IN
+                      (SELECT rowid FROM
+                          (SELECT rowid, ROW_NUMBER() OVER (PARTITION BY userID, tableSlot, hash, played / {WEEK}
+                                                            ORDER BY exScore DESC) AS position
+                           FROM SCORE_HISTORY WHERE played < ?)
+                       WHERE position = 1)''', (cutoff, cutoff))
+        removed = c.rowcount
+        c.execute('UPDATE SCORE_HISTORY SET scatter = NULL WHERE played < ? AND scatter IS NOT NULL', (cutoff,))
+    if removed:
+        logger.info(f"Downsampled play history, removed {removed} plays older than {full_days} days")
+    return removed
+
+
+def start_history_retention(logger=logging):
+    full_days = int(os.getenv('HISTORY_FULL_DAYS', '90'))
+
+    def retention_worker():
+        while True:
+            try:
+                prune_history(full_days, logger)
+            except Exception:
+                logger.exception("Play history retention failed")
+            time.sleep(24 * 3600)
+
+    thread = threading.Thread(target=retention_worker, daemon=True, name='history-retention')
+    thread.start()
+    return thread
@@ -0,0 +1,139 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from utility.database import db
+from utility import metrics
+
+#================================================================================================
+# Batched submission writer
+#================================================================================================
+# Every /send used to open its own write transaction, so a burst of submissions meant a burst of
+# commits fighting over the SQLite lock. Request threads now put a job on a bounded queue and
+# wait on a future. One writer thread drains the queue and runs everything that arrived within
+# a few milliseconds in a single transaction. Each job runs in its own savepoint, so a failing
+# submission only rolls back itself. Futures are completed after the commit.
+#
+# A request that gives up waiting cancels its future. Jobs are marked running only inside the
+# write transaction, so a cancelled job is never written and the client can safely send it
+# again. Once a job is running the cancel fails and the request has to wait for the commit.
+#================================================================================================
+
+class QueueFull(Exception):
+    pass
+
+
+class SubmissionWriter:
+    def __init__(self, manager, max_queue=256, max_batch=64, batch_window=0.005, logger=logging):
+        self.manager = manager
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.logger = logger
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submissions': 0,
+            'batches': 0,
+            'failed_jobs': 0,
+            'cancelled_jobs': 0,
+            'rejected': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_commit_ms': 0.0,
+            'max_commit_ms': 0.0,
+            'total_commit_ms': 0.0,
+        }
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='submission-writer')
+            self._thread.start()
+
+    def submit(self, job, *args):
+        """Queue job(conn, *args) for the writer thread. Raises QueueFull instead of blocking."""
+        future = Future()
+        try:
+            self._queue.put_nowait((job, args, future))
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['rejected'] += 1
+            raise QueueFull(f"Submission queue is full ({self._queue.maxsize} pending)")
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_batch(self, batch):
+        outcomes = []
+        cancelled = 0
+        start = time.perf_counter()
+        try:
+            with self.manager.writer() as conn:
+                for job, args, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        cancelled += 1
+                        continue
+                    conn.execute('SAVEPOINT submission')
+                    try:
+                        outcomes.append((future, job(conn, *args), None))
+                        conn.execute('RELEASE submission')
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO submission')
+                        conn.execute('RELEASE submission')
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            self.logger.error(f"Submission batch of {len(batch)} failed to commit: {e}")
+            # Jobs the loop had not reached yet are claimed here, unless their request gave up
+            outcomes = [(future, None, e) for _, _, future in batch if future.running() or future.set_running_or_notify_cancel()]
+        commit_ms = (time.perf_counter() - start) * 1000
+
+        failed = 0
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                failed += 1
+                future.set_exception(error)
+
+        with self._stats_lock:
+            self._stats['submissions'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['failed_jobs'] += failed
+            self._stats['cancelled_jobs'] += cancelled
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+            self._stats['last_commit_ms'] = commit_ms
+            self._stats['max_commit_ms'] = max(self._stats['max_commit_ms'], commit_ms)
+            self._stats['total_commit_ms'] += commit_ms
+
+    def _run(self):
+        while True:
+            self._run_batch(self._next_batch())
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = stats['batches'] or 1
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_batch_size'] = round(stats['submissions'] / batches, 2)
+        stats['avg_commit_ms'] = round(stats.pop('total_commit_ms') / batches, 2)
+        stats['last_commit_ms'] = round(stats['last_commit_ms'], 2)
+        stats['max_commit_ms'] = round(stats['max_commit_ms'], 2)
+        return stats
+
+
+submission_writer = SubmissionWriter(db)
+metrics.register('ingest', submission_writer.stats)
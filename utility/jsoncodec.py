@@ -0,0 +1,62 @@
+import ast
+import json
+import logging
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#================================================================================================
+# JSON codec
+#================================================================================================
+# Request bodies, the judgements column, radar and course entries go through loads()/dumps()
+# here. orjson is used when it is installed (parses the large submission bodies several times
+# faster), the standard library otherwise. JSON_CODEC=json forces the standard library, run
+# python -m utility.bench_json to compare them on the scores in the database.
+#
+# Radar and course entries used to be stored as str() of the Python value. loads_stored()
+# reads those as well as JSON, new rows are written with dumps().
+#================================================================================================
+
+
+def _std_dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+def _orjson_dumps(value):
+    return orjson.dumps(value).decode('utf-8')
+
+
+# name -> (loads, dumps), loads takes str or bytes, dumps returns str
+CODECS = {'json': (json.loads, _std_dumps)}
+if orjson is not None:
+    CODECS['orjson'] = (orjson.loads, _orjson_dumps)
+
+
+def _configured(logger=logging):
+    name = os.getenv('JSON_CODEC', 'auto').lower()
+    if name == 'auto':
+        return 'orjson' if orjson is not None else 'json'
+    if name not in CODECS:
+        logger.warning(f"JSON_CODEC '{name}' is not available, using json")
+        return 'json'
+    return name
+
+
+NAME = _configured()
+loads, dumps = CODECS[NAME]
+
+
+def loads_stored(value, default=None):
+    """Radar/entries column value, stored as JSON or (older rows) as str() of the Python value."""
+    if not value:
+        return default
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value).decode('utf-8')
+    try:
+        return loads(value)
+    except ValueError:
+        # repr() rows, with None/True and quotes inside strings JSON would not accept
+        return ast.literal_eval(value)
@@ -0,0 +1,94 @@
+import numpy as np
+
+from utility import jsoncodec
+from utility.library import set_scale, scale
+from utility.packing import as_point_arrays
+
+#================================================================================================
+# Judgement counts and timing statistics
+#================================================================================================
+# Everything /breakdown shows about a score's timing only depends on the scatter points and the
+# worst window, so it is computed once when the score is submitted and stored next to it.
+#
+# The scatter y axis runs from 0 (late end of the worst window) to 200 (early end), 100 is dead
+# on. 200 also marks misses (each miss is drawn as two points), 0 is a point without timing.
+# set_scale() gives the judgement boundaries on that axis, late ones below 100, early above:
+#
+#   l_wo < l_de < l_gr < l_ex < l_fa < l_fap | e_fap < e_fa < e_ex < e_gr < e_de < e_wo
+#
+# Late windows are closed towards the late end ([l_de, l_gr) is a late decent), early windows
+# towards dead on ((e_fap, e_fa] is an early fantastic), FA+ is [l_fap, e_fap].
+#================================================================================================
+
+JUDGEMENTS = ['fa_p', 'e_fa', 'l_fa', 'e_ex', 'l_ex', 'e_gr', 'l_gr', 'e_de', 'l_de', 'e_wo', 'l_wo', 'miss']
+
+_boundaries = ['l_wo', 'l_de', 'l_gr', 'l_ex', 'l_fa', 'l_fap', 'e_fap', 'e_fa', 'e_ex', 'e_gr', 'e_de', 'e_wo']
+# Bucket i holds the points between boundary i and i + 1, the FA+ bucket spans l_fap..e_fap
+_buckets = ['l_wo', 'l_de', 'l_gr', 'l_ex', 'l_fa', 'fa_p', 'e_fa', 'e_ex', 'e_gr', 'e_de', 'e_wo']
+
+# Score table columns, see utility.schema
+STAT_COLUMNS = ['meanAbsError', 'meanError', 'stdDev3', 'maxError']
+
+
+def count_judgements(y, worst_window):
+    jt = set_scale(worst_window)
+    # Compare in the precision of the points, like the per-point comparisons this replaces
+    bounds = np.array([jt[name] for name in _boundaries], dtype=y.dtype)
+    y = y[y != 0]
+
+    late = np.searchsorted(bounds, y, side='right') - 1
+    early = np.searchsorted(bounds, y, side='left') - 1
+    bucket = np.where(y < bounds[5], late, np.where(y > bounds[6], early, _buckets.index('fa_p')))
+
+    # With a worst window narrower than way off the top of the graph lies inside an early window,
+    # those points were always counted as that judgement. Only a window ending exactly on 200
+    # leaves them to the misses.
+    top = np.searchsorted(bounds, 200, side='left')
+    if top <= _boundaries.index('e_fap'):
+        top_is_judged = True    # FA+ is closed on both ends
+    elif top == len(bounds) - 1:
+        top_is_judged = bool(bounds[-1] > 200)
+    else:
+        top_is_judged = top < len(bounds) and jt[_boundaries[top]] != 200
+    judged = (y > bounds[0]) & (y < bounds[-1])
+    if not top_is_judged:
+        judged &= y != 200
+
+    counts = np.bincount(bucket[judged], minlength=len(_buckets))
+    judgements = {name: int(counts[index]) for index, name in enumerate(_buckets)}
+    judgements['miss'] = 0 if top_is_judged else int(np.count_nonzero(y == 200) // 2)
+    return {name: judgements[name] for name in JUDGEMENTS}
+
+
+def timing_stats(y, worst_window):
+    """Offsets in ms, rounded the way /breakdown always showed them. None without timed points."""
+    y = 100 - y[(y != 0) & (y != 200)].astype(np.float64)
+    if not len(y):
+        return None
+
+    worst_window = float(worst_window)
+    y_scaled = np.round(1000 * scale(y, -100, 100, -worst_window, worst_window), 1)
+    return {
+        #NOTE: reimplemented from Simply-Love-SM5/BGAnimations/ScreenEvaluation common/Panes/Pane5/default.lua
+        'meanAbsError': float(np.round(np.sum(np.abs(y_scaled)) / len(y_scaled))),
+        'meanError': float(np.round(np.mean(y_scaled), 1)),
+        'stdDev3': float(np.round(np.std(y_scaled) * 3, 1)),
+        'maxError': float(np.round(np.max(np.abs(y_scaled)), 1)),
+    }
+
+
+def compute_breakdown(scatter, worst_window):
+    """(judgements, timing stats) of a score, (None, None) if it has no usable scatter data."""
+    if worst_window is None or scatter is None:
+        return None, None
+    y = as_point_arrays(scatter)['y']
+    if not len(y):
+        return None, None
+    return count_judgements(y, worst_window), timing_stats(y, worst_window)
+
+
+def breakdown_values(judgements, stats):
+    """Values for the judgements + STAT_COLUMNS score table columns."""
+    stats = stats or {}
+    return (jsoncodec.dumps(judgements) if judgements else None,) + tuple(stats.get(column) for column in STAT_COLUMNS)
+
@@ -1,6 +1,9 @@
-import json
 from urllib.parse import urlparse
 
+from utility import jsoncodec
+from utility.codec import decode
+from utility.packing import as_point_arrays
+
 #================================================================================================
 # Get bare domain from URL
 #================================================================================================
@@ -96,42 +99,50 @@ def reduce_precision(data, decimal_places=3):
 # Data from database to dict
 #================================================================================================
 
-def extract_data_from_row(row):
+# Rows come from listing queries (see utility.schema.listing_columns), the payload from
+# utility.payloads.fetch_payload for the one selected score. Both may hold compressed values
+# (see utility.codec).
+
+def extract_data_from_row(row, payload=None):
+    payload = payload or {}
     return {
-        'songName': row[1],
-        'artist': row[2],
-        'pack': row[3],
-        'difficulty': row[4],
-        'itgScore': row[5],
-        'exScore': row[6],
-        'grade': row[7],
-        'length': row[8],
-        'stepartist': row[9],
-        'hash': row[10],
-        'scatterplotData': json.loads(row[11].replace("'", '"') if row[11] else '[]'),
-        'lifebarInfo': json.loads(row[12].replace("'", '"') if row[12] else '[]'),
-        'worstWindow': row[13],
-        'date': row[14],
-        'mods': row[15],
-        'prevBestEx': row[17],
-        'radar': json.loads(row[18].replace("'", '"') if row[18] else '[]')
+        'songName': row['songName'],
+        'artist': row['artist'],
+        'pack': row['pack'],
+        'difficulty': row['difficulty'],
+        'itgScore': row['itgScore'],
+        'exScore': row['exScore'],
+        'grade': row['grade'],
+        'length': row['length'],
+        'stepartist': row['stepartist'],
+        'hash': row['hash'],
+        'scatterplotData': as_point_arrays(decode(payload.get('scatter'))),
+        'lifebarInfo': as_point_arrays(decode(payload.get('life'))),
+        'worstWindow': row['worstWindow'],
+        'date': row['date'],
+        'mods': row['mods'],
+        'prevBestEx': row['prevBestEx'],
+        'radar': jsoncodec.loads_stored(decode(payload.get('radar')), []),
+        'judgements': jsoncodec.loads(row['judgements']) if row['judgements'] else None,
+        'timingStats': {column: row[column] for column in ('meanAbsError', 'meanError', 'stdDev3', 'maxError')} if row['meanError'] is not None else None
     }
 
-def extract_course_data_from_row(row):
+def extract_course_data_from_row(row, payload=None):
+    payload = payload or {}
     return {
-        'courseName': row[1],
-        'pack': row[2],
-        'entries': json.loads(row[3].replace("'", '"') if row[3] else '[]'),
-        'scripter': row[4],
-        'difficulty': row[5],
-        'description': row[6],
-        'itgScore': row[7],
-        'exScore': row[8],
-        'grade': row[9],
-        'hash': row[10],
-        'lifebarInfo': json.loads(row[11].replace("'", '"') if row[11] else '[]'),
-        'date': row[12],
-        'mods': row[13],
-        'prevBestEx': row[14],
-        'radar': json.loads(row[15].replace("'", '"') if row[15] else '[]')
-    }
\ No newline at end of file
+        'courseName': row['courseName'],
+        'pack': row['pack'],
+        'entries': jsoncodec.loads_stored(decode(row['entries']), []),
+        'scripter': row['scripter'],
+        'difficulty': row['difficulty'],
+        'description': row['description'],
+        'itgScore': row['itgScore'],
+        'exScore': row['exScore'],
+        'grade': row['grade'],
+        'hash': row['hash'],
+        'lifebarInfo': as_point_arrays(decode(payload.get('life'))),
+        'date': row['date'],
+        'mods': row['mods'],
+        'prevBestEx': row['prevBestEx'],
+        'radar': jsoncodec.loads_stored(decode(payload.get('radar')), [])
+    }
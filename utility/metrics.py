@@ -0,0 +1,67 @@
+#================================================================================================
+# Runtime metrics registry
+#================================================================================================
+# Components register a callable that returns a flat dict of counters. The admin /stats
+# command renders whatever is registered here.
+#================================================================================================
+
+import asyncio
+import logging
+import threading
+
+_providers = {}
+
+
+def register(name, provider):
+    _providers[name] = provider
+
+
+def snapshot():
+    result = {}
+    for name, provider in _providers.items():
+        try:
+            result[name] = provider()
+        except Exception as e:
+            result[name] = {'error': str(e)}
+    return result
+
+
+#================================================================================================
+# Event loop lag
+#================================================================================================
+# A task that asks to be woken up every `interval` seconds. Anything blocking the loop delays
+# the wake up, the delay is the lag every other coroutine saw at that moment.
+#================================================================================================
+
+_loop_lock = threading.Lock()
+_loop_stats = {'samples': 0, 'last_lag_ms': 0.0, 'max_lag_ms': 0.0, 'total_lag_ms': 0.0, 'slow_ticks': 0}
+
+
+async def watch_event_loop(interval=0.5, warn_after=0.25, logger=logging):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        with _loop_lock:
+            _loop_stats['samples'] += 1
+            _loop_stats['last_lag_ms'] = lag * 1000
+            _loop_stats['max_lag_ms'] = max(_loop_stats['max_lag_ms'], lag * 1000)
+            _loop_stats['total_lag_ms'] += lag * 1000
+            if lag > warn_after:
+                _loop_stats['slow_ticks'] += 1
+        if lag > warn_after:
+            logger.warning(f"Event loop was blocked for {lag * 1000:.0f} ms")
+
+
+def event_loop_stats():
+    with _loop_lock:
+        stats = dict(_loop_stats)
+    total = stats.pop('total_lag_ms')
+    stats['avg_lag_ms'] = round(total / stats['samples'], 2) if stats['samples'] else 0.0
+    stats['last_lag_ms'] = round(stats['last_lag_ms'], 2)
+    stats['max_lag_ms'] = round(stats['max_lag_ms'], 2)
+    return stats
+
+
+register('event_loop', event_loop_stats)
@@ -0,0 +1,340 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from utility.config import database
+from utility.database import db
+from utility.codec import encode, decode, configured_codec
+from utility.judgements import STAT_COLUMNS, compute_breakdown, breakdown_values
+from utility.payloads import move_payloads
+from utility.schema import score_tables, tables_normal, tables_courses, payload_columns, is_course_table, table_slot, score_key
+from utility.squash_db_precision import backup_db, squash_rows
+
+#================================================================================================
+# Schema and data migrations
+#================================================================================================
+# Steps are registered in order with the @migration decorator. Each step has a checkpoint in
+# CONFIG.migrations (a JSON object keyed by step name), so finished steps never run again and a
+# step that was interrupted picks up where it stopped. Long data migrations go through
+# MigrationStep.for_each_batch(), which commits the checkpoint in the same transaction as the
+# batch it belongs to.
+#
+# Steps marked background=True may run in a background thread while the bot already serves
+# requests, so their readers must handle both the old and the new layout in the meantime.
+# Foreground steps always run first, they must not depend on a background step.
+#
+# VACUUM needs the database to itself and holds the write lock until it is done, which stalls
+# /send for minutes on a large database. Background steps therefore skip it unless
+# MIGRATION_VACUUM=true, run sqlite3 dbdata/database.db VACUUM with the bot stopped instead.
+# With BACKGROUND_MIGRATIONS=false the steps run before the bot starts and always compact.
+#
+# A step that has no checkpoint yet counts as applied if it belongs to a version older than the
+# one stored in CONFIG, that database was created by a bot that already had the change.
+#================================================================================================
+
+_migrations = []
+
+VACUUM_IN_BACKGROUND = os.getenv('MIGRATION_VACUUM', 'false').lower() == 'true'
+
+
+class Migration:
+    def __init__(self, name, version, function, background):
+        self.name = name
+        self.version = version
+        self.function = function
+        self.background = background
+
+
+def migration(name, version, background=False):
+    def register(function):
+        _migrations.append(Migration(name, version, function, background))
+        return function
+    return register
+
+
+def _version_tuple(value):
+    try:
+        return tuple(int(part) for part in str(value).split('.'))
+    except ValueError:
+        return ()
+
+
+class MigrationStep:
+    """Checkpoint handle passed to a migration function."""
+
+    def __init__(self, name, state, logger, background=False):
+        self.name = name
+        self.state = state
+        self.logger = logger
+        self.background = background
+
+    def save(self, conn, **values):
+        """Update the checkpoint. Use the connection of the write transaction the progress belongs to."""
+        self.state.update(values)
+        conn.execute('UPDATE CONFIG SET migrations = json_set(COALESCE(migrations, \'{}\'), ?, json(?))',
+                     (f'$."{self.name}"', json.dumps(self.state)))
+
+    def for_each_batch(self, table_name, columns, handler, where='1=1', batch_size=500, pause=0.0):
+        """
+        Call handler(conn, table_name, rows) for rows (rowid, *columns) of a table in rowid order.
+        Each batch and its checkpoint are committed together. Returns the number of rows handled.
+        """
+        positions = self.state.get('positions', {})
+        last_rowid = positions.get(table_name, 0)
+        handled = 0
+
+        while True:
+            with db.reader() as conn:
+                rows = conn.execute(
+                    f"SELECT rowid, {', '.join(columns)} FROM {table_name} WHERE rowid > ? AND ({where}) ORDER BY rowid LIMIT ?",
+                    (last_rowid, batch_size)
+                ).fetchall()
+            if not rows:
+                break
+
+            last_rowid = rows[-1][0]
+            with db.writer() as conn:
+                handler(conn, table_name, rows)
+                positions[table_name] = last_rowid
+                self.save(conn, positions=positions)
+
+            handled += len(rows)
+            if pause:
+                # Let the ingestion path grab the write lock between batches
+                time.sleep(pause)
+
+        return handled
+
+    def compact(self):
+        """VACUUM the database, unless this runs next to ingestion and MIGRATION_VACUUM is not set."""
+        if self.background and not VACUUM_IN_BACKGROUND:
+            self.logger.info(f"{self.name}: skipping VACUUM while the bot is running. Run it with the bot stopped "
+                             f"(sqlite3 {database} VACUUM) or set MIGRATION_VACUUM=true to reclaim the space.")
+            return False
+        if self.background:
+            self.logger.warning("Compacting database (VACUUM). Submissions are paused until it finishes...")
+        else:
+            self.logger.info("Compacting database (VACUUM). This might take a while...")
+        with db.exclusive() as conn:
+            conn.execute('VACUUM')
+        return True
+
+
+def _ensure_config(conn):
+    c = conn.cursor()
+    c.execute('PRAGMA table_info(CONFIG)')
+    if 'migrations' not in {row[1] for row in c.fetchall()}:
+        c.execute('ALTER TABLE CONFIG ADD COLUMN migrations TEXT')
+
+    c.execute('SELECT version, migrations FROM CONFIG')
+    row = c.fetchone()
+    if not row:
+        c.execute('INSERT INTO CONFIG (version) VALUES (NULL)')
+        return None, {}
+    return row[0], json.loads(row[1]) if row[1] else {}
+
+
+def _run_step(step, state, logger, background=False):
+    started = time.perf_counter()
+    logger.info(f"Running migration {step.name}...")
+    handle = MigrationStep(step.name, state, logger, background)
+    step.function(handle)
+    with db.writer() as conn:
+        handle.save(conn, done=True)
+    logger.info(f"Migration {step.name} finished in {time.perf_counter() - started:.1f}s")
+
+
+def _run_steps(steps, states, logger, background=False):
+    for step in steps:
+        try:
+            _run_step(step, states.get(step.name, {}), logger, background)
+        except Exception:
+            # Everything up to the last checkpoint is kept, the next start continues from there
+            logger.exception(f"Migration {step.name} failed, it will be resumed on the next start")
+            return False
+    return True
+
+
+def run_migrations(logger=logging, background=True):
+    """
+    Run every pending migration. With background=True the heavy steps run in a daemon thread,
+    which is returned. Otherwise everything runs before this returns.
+    """
+    with db.writer() as conn:
+        stored_version, states = _ensure_config(conn)
+
+        pending = []
+        for step in _migrations:
+            state = states.get(step.name)
+            if state is None and stored_version and _version_tuple(step.version) < _version_tuple(stored_version):
+                state = {'done': True, 'skipped': True}
+                MigrationStep(step.name, state, logger).save(conn)
+            states[step.name] = state or {}
+            if not states[step.name].get('done'):
+                pending.append(step)
+
+    foreground = [step for step in pending if not (background and step.background)]
+    deferred = [step for step in pending if background and step.background]
+
+    if not _run_steps(foreground, states, logger):
+        raise RuntimeError("Database migration failed, see the log above")
+
+    if deferred:
+        thread = threading.Thread(target=_run_steps, args=(deferred, states, logger, True), daemon=True, name='migrations')
+        thread.start()
+        return thread
+    return None
+
+
+#================================================================================================
+# Steps
+#================================================================================================
+
+@migration('notification_columns', '1.4.0')
+def add_notification_columns(step):
+    with db.writer() as conn:
+        c = conn.cursor()
+        c.execute('PRAGMA table_info(USERS)')
+        if 'updateNotification' not in {row[1] for row in c.fetchall()}:
+            c.execute("ALTER TABLE USERS ADD COLUMN updateNotification BOOL DEFAULT 1")
+        c.execute('PRAGMA table_info(CONFIG)')
+        if 'updateNotificationSent' not in {row[1] for row in c.fetchall()}:
+            c.execute("ALTER TABLE CONFIG ADD COLUMN updateNotificationSent BOOL DEFAULT 0")
+
+
+# Remove unnecessary precision from scatterplot and lifebar data that is still stored as text.
+# This runs serially next to ingestion, only the offline CLI is parallel
+# (python -m utility.squash_db_precision <database> --parallel, with the bot stopped).
+@migration('squash_precision', '1.4.0', background=True)
+def squash_precision(step):
+    if not step.state.get('backup'):
+        backup_db(database, step.logger)
+        with db.writer() as conn:
+            step.save(conn, backup=True)
+
+    for table_name in score_tables:
+        columns = ['life'] if is_course_table(table_name) else ['life', 'scatter']
+        step.for_each_batch(table_name, columns,
+                            lambda conn, table, rows, columns=columns: squash_rows(conn.cursor(), table, columns, rows, 3, step.logger),
+                            where=" OR ".join(f"typeof({column}) = 'text'" for column in columns), batch_size=250, pause=0.01)
+
+    step.compact()
+
+
+# Move scatter/lifebar/radar payloads out of the score tables (packing legacy text on the way).
+# fetch_payload() reads from either place while this runs.
+@migration('payload_side_table', '1.5.0', background=True)
+def move_payloads_to_side_table(step):
+    for table_name in score_tables:
+        columns = payload_columns(table_name)
+        moved = step.for_each_batch(table_name, columns, lambda conn, table, rows: move_payloads(conn, table, rows, step.logger),
+                                    where=" OR ".join(f"{column} IS NOT NULL" for column in columns), pause=0.05)
+        if moved:
+            step.logger.info(f"Moved {moved} payloads out of {table_name}")
+
+
+# Seed the play history with the scores that are already stored, so /progress has a starting point.
+# Charts that already got a play recorded since the upgrade are left alone.
+@migration('history_seed', '1.5.0', background=True)
+def seed_play_history(step):
+    date_format = os.getenv('DATE_FORMAT')
+
+    def seed(conn, table_name, rows):
+        slot = table_slot(table_name)
+        plays = []
+        for rowid, user_id, chart_hash, ex_score, itg_score, grade, mods, date in rows:
+            try:
+                played = int(datetime.strptime(date, date_format).timestamp())
+            except (TypeError, ValueError):
+                continue
+            plays.append((user_id, slot, chart_hash, ex_score, itg_score, grade, mods, played, user_id, chart_hash, slot))
+        conn.executemany('''INSERT INTO SCORE_HISTORY (userID, tableSlot, hash, exScore, itgScore, grade, mods, played)
+                            SELECT ?, ?, ?, ?, ?, ?, ?, ?
+                            WHERE NOT EXISTS (SELECT 1 FROM SCORE_HISTORY WHERE userID = ? AND hash = ? AND tableSlot = ?)''', plays)
+
+    for table_name in score_tables:
+        step.for_each_batch(table_name, ['userID', 'hash', 'exScore', 'itgScore', 'grade', 'mods', 'date'], seed, pause=0.01)
+
+
+# Columns for the precomputed /breakdown data, new databases get them from normal_schema
+@migration('breakdown_columns', '1.5.0')
+def add_breakdown_columns(step):
+    with db.writer() as conn:
+        c = conn.cursor()
+        for table_name in tables_normal:
+            c.execute(f'PRAGMA table_info({table_name})')
+            existing = {row[1] for row in c.fetchall()}
+            for column, column_type in [('judgements', 'TEXT')] + [(column, 'REAL') for column in STAT_COLUMNS]:
+                if column not in existing:
+                    c.execute(f'ALTER TABLE {table_name} ADD COLUMN {column} {column_type}')
+
+
+# Fill the breakdown columns of scores stored before they existed. /breakdown computes the
+# values on the fly for rows this has not reached yet.
+@migration('breakdown_backfill', '1.5.0', background=True)
+def backfill_breakdowns(step):
+    def backfill(conn, table_name, rows):
+        updates = []
+        for rowid, worst_window, scatter in rows:
+            if scatter is None:
+                payload = conn.execute('SELECT scatter FROM SCORE_PAYLOADS WHERE scoreKey = ?', (score_key(table_name, rowid),)).fetchone()
+                scatter = decode(payload[0]) if payload else None
+            try:
+                judgements, stats = compute_breakdown(scatter, worst_window)
+            except (SyntaxError, ValueError, KeyError, TypeError):
+                step.logger.warning(f"Unable to read scatter of {table_name} row {rowid}, skipping its breakdown")
+                continue
+            if judgements is not None:
+                updates.append(breakdown_values(judgements, stats) + (rowid,))
+        conn.executemany(f"UPDATE {table_name} SET judgements = ?, {', '.join(f'{column} = ?' for column in STAT_COLUMNS)} WHERE rowid = ?", updates)
+
+    for table_name in tables_normal:
+        filled = step.for_each_batch(table_name, ['worstWindow', 'scatter'], backfill,
+                                     where='judgements IS NULL AND worstWindow IS NOT NULL', batch_size=250, pause=0.01)
+        if filled:
+            step.logger.info(f"Computed breakdowns for {filled} scores in {table_name}")
+
+
+def _database_size():
+    with db.reader() as conn:
+        return conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+
+# Compress the payloads and course entries stored before utility.codec existed
+@migration('compress_payloads', '1.5.0', background=True)
+def compress_payloads(step):
+    codec = configured_codec(step.logger)
+    if codec is None:
+        step.logger.info("PAYLOAD_COMPRESSION=none, stored payloads are left uncompressed")
+        return
+
+    if 'size_before' not in step.state:
+        with db.writer() as conn:
+            step.save(conn, size_before=_database_size())
+
+    def compressor(columns):
+        def compress(conn, table_name, rows):
+            updates = []
+            for row in rows:
+                values = list(row[1:])
+                encoded = [encode(value, codec) for value in values]
+                if encoded != values:
+                    updates.append(tuple(encoded) + (row[0],))
+            conn.executemany(f"UPDATE {table_name} SET {', '.join(f'{column} = ?' for column in columns)} WHERE rowid = ?", updates)
+        return compress
+
+    columns = ['scatter', 'life', 'radar']
+    step.for_each_batch('SCORE_PAYLOADS', columns, compressor(columns), batch_size=250, pause=0.01)
+    for table_name in tables_courses:
+        step.for_each_batch(table_name, ['entries'], compressor(['entries']), where="typeof(entries) = 'text'", pause=0.01)
+
+    # Freed pages only leave the file with a VACUUM
+    if not step.compact():
+        return
+
+    size_before, size_after = step.state['size_before'], _database_size()
+    step.logger.info(f"Payload compression saved {(size_before - size_after) / 1048576:.1f} MB "
+                     f"({size_before / 1048576:.1f} MB -> {size_after / 1048576:.1f} MB)")
@@ -0,0 +1,126 @@
+import struct
+
+import numpy as np
+
+from utility import jsoncodec
+#================================================================================================
+# Packed point format
+#================================================================================================
+# Scatterplot and lifebar points used to be stored as str() of a list of dicts, ~50 bytes per
+# point. The packed format stores the same data as little-endian arrays:
+#
+#   header      b'SLP' + version (uint8) + kind (uint8) + point count (uint32)
+#   lifebar     x float32[n], y float32[n]
+#   scatter     palette size (uint8), palette float32[size * 4] (RGBA),
+#               x float32[n], y float32[n], palette index uint8[n]
+#
+# Scatter colors are really just the judgement colors, so a point costs 9 bytes instead of 50.
+# In memory the points are a dict of NumPy arrays: {'x': ..., 'y': ..., 'color': (n, 4)}.
+#================================================================================================
+
+MAGIC = b'SLP'
+FORMAT_VERSION = 1
+KIND_LIFEBAR = 1
+KIND_SCATTER = 2
+
+_header = struct.Struct('<3sBBI')
+
+
+def empty_points():
+    return {
+        'x': np.empty(0, dtype=np.float32),
+        'y': np.empty(0, dtype=np.float32),
+        'color': np.empty((0, 4), dtype=np.float32),
+    }
+
+
+def _points_from_list(points):
+    if not points:
+        return empty_points()
+    x = np.fromiter((point['x'] for point in points), dtype=np.float32, count=len(points))
+    y = np.fromiter((point['y'] for point in points), dtype=np.float32, count=len(points))
+    arrays = {'x': x, 'y': y}
+    if 'color' in points[0]:
+        arrays['color'] = np.array([point['color'] for point in points], dtype=np.float32).reshape(-1, 4)
+    return arrays
+
+
+def parse_legacy_points(text):
+    """Reader for the old str(list of dicts) format."""
+    return jsoncodec.loads_stored(text, [])
+
+
+def as_point_arrays(value):
+    """Accepts packed bytes, legacy text, a list of point dicts or already decoded arrays."""
+    if value is None:
+        return empty_points()
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return unpack_points(bytes(value))
+    if isinstance(value, str):
+        value = parse_legacy_points(value)
+    return _points_from_list(value)
+
+
+def is_packed(value):
+    return isinstance(value, bytes) and value[:3] == MAGIC
+
+
+def pack_lifebar(points):
+    if points is None:
+        return None
+    arrays = as_point_arrays(points)
+    count = len(arrays['x'])
+    return b''.join((
+        _header.pack(MAGIC, FORMAT_VERSION, KIND_LIFEBAR, count),
+        arrays['x'].astype('<f4').tobytes(),
+        arrays['y'].astype('<f4').tobytes(),
+    ))
+
+
+def pack_scatter(points):
+    if points is None:
+        return None
+    arrays = as_point_arrays(points)
+    count = len(arrays['x'])
+    colors = arrays.get('color')
+    if colors is None:
+        colors = np.zeros((count, 4), dtype=np.float32)
+
+    palette, indices = np.unique(colors.astype('<f4'), axis=0, return_inverse=True)
+    if len(palette) > 255:
+        raise ValueError(f"Too many distinct scatterplot colors to pack ({len(palette)})")
+
+    return b''.join((
+        _header.pack(MAGIC, FORMAT_VERSION, KIND_SCATTER, count),
+        struct.pack('<B', len(palette)),
+        palette.astype('<f4').tobytes(),
+        arrays['x'].astype('<f4').tobytes(),
+        arrays['y'].astype('<f4').tobytes(),
+        indices.reshape(-1).astype(np.uint8).tobytes(),
+    ))
+
+
+def unpack_points(blob):
+    magic, version, kind, count = _header.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a packed point blob")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported packed point format version {version}")
+
+    offset = _header.size
+    if kind == KIND_LIFEBAR:
+        x = np.frombuffer(blob, dtype='<f4', count=count, offset=offset)
+        y = np.frombuffer(blob, dtype='<f4', count=count, offset=offset + 4 * count)
+        return {'x': x, 'y': y}
+
+    palette_size = blob[offset]
+    offset += 1
+    palette = np.frombuffer(blob, dtype='<f4', count=palette_size * 4, offset=offset).reshape(-1, 4)
+    offset += palette_size * 16
+    x = np.frombuffer(blob, dtype='<f4', count=count, offset=offset)
+    y = np.frombuffer(blob, dtype='<f4', count=count, offset=offset + 4 * count)
+    indices = np.frombuffer(blob, dtype=np.uint8, count=count, offset=offset + 8 * count)
+    color = palette[indices] if palette_size else np.zeros((count, 4), dtype=np.float32)
+    return {'x': x, 'y': y, 'color': color}
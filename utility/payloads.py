@@ -0,0 +1,76 @@
+import logging
+
+from utility.database import db
+from utility.packing import parse_legacy_points, pack_scatter, pack_lifebar
+from utility.schema import score_tables, payload_columns, table_slot, score_key, SLOTS
+
+#================================================================================================
+# Score payloads (scatter, lifebar, radar)
+#================================================================================================
+# The per-point data is by far the largest part of a score and is only needed when a single
+# score gets displayed. It lives in SCORE_PAYLOADS keyed by score key (see utility.schema), so
+# listing queries never read it. Rows that have not been migrated yet still carry the payload
+# in the score table itself, fetch_payload() falls back to those columns.
+#================================================================================================
+
+def ensure_payload_table(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS SCORE_PAYLOADS
+                 (scoreKey INTEGER PRIMARY KEY, scatter BLOB, life BLOB, radar TEXT)''')
+    for table_name in score_tables:
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS payload_{table_name}_delete AFTER DELETE ON {table_name} BEGIN
+                        DELETE FROM SCORE_PAYLOADS WHERE scoreKey = old.rowid * {SLOTS} + {table_slot(table_name)};
+                      END''')
+
+
+def save_payload(conn, table_name, score_rowid, scatter, life, radar):
+    conn.execute('INSERT OR REPLACE INTO SCORE_PAYLOADS (scoreKey, scatter, life, radar) VALUES (?, ?, ?, ?)',
+                 (score_key(table_name, score_rowid), scatter, life, radar))
+
+
+def fetch_payload(table_name, score_rowid):
+    with db.reader() as conn:
+        c = conn.cursor()
+        c.execute('SELECT scatter, life, radar FROM SCORE_PAYLOADS WHERE scoreKey = ?', (score_key(table_name, score_rowid),))
+        row = c.fetchone()
+        if row:
+            return {'scatter': row[0], 'life': row[1], 'radar': row[2]}
+
+        columns = payload_columns(table_name)
+        c.execute(f"SELECT {', '.join(columns)} FROM {table_name} WHERE rowid = ?", (score_rowid,))
+        row = c.fetchone()
+        return dict(zip(columns, row)) if row else {}
+
+
+#================================================================================================
+# Moving payloads out of the score tables (see the payload migration in utility.migrations)
+#================================================================================================
+
+def _pack_legacy(column_name, value):
+    if not isinstance(value, str):
+        return value
+    if column_name == 'scatter':
+        return pack_scatter(parse_legacy_points(value))
+    if column_name == 'life':
+        return pack_lifebar(parse_legacy_points(value))
+    return value
+
+
+def move_payloads(conn, table_name, rows, logger=logging):
+    """Move the payloads of already fetched (rowid, *payload_columns) rows to SCORE_PAYLOADS."""
+    columns = payload_columns(table_name)
+    clear = ", ".join(f"{column} = NULL" for column in columns)
+
+    payloads = []
+    for row in rows:
+        values = dict(zip(columns, row[1:]))
+        try:
+            values = {column: _pack_legacy(column, value) for column, value in values.items()}
+        except (SyntaxError, ValueError, KeyError, TypeError):
+            logger.warning(f"Unable to pack payload of {table_name} row {row[0]}, moving it as legacy text")
+        payloads.append((score_key(table_name, row[0]), values.get('scatter'), values.get('life'), values.get('radar')))
+
+    # A payload written by a newer submission wins over the stale one in the score table
+    conn.executemany('INSERT OR IGNORE INTO SCORE_PAYLOADS (scoreKey, scatter, life, radar) VALUES (?, ?, ?, ?)', payloads)
+    conn.executemany(f"UPDATE {table_name} SET {clear} WHERE rowid = ?", [(row[0],) for row in rows])
+    return len(payloads)
@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
 from utility.library import *
+from utility.packing import as_point_arrays
 import io
 import discord
 
@@ -14,9 +15,13 @@ import discord
 def create_scatterplot_from_json(data, lifebar_info, output_file='scatterplot.png'):
     import logging
     
+    if data is not None:
+        data = as_point_arrays(data)
+    lifebar_info = as_point_arrays(lifebar_info)
+
     # Log data point counts for debugging
-    data_points = len(data) if data else 0
-    lifebar_points = len(lifebar_info) if lifebar_info else 0
+    data_points = len(data['x']) if data is not None else 0
+    lifebar_points = len(lifebar_info['x'])
     logging.info(f"Creating scatterplot with {data_points} data points and {lifebar_points} lifebar points")
 
     # Set plot size
@@ -31,12 +36,13 @@ def create_scatterplot_from_json(data, lifebar_info, output_file='scatterplot.pn
 
     if data is not None:
         # Extract x, y, and color values, excluding points with y=0 or y=200 (misses)
-        x_values = [point['x'] for point in data if point['y'] not in [0, 200]]
-        y_values = [-point['y'] for point in data if point['y'] not in [0, 200]]
-        colors = [point['color'] for point in data if point['y'] not in [0, 200]]
+        hits = (data['y'] != 0) & (data['y'] != 200)
+        x_values = data['x'][hits]
+        y_values = -data['y'][hits]
+        colors = data['color'][hits]
         
         # Create the density plot
-        x_dens = [point['x'] for point in data if point['y'] not in [0]]
+        x_dens = data['x'][data['y'] != 0]
         density = np.histogram(x_dens, bins=40, density=True)
         x_density = (density[1][1:] + density[1][:-1]) / 2
         y_density = density[0]
@@ -52,15 +58,14 @@ def create_scatterplot_from_json(data, lifebar_info, output_file='scatterplot.pn
         ax1.scatter(x_values, y_values, c=colors, marker='s', s=5)
         
         # Add vertical lines for all points with y=200 (misses)
-        for point in data:
-            if point['y'] == 200:
-                vertical_line_color = point['color']
-                ax1.axvline(x=point['x'], color=vertical_line_color, linestyle='-')
+        misses = data['y'] == 200
+        for miss_x, vertical_line_color in zip(data['x'][misses], data['color'][misses]):
+            ax1.axvline(x=miss_x, color=vertical_line_color, linestyle='-')
     
 
     # Extract lifebarInfo data points
-    lifebar_x_values = [point['x'] for point in lifebar_info]
-    lifebar_y_values = [-200 + point['y'] for point in lifebar_info]
+    lifebar_x_values = lifebar_info['x']
+    lifebar_y_values = -200 + lifebar_info['y']
 
     # Plot lifebarInfo as a continuous line
     ax1.plot(lifebar_x_values, lifebar_y_values, color='white', linestyle='-', linewidth=2)
@@ -92,12 +97,14 @@ def create_scatterplot_from_json(data, lifebar_info, output_file='scatterplot.pn
 def create_distribution_from_json(data, worstWindow,  output_file='distribution.png'):
     import logging
     
+    data = as_point_arrays(data)
+
     # Log data point counts for debugging
-    data_points = len(data) if data else 0
+    data_points = len(data['x'])
     logging.info(f"Creating distribution plot with {data_points} data points")
 
     # Assuming x_values and y_values are already defined
-    y_values = [point['y'] for point in data if point['y'] not in [0, 200]]
+    y_values = data['y'][(data['y'] != 0) & (data['y'] != 200)]
     
     jt = set_scale(worstWindow)
 
@@ -140,6 +147,44 @@ def create_distribution_from_json(data, worstWindow,  output_file='distribution.
     plt.savefig(output_file, bbox_inches='tight', pad_inches=0)
     plt.close()
 
+#================================================================================================
+# Progress over time
+#================================================================================================
+
+# /progress renders in a worker thread, so this builds a bare Figure instead of going through
+# pyplot, whose current-figure state is shared with the plots drawn on the event loop
+def create_progress_plot(plays, output_file='progress.png'):
+    from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+    from matplotlib.figure import Figure
+    from datetime import datetime
+
+    played = np.array([datetime.fromtimestamp(play[0]) for play in plays])
+    ex_scores = np.array([play[1] for play in plays], dtype=np.float64)
+    failed = np.array([play[2] for play in plays], dtype=bool)
+    # Fails never count as the best score, fmax skips the NaNs
+    best = np.fmax.accumulate(np.where(failed, np.nan, ex_scores))
+
+    fig = Figure(figsize=(10, 4))
+    ax = fig.subplots()
+    ax.step(played, best, where='post', color='#21cce8', linewidth=2, label='Best EX')
+    ax.scatter(played[~failed], ex_scores[~failed], color='white', s=18, zorder=3, label='Pass')
+    if failed.any():
+        ax.scatter(played[failed], ex_scores[failed], color='#ff5555', marker='x', s=18, zorder=3, label='Fail')
+
+    locator = AutoDateLocator()
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+    ax.set_ylabel('EX Score (%)', color='white')
+    ax.tick_params(colors='white')
+    for spine in ax.spines.values():
+        spine.set_color('#555555')
+    ax.grid(color='#333333', linestyle='-', linewidth=0.5)
+    ax.legend(facecolor='black', edgecolor='#555555', labelcolor='white', loc='best')
+    ax.set_facecolor('black')
+    fig.patch.set_facecolor('black')
+
+    fig.savefig(output_file, bbox_inches='tight')
+
 def build_plot_attachment(plotter, attachment_name, *plot_args):
     buffer = io.BytesIO()
     plotter(*plot_args, output_file=buffer)
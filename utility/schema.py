@@ -0,0 +1,163 @@
+import logging
+import sqlite3
+
+#================================================================================================
+# Score tables
+#================================================================================================
+
+normal_schema = '''
+             (userID TEXT, songName TEXT, artist TEXT, pack TEXT, difficulty INTEGER,
+              itgScore REAL, exScore REAL, grade TEXT, length TEXT, stepartist TEXT, hash TEXT,
+              scatter JSON, life JSON, worstWindow TEXT, date TEXT, mods TEXT, description TEXT, prevBestEx REAL, radar JSON,
+              judgements TEXT, meanAbsError REAL, meanError REAL, stdDev3 REAL, maxError REAL)
+              '''
+course_schema = '''
+             (userID TEXT, courseName TEXT, pack TEXT, entries TEXT, scripter TEXT, difficulty INTEGER,
+              description TEXT, itgScore REAL, exScore REAL, grade TEXT, hash TEXT,
+              life JSON, date TEXT, mods TEXT, prevBestEx REAL, radar JSON)
+              '''
+
+tables_normal = [
+    'SINGLES', 'SINGLESFAILS', 'DOUBLES', 'DOUBLESFAILS',
+    'SINGLES_PUMP', 'SINGLESFAILS_PUMP', 'DOUBLES_PUMP', 'DOUBLESFAILS_PUMP'
+]
+tables_courses = [
+    'COURSESSINGLES', 'COURSESSINGLESFAILS', 'COURSESDOUBLES', 'COURSESDOUBLESFAILS',
+    'COURSESSINGLES_PUMP', 'COURSESSINGLESFAILS_PUMP', 'COURSESDOUBLES_PUMP', 'COURSESDOUBLESFAILS_PUMP'
+]
+score_tables = tables_normal + tables_courses
+
+
+# Column lists without the heavy per-point payloads (scatter, life, radar). Those live in
+# SCORE_PAYLOADS and are only loaded for the one score that is actually displayed.
+# judgements and the timing columns are precomputed from the scatter, see utility.judgements.
+song_columns = [
+    'userID', 'songName', 'artist', 'pack', 'difficulty', 'itgScore', 'exScore', 'grade', 'length',
+    'stepartist', 'hash', 'worstWindow', 'date', 'mods', 'description', 'prevBestEx',
+    'judgements', 'meanAbsError', 'meanError', 'stdDev3', 'maxError'
+]
+course_columns = [
+    'userID', 'courseName', 'pack', 'entries', 'scripter', 'difficulty', 'description', 'itgScore',
+    'exScore', 'grade', 'hash', 'date', 'mods', 'prevBestEx'
+]
+
+
+# Fields a /send body must have (the point lists come on top, they may arrive as chunks)
+song_submission_keys = [
+    'songName', 'artist', 'pack', 'length', 'stepartist', 'difficulty', 'description',
+    'itgScore', 'exScore', 'grade', 'hash', 'worstWindow', 'style', 'mods', 'radar', 'gameMode'
+]
+course_submission_keys = [
+    'courseName', 'pack', 'entries', 'hash', 'scripter', 'itgScore', 'description',
+    'exScore', 'grade', 'style', 'mods', 'difficulty', 'radar', 'gameMode'
+]
+
+
+def is_course_table(table):
+    return table.startswith('COURSES')
+
+
+def submission_table(data):
+    """Score table of a submission, e.g. COURSESDOUBLESFAILS_PUMP."""
+    table = 'COURSES' if data.get('courseName') else ''
+    table += 'DOUBLES' if data.get('style') == 'double' else 'SINGLES'
+    if data.get('grade') == 'Grade_Failed':
+        table += 'FAILS'
+    if data.get('gameMode') == 'pump':
+        table += '_PUMP'
+    return table
+
+
+def name_column(table):
+    return 'courseName' if is_course_table(table) else 'songName'
+
+
+def payload_columns(table):
+    return ['life', 'radar'] if is_course_table(table) else ['scatter', 'life', 'radar']
+
+
+def listing_columns(table):
+    """SELECT list for a score table without the payload columns, rowid first."""
+    return ', '.join(['rowid'] + (course_columns if is_course_table(table) else song_columns))
+
+
+# Tables keyed by score (search index, payloads) use one integer key for all score tables:
+#   score key = score rowid * SLOTS + index of the table in score_tables
+SLOTS = 32
+
+
+def table_slot(table):
+    return score_tables.index(table)
+
+
+def score_key(table, rowid):
+    return rowid * SLOTS + table_slot(table)
+
+
+#================================================================================================
+# Indexes
+#================================================================================================
+# (userID, hash) UNIQUE - PB lookup in /send, deleting a score, one side of the /compare and
+#                         /unplayed self-joins. Also stops duplicate rows from accumulating.
+# (hash, exScore, userID) - Leaderboard of a chart (top scores) and the hash side of the joins.
+#                           Covering, so the top scores never touch the table itself.
+# (userID, name)        - Every recall command filters by user first, then by song/course name.
+#================================================================================================
+
+def expected_indexes(table):
+    return {
+        f'idx_{table}_user_hash': f'CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_user_hash ON {table} (userID, hash)',
+        f'idx_{table}_hash_ex': f'CREATE INDEX IF NOT EXISTS idx_{table}_hash_ex ON {table} (hash, exScore DESC, userID)',
+        f'idx_{table}_user_name': f'CREATE INDEX IF NOT EXISTS idx_{table}_user_name ON {table} (userID, {name_column(table)})',
+    }
+
+
+def _remove_duplicate_scores(c, table):
+    # Keep only the best row per (userID, hash), bare rowid next to MAX() comes from the max row
+    c.execute(f'''DELETE FROM {table} WHERE rowid NOT IN
+                  (SELECT rowid FROM (SELECT rowid, MAX(exScore) FROM {table} GROUP BY userID, hash))''')
+    return c.rowcount
+
+
+def missing_indexes(conn):
+    c = conn.cursor()
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existing = {row[0] for row in c.fetchall()}
+
+    missing = []
+    for table in score_tables:
+        missing.extend(name for name in expected_indexes(table) if name not in existing)
+    return missing
+
+
+def ensure_indexes(conn, logger=logging):
+    """Idempotent index migration. Safe to run on every startup."""
+    c = conn.cursor()
+    missing = set(missing_indexes(conn))
+
+    for table in score_tables:
+        for name, statement in expected_indexes(table).items():
+            if name not in missing:
+                continue
+
+            if name.endswith('_user_hash'):
+                removed = _remove_duplicate_scores(c, table)
+                if removed:
+                    logger.warning(f"Removed {removed} duplicate scores from {table} before adding unique index")
+
+            try:
+                c.execute(statement)
+                logger.info(f"Created index {name}")
+            except sqlite3.Error as e:
+                logger.error(f"Could not create index {name}: {e}")
+
+    return report_missing_indexes(conn, logger)
+
+
+def report_missing_indexes(conn, logger=logging):
+    missing = missing_indexes(conn)
+    if missing:
+        logger.warning(f"Missing {len(missing)} database indexes, lookups will be slow: {', '.join(missing)}")
+    else:
+        logger.info("All database indexes are present.")
+    return missing
@@ -0,0 +1,75 @@
+import logging
+
+from utility.schema import score_tables, name_column, SLOTS, table_slot
+
+#================================================================================================
+# Trigram search index over song/course names, artists and packs
+#================================================================================================
+# One FTS5 table covers all score tables. Its rowid is the score key (see utility.schema),
+# so triggers can update a single entry directly and lookups map straight back to score rowids.
+# The trigram tokenizer lets FTS5 answer LIKE '%term%' from the index (for terms of 3+ chars).
+#================================================================================================
+
+def _create_triggers(c, table_name):
+    slot = table_slot(table_name)
+    name = name_column(table_name)
+    artist = 'new.artist' if name == 'songName' else 'NULL'
+
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS search_{table_name}_insert AFTER INSERT ON {table_name} BEGIN
+                    INSERT INTO SCORE_SEARCH (rowid, name, artist, pack)
+                    VALUES (new.rowid * {SLOTS} + {slot}, new.{name}, {artist}, new.pack);
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS search_{table_name}_delete AFTER DELETE ON {table_name} BEGIN
+                    DELETE FROM SCORE_SEARCH WHERE rowid = old.rowid * {SLOTS} + {slot};
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS search_{table_name}_update AFTER UPDATE OF {name}, pack{', artist' if name == 'songName' else ''} ON {table_name} BEGIN
+                    DELETE FROM SCORE_SEARCH WHERE rowid = old.rowid * {SLOTS} + {slot};
+                    INSERT INTO SCORE_SEARCH (rowid, name, artist, pack)
+                    VALUES (new.rowid * {SLOTS} + {slot}, new.{name}, {artist}, new.pack);
+                  END''')
+
+
+def rebuild_search_index(conn):
+    c = conn.cursor()
+    c.execute('DELETE FROM SCORE_SEARCH')
+    for table_name in score_tables:
+        name = name_column(table_name)
+        artist = 'artist' if name == 'songName' else 'NULL'
+        c.execute(f'''INSERT INTO SCORE_SEARCH (rowid, name, artist, pack)
+                      SELECT rowid * {SLOTS} + {table_slot(table_name)}, {name}, {artist}, pack FROM {table_name}''')
+
+
+def ensure_search_index(conn, logger=logging):
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'SCORE_SEARCH'")
+    exists = c.fetchone() is not None
+
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS SCORE_SEARCH
+                 USING fts5(name, artist, pack, tokenize = 'trigram')''')
+    for table_name in score_tables:
+        _create_triggers(c, table_name)
+
+    if not exists:
+        logger.info("Building song/course search index...")
+        rebuild_search_index(conn)
+        c.execute('SELECT COUNT(*) FROM SCORE_SEARCH')
+        logger.info(f"Search index built with {c.fetchone()[0]} entries.")
+
+
+def search_filter(table_name, name='', pack='', alias=''):
+    """SQL fragment (starting with AND) limiting a score table to rows matching name and/or pack."""
+    conditions = []
+    params = []
+    if name:
+        conditions.append('name LIKE ?')
+        params.append(f"%{name}%")
+    if pack:
+        conditions.append('pack LIKE ?')
+        params.append(f"%{pack}%")
+    if not conditions:
+        return '', []
+
+    rowid = f'{alias}.rowid' if alias else 'rowid'
+    sql = (f" AND {rowid} IN (SELECT rowid / {SLOTS} FROM SCORE_SEARCH WHERE {' AND '.join(conditions)}"
+           f" AND rowid % {SLOTS} = {table_slot(table_name)})")
+    return sql, params
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from utility import jsoncodec, metrics
+
+#================================================================================================
+# HTTP ingestion server
+#================================================================================================
+# aiohttp server running on the bot's own event loop (aiohttp comes with discord.py). The route
+# handlers are the same blocking functions the Flask app uses, they run on a small thread pool:
+#
+#   INGEST_CONCURRENCY      requests read and handled at the same time (default 8), further requests
+#                           wait before their body is read, so waiting connections buffer nothing
+#   INGEST_MAX_BODY_MB      larger request bodies are rejected with 413 (default 8)
+#   INGEST_MAX_DECODED_MB   limit for a body after Content-Encoding gzip/deflate is undone (default 32)
+#   INGEST_KEEPALIVE        seconds an idle keep-alive connection stays open (default 75)
+#   INGEST_DRAIN_SECONDS    on shutdown, how long in-flight requests get to finish (default 30)
+#
+# A handler returns (body, status) or (body, status, after). `after` is a coroutine function
+# that is started on the loop once the response is ready, for posting results to Discord
+# without run_coroutine_threadsafe. Stopping the server drains those as well.
+#================================================================================================
+
+
+class BodyError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _is_zlib_stream(raw):
+    return len(raw) >= 2 and raw[0] & 0x0F == 8 and (raw[0] * 256 + raw[1]) % 31 == 0
+
+
+def decode_body(raw, content_encoding, max_size):
+    """Undo Content-Encoding gzip/deflate. Stops decompressing as soon as max_size is exceeded.
+    Bodies the server can not decode get 415, modules resend those uncompressed."""
+    encoding = (content_encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        return raw
+    if encoding in ('gzip', 'x-gzip'):
+        wbits = 16 + zlib.MAX_WBITS
+    elif encoding == 'deflate':
+        # The standard says zlib wrapped, some clients send a raw deflate stream anyway
+        wbits = zlib.MAX_WBITS if _is_zlib_stream(raw) else -zlib.MAX_WBITS
+    else:
+        raise BodyError(415, f'Unsupported Content-Encoding: {encoding}.')
+
+    decompressor = zlib.decompressobj(wbits)
+    try:
+        body = decompressor.decompress(raw, max_size)
+    except zlib.error:
+        raise BodyError(415, f'Request body is not valid {encoding} data.')
+    if decompressor.unconsumed_tail:
+        raise BodyError(413, f'Request is too large, the limit is {max_size // 1048576} MB uncompressed.')
+    if not decompressor.eof:
+        raise BodyError(415, f'Request body is truncated {encoding} data.')
+    return body
+
+
+class IngestServer:
+    def __init__(self, host='0.0.0.0', port=5000, concurrency=8, max_body=8 * 1048576, max_decoded=32 * 1048576,
+                 keepalive=75.0, drain_timeout=30.0, logger=logging):
+        self.host = host
+        self.port = port
+        self.concurrency = concurrency
+        self.max_body = max_body
+        self.max_decoded = max_decoded
+        self.keepalive = keepalive
+        self.drain_timeout = drain_timeout
+        self.logger = logger
+        self.routes = []
+        self._executor = None
+        self._runner = None
+        self._slots = None
+        self._tasks = set()
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': 0, 'in_flight': 0, 'errors': 0, 'too_large': 0, 'compressed': 0,
+                       'compressed_bytes': 0, 'decoded_bytes': 0, 'handler_ms': 0.0}
+
+    @classmethod
+    def from_env(cls, logger=logging):
+        return cls(host=os.getenv('INGEST_HOST', '0.0.0.0'),
+                   port=int(os.getenv('INGEST_PORT', '5000')),
+                   concurrency=int(os.getenv('INGEST_CONCURRENCY', '8')),
+                   max_body=int(float(os.getenv('INGEST_MAX_BODY_MB', '8')) * 1048576),
+                   max_decoded=int(float(os.getenv('INGEST_MAX_DECODED_MB', '32')) * 1048576),
+                   keepalive=float(os.getenv('INGEST_KEEPALIVE', '75')),
+                   drain_timeout=float(os.getenv('INGEST_DRAIN_SECONDS', '30')),
+                   logger=logger)
+
+    def route(self, method, path, handler, json_body=True, query=False):
+        """handler(data) for JSON routes, handler(query) with query=True, handler() otherwise."""
+        self.routes.append((method, path, handler, json_body, query))
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _endpoint(self, handler, json_body, query):
+        async def handle(request):
+            args = (dict(request.query),) if query else ()
+            if json_body:
+                try:
+                    raw = await request.read()
+                except web.HTTPRequestEntityTooLarge:
+                    self._count('too_large')
+                    return web.json_response({'status': f'Request is too large, the limit is {self.max_body // 1048576} MB.'}, status=413)
+                try:
+                    args = (self.parse_json(raw, request.headers.get('Content-Encoding')),)
+                except BodyError as e:
+                    return web.json_response({'status': e.message}, status=e.status)
+
+            self._count('in_flight')
+            started = time.perf_counter()
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, handler, *args)
+            except Exception:
+                self._count('errors')
+                self.logger.exception(f"Unhandled error in {request.method} {request.path}")
+                return web.json_response({'status': 'Internal server error.'}, status=500)
+            finally:
+                self._count('in_flight', -1)
+                self._count('handler_ms', (time.perf_counter() - started) * 1000)
+
+            body, status = result[:2]
+            if len(result) > 2 and result[2] is not None:
+                task = asyncio.create_task(result[2]())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return web.json_response(body, status=status, dumps=jsoncodec.dumps)
+
+        async def endpoint(request):
+            self._count('requests')
+            async with self._slots:
+                return await handle(request)
+        return endpoint
+
+    def parse_json(self, raw, content_encoding):
+        """JSON body of a request, raises BodyError. Also used by the Flask routes."""
+        try:
+            body = decode_body(raw, content_encoding, self.max_decoded)
+        except BodyError as e:
+            if e.status == 413:
+                self._count('too_large')
+            raise
+        if body is not raw:
+            self._count('compressed')
+            self._count('compressed_bytes', len(raw))
+            self._count('decoded_bytes', len(body))
+        try:
+            return jsoncodec.loads(body)
+        except ValueError:
+            raise BodyError(400, 'Request body is not valid JSON.')
+
+    async def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='ingest-http')
+        self._slots = asyncio.Semaphore(self.concurrency)
+        app = web.Application(client_max_size=self.max_body)
+        for method, path, handler, json_body, query in self.routes:
+            app.router.add_route(method, path, self._endpoint(handler, json_body, query))
+
+        # Content-Encoding is handled by parse_json, which enforces the decoded size limit
+        self._runner = web.AppRunner(app, keepalive_timeout=self.keepalive, access_log=None, auto_decompress=False,
+                                     shutdown_timeout=self.drain_timeout)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.logger.info(f"Ingestion server listening on {self.host}:{self.port} "
+                         f"(concurrency {self.concurrency}, max body {self.max_body // 1048576} MB)")
+
+    async def stop(self):
+        """Stop accepting connections, then wait for in-flight requests and their Discord posts."""
+        if self._runner is None:
+            return
+        self.logger.info("Draining ingestion server...")
+        await self._runner.cleanup()
+        self._runner = None
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=self.drain_timeout)
+        self._executor.shutdown(wait=False)
+        self.logger.info("Ingestion server stopped.")
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['handler_ms'] = round(stats['handler_ms'], 1)
+        stats['pending_posts'] = len(self._tasks)
+        return stats
+
+
+ingest_server = IngestServer.from_env()
+metrics.register('ingest_http', ingest_server.stats)
@@ -1,8 +1,14 @@
-import ast
+import argparse
+import logging
+import os
 import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+from utility.packing import parse_legacy_points
 
-def _backup_db(db_path, logger):
+
+def backup_db(db_path, logger):
     backup_path = db_path + ".bak"
 
     conn = sqlite3.connect(db_path)
@@ -15,13 +21,13 @@ def _backup_db(db_path, logger):
     return backup_path
 
 def _round_nested_numbers(value, decimal_places):
-    if isinstance(value, bool):
-        return value
-    if isinstance(value, (int, float)):
+    # Exact type checks are faster than isinstance() and leave bools alone
+    value_type = type(value)
+    if value_type is float or value_type is int:
         return round(float(value), decimal_places)
-    if isinstance(value, list):
+    if value_type is list:
         return [_round_nested_numbers(item, decimal_places) for item in value]
-    if isinstance(value, dict):
+    if value_type is dict:
         return {k: _round_nested_numbers(v, decimal_places) for k, v in value.items()}
     return value
 
@@ -31,13 +37,17 @@ def _parse_serialized_points(raw_value, logger, table_name, column_name):
         return None
     if isinstance(raw_value, (list, dict)):
         return raw_value
+    if isinstance(raw_value, bytes):
+        # Packed payloads are already stored as float32, nothing to squash
+        return None
 
     text = str(raw_value).strip()
     if not text:
         return None
 
     try:
-        return ast.literal_eval(text)
+        # JSON first, literal_eval only for the values JSON can not read
+        return parse_legacy_points(text)
     except (SyntaxError, ValueError):
         logger.warning("Unable to parse payload in %s.%s, skipping value", table_name, column_name)
         return None
@@ -59,6 +69,34 @@ def _get_target_tables(connection):
     return target_tables
 
 
+def squash_rows(cursor, table_name, target_columns, rows, decimal_places, logger):
+    """Round the points of already fetched (rowid, *target_columns) rows. Returns the number of rows updated."""
+    rows_updated = 0
+    for row in rows:
+        rowid = row[0]
+        values_by_column = dict(zip(target_columns, row[1:]))
+        updates = {}
+
+        for column_name, raw_value in values_by_column.items():
+            parsed = _parse_serialized_points(raw_value, logger, table_name, column_name)
+            if parsed is None:
+                continue
+
+            rounded = _round_nested_numbers(parsed, decimal_places)
+            rounded_serialized = str(rounded)
+
+            if raw_value != rounded_serialized:
+                updates[column_name] = rounded_serialized
+
+        if updates:
+            set_clause = ", ".join([f"{column} = ?" for column in updates])
+            params = list(updates.values()) + [rowid]
+            cursor.execute(f"UPDATE {table_name} SET {set_clause} WHERE rowid = ?", params)
+            rows_updated += 1
+
+    return rows_updated
+
+
 def _squash_table_rows(connection, table_name, target_columns, decimal_places, logger, batch_size=250):
     read_cursor = connection.cursor()
     write_cursor = connection.cursor()
@@ -72,27 +110,7 @@ def _squash_table_rows(connection, table_name, target_columns, decimal_places, l
         if not batch_rows:
             break
 
-        for row in batch_rows:
-            rowid = row[0]
-            values_by_column = dict(zip(target_columns, row[1:]))
-            updates = {}
-
-            for column_name, raw_value in values_by_column.items():
-                parsed = _parse_serialized_points(raw_value, logger, table_name, column_name)
-                if parsed is None:
-                    continue
-
-                rounded = _round_nested_numbers(parsed, decimal_places)
-                rounded_serialized = str(rounded)
-
-                if raw_value != rounded_serialized:
-                    updates[column_name] = rounded_serialized
-
-            if updates:
-                set_clause = ", ".join([f"{column} = ?" for column in updates])
-                params = list(updates.values()) + [rowid]
-                write_cursor.execute(f"UPDATE {table_name} SET {set_clause} WHERE rowid = ?", params)
-                rows_updated += 1
+        rows_updated += squash_rows(write_cursor, table_name, target_columns, batch_rows, decimal_places, logger)
 
     return rows_updated
 
@@ -133,9 +151,133 @@ def _vacuum_database(db_path, logger):
     logger.info("Database compaction complete (VACUUM).")
 
 
-def backup_and_squash(db_path, logger, decimal_places=3, compact=True):
-    _backup_db(db_path, logger)
-    rows_updated = _squash_db_precision(db_path, logger, decimal_places=decimal_places)
+#================================================================================================
+# Parallel mode
+#================================================================================================
+# Every table is split into rowid ranges. Worker processes read, parse and round one range each
+# and hand back the new values, the parent writes them with executemany, one transaction per
+# range. Finished ranges are recorded in SQUASH_PROGRESS in that same transaction, so a rerun
+# after an interruption skips them. The table is dropped once every range is done, and a rerun
+# that resumes keeps the backup taken by the first run. Only text values are read, packed blobs
+# are left alone.
+#================================================================================================
+
+def _squash_range(db_path, table_name, target_columns, start_rowid, end_rowid, decimal_places):
+    logger = logging.getLogger(__name__)
+    connection = sqlite3.connect(db_path)
+    try:
+        text_filter = " OR ".join(f"typeof({column}) = 'text'" for column in target_columns)
+        rows = connection.execute(
+            f"SELECT rowid, {', '.join(target_columns)} FROM {table_name} WHERE rowid >= ? AND rowid < ? AND ({text_filter})",
+            (start_rowid, end_rowid)
+        ).fetchall()
+    finally:
+        connection.close()
+
+    updates = {column: [] for column in target_columns}
+    for row in rows:
+        for column_name, raw_value in zip(target_columns, row[1:]):
+            parsed = _parse_serialized_points(raw_value, logger, table_name, column_name)
+            if parsed is None:
+                continue
+            rounded_serialized = str(_round_nested_numbers(parsed, decimal_places))
+            if raw_value != rounded_serialized:
+                updates[column_name].append((rounded_serialized, row[0]))
+
+    return len(rows), updates
+
+
+def _table_ranges(connection, table_name, range_size):
+    low, high = connection.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table_name}").fetchone()
+    if low is None:
+        return []
+    return [(start, start + range_size) for start in range(low, high + 1, range_size)]
+
+
+def _squash_in_progress(db_path):
+    """True if an interrupted parallel squash left finished ranges behind."""
+    connection = sqlite3.connect(db_path)
+    try:
+        if not connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'SQUASH_PROGRESS'").fetchone():
+            return False
+        return connection.execute("SELECT 1 FROM SQUASH_PROGRESS LIMIT 1").fetchone() is not None
+    finally:
+        connection.close()
+
+
+def parallel_squash(db_path, logger, decimal_places=3, workers=None, range_size=5000):
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    connection.execute("PRAGMA busy_timeout = 5000")
+    connection.execute("CREATE TABLE IF NOT EXISTS SQUASH_PROGRESS "
+                       "(tableName TEXT, startRowid INTEGER, rowsUpdated INTEGER, PRIMARY KEY (tableName, startRowid))")
+
+    jobs = []
+    for table_name, target_columns in _get_target_tables(connection):
+        done = {row[0] for row in connection.execute("SELECT startRowid FROM SQUASH_PROGRESS WHERE tableName = ?", (table_name,))}
+        jobs.extend((table_name, target_columns, start, end)
+                    for start, end in _table_ranges(connection, table_name, range_size) if start not in done)
+
+    if not jobs:
+        logger.info("Precision squash: nothing left to do")
+        connection.execute("DROP TABLE SQUASH_PROGRESS")
+        connection.close()
+        return 0
+
+    logger.info("Precision squash: %s ranges of %s rows with %s workers", len(jobs), range_size, workers or os.cpu_count())
+    started = time.perf_counter()
+    rows_read = 0
+    total_rows_updated = 0
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_squash_range, db_path, table_name, target_columns, start, end, decimal_places): (table_name, start)
+                for table_name, target_columns, start, end in jobs
+            }
+            for completed, future in enumerate(as_completed(futures), start=1):
+                table_name, start = futures[future]
+                read, updates = future.result()
+
+                updated_rows = set()
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    for column_name, values in updates.items():
+                        if values:
+                            connection.executemany(f"UPDATE {table_name} SET {column_name} = ? WHERE rowid = ?", values)
+                            updated_rows.update(rowid for _, rowid in values)
+                    connection.execute("INSERT OR REPLACE INTO SQUASH_PROGRESS (tableName, startRowid, rowsUpdated) VALUES (?, ?, ?)",
+                                       (table_name, start, len(updated_rows)))
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+
+                rows_read += read
+                total_rows_updated += len(updated_rows)
+                if completed % 20 == 0 or completed == len(jobs):
+                    elapsed = time.perf_counter() - started
+                    logger.info("Precision squash: %s/%s ranges, %s rows, %.0f rows/sec",
+                                completed, len(jobs), rows_read, rows_read / elapsed if elapsed else 0)
+
+        # Every range is done, a later run starts over on whatever text values are left
+        connection.execute("DROP TABLE SQUASH_PROGRESS")
+    finally:
+        connection.close()
+
+    logger.info("Precision squash complete. Total rows updated: %s", total_rows_updated)
+    return total_rows_updated
+
+
+def backup_and_squash(db_path, logger, decimal_places=3, compact=True, parallel=False, workers=None):
+    # A resumed run would overwrite the clean backup with the half squashed database
+    if parallel and _squash_in_progress(db_path):
+        logger.info(f"Resuming an interrupted squash, keeping the existing backup {db_path}.bak")
+    else:
+        backup_db(db_path, logger)
+    if parallel:
+        rows_updated = parallel_squash(db_path, logger, decimal_places=decimal_places, workers=workers)
+    else:
+        rows_updated = _squash_db_precision(db_path, logger, decimal_places=decimal_places)
 
     if compact:
         _vacuum_database(db_path, logger)
@@ -143,4 +285,16 @@ def backup_and_squash(db_path, logger, decimal_places=3, compact=True):
     return rows_updated
 
 
+if __name__ == "__main__":
+    # Offline use with the bot stopped, e.g. python -m utility.squash_db_precision dbdata/database.db --parallel
+    parser = argparse.ArgumentParser(description="Round scatterplot/lifebar points that are still stored as text.")
+    parser.add_argument("database")
+    parser.add_argument("--decimal-places", type=int, default=3)
+    parser.add_argument("--parallel", action="store_true", help="process rowid ranges in a process pool (resumable)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-vacuum", action="store_true")
+    args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    backup_and_squash(args.database, logging.getLogger("squash"), decimal_places=args.decimal_places,
+                      compact=not args.no_vacuum, parallel=args.parallel, workers=args.workers)
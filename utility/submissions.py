@@ -0,0 +1,83 @@
+from utility import jsoncodec
+from utility.codec import encode, configured_codec
+from utility.judgements import breakdown_values
+from utility.packing import pack_scatter, pack_lifebar
+from utility.payloads import save_payload
+from utility.schema import is_course_table
+
+#================================================================================================
+# Personal best write path
+#================================================================================================
+# One upsert decides everything: the row is inserted if the user has no score on the chart yet,
+# updated if the new EX score beats the stored one and left alone otherwise. RETURNING only
+# yields a row when something was written, together with the previous best (prevBestEx is set
+# from the old exScore on update) and the position of the new score on the chart.
+#
+# Payloads and course entries are compressed on the way in, see utility.codec.
+#================================================================================================
+
+_song_insert_columns = [
+    'userID', 'songName', 'artist', 'pack', 'difficulty', 'itgScore', 'exScore', 'grade', 'length',
+    'stepartist', 'hash', 'worstWindow', 'date', 'mods', 'description', 'prevBestEx',
+    'judgements', 'meanAbsError', 'meanError', 'stdDev3', 'maxError'
+]
+_course_insert_columns = [
+    'userID', 'courseName', 'pack', 'entries', 'scripter', 'itgScore', 'exScore', 'grade', 'hash',
+    'date', 'mods', 'difficulty', 'description', 'prevBestEx'
+]
+
+# Columns refreshed when a score is beaten. The payload columns are cleared, the payload itself
+# goes to SCORE_PAYLOADS.
+_song_update = ('itgScore = excluded.itgScore, exScore = excluded.exScore, grade = excluded.grade, '
+                'scatter = NULL, life = NULL, worstWindow = excluded.worstWindow, date = excluded.date, '
+                'mods = excluded.mods, length = excluded.length, prevBestEx = exScore, radar = NULL, '
+                'judgements = excluded.judgements, meanAbsError = excluded.meanAbsError, meanError = excluded.meanError, '
+                'stdDev3 = excluded.stdDev3, maxError = excluded.maxError')
+_course_update = ('itgScore = excluded.itgScore, exScore = excluded.exScore, grade = excluded.grade, '
+                  'life = NULL, date = excluded.date, mods = excluded.mods, prevBestEx = exScore, radar = NULL')
+
+
+def _upsert_statement(table_name):
+    course = is_course_table(table_name)
+    columns = _course_insert_columns if course else _song_insert_columns
+    # INSERT ... SELECT so a 0% score is never stored, the WHERE is also required by the upsert syntax
+    return (f"INSERT INTO {table_name} ({', '.join(columns)}) "
+            f"SELECT {', '.join('?' * len(columns))} WHERE ? > 0 "
+            f"ON CONFLICT(userID, hash) DO UPDATE SET {_course_update if course else _song_update} "
+            f"WHERE excluded.exScore > exScore "
+            f"RETURNING rowid, prevBestEx, "
+            f"(SELECT COUNT(*) + 1 FROM {table_name} AS other WHERE other.hash = {table_name}.hash AND other.exScore > {table_name}.exScore)")
+
+
+def _insert_values(table_name, user_id, data, ex_score, date):
+    if is_course_table(table_name):
+        return (user_id, data.get('courseName'), data.get('pack'), encode(jsoncodec.dumps(data.get('entries')), configured_codec()), data.get('scripter'),
+                data.get('itgScore'), ex_score, data.get('grade'), data.get('hash'), date, data.get('mods'),
+                data.get('difficulty'), data.get('description'), 0)
+
+    return (user_id, data.get('songName'), data.get('artist'), data.get('pack'), data.get('difficulty'),
+            data.get('itgScore'), ex_score, data.get('grade'), data.get('length'), data.get('stepartist'),
+            data.get('hash'), data.get('worstWindow'), date, data.get('mods'), data.get('description'), 0) \
+        + breakdown_values(data.get('judgements'), data.get('timingStats'))
+
+
+def save_score(conn, table_name, user_id, data, date):
+    """
+    Store a submission if it is a new best for the user on that chart.
+    Must run inside a write transaction. Returns (rowid, previous best EX, chart position),
+    or None when the stored score was not beaten.
+    """
+    ex_score = float(data.get('exScore'))
+    c = conn.cursor()
+    c.execute(_upsert_statement(table_name), _insert_values(table_name, user_id, data, ex_score, date) + (ex_score,))
+    result = c.fetchone()
+    if result is None:
+        return None
+
+    score_rowid, prev_best_ex, position = result
+    codec = configured_codec()
+    save_payload(conn, table_name, score_rowid,
+                 None if is_course_table(table_name) else encode(pack_scatter(data.get('scatterplotData')), codec),
+                 encode(pack_lifebar(data.get('lifebarInfo')), codec),
+                 encode(jsoncodec.dumps(data.get('radar')), codec))
+    return score_rowid, float(prev_best_ex or 0), position
@@ -0,0 +1,61 @@
+import numpy as np
+
+#================================================================================================
+# Submission wire formats
+#================================================================================================
+# /hello lists the formats the server accepts, the module picks the newest one it knows.
+#
+#   1   JSON, scatterplotData/lifebarInfo are lists of {"x", "y", "color"} objects
+#   2   JSON with columnar points, "format": 2 and instead of the two lists:
+#
+#       "scatter": {"x": [...], "y": [...], "j": [...], "palette": [[r, g, b, a], ...]}
+#       "lifebar": {"x": [...], "y": [...]}
+#
+# In format 2 coordinates are integers in thousandths (the precision scores are stored with),
+# x is delta encoded since points come in time order. A scatter point's color is palette[j],
+# the palette holds one entry per judgement color. A point costs ~12 bytes instead of ~55 and
+# decodes straight into the arrays of utility.packing.
+#================================================================================================
+
+FORMAT_JSON = 1
+FORMAT_COLUMNAR = 2
+SUPPORTED_FORMATS = [FORMAT_JSON, FORMAT_COLUMNAR]
+
+
+def _coordinates(value, count=None):
+    x = np.cumsum(np.asarray(value['x'], dtype=np.int64)) / 1000
+    y = np.asarray(value['y'], dtype=np.int64) / 1000
+    if x.ndim != 1 or x.shape != y.shape or (count is not None and len(x) != count):
+        raise ValueError("Point columns have different lengths")
+    return x.astype(np.float32), y.astype(np.float32)
+
+
+def decode_lifebar(value):
+    x, y = _coordinates(value)
+    return {'x': x, 'y': y}
+
+
+def decode_scatter(value):
+    indices = np.asarray(value['j'], dtype=np.int64)
+    x, y = _coordinates(value, len(indices))
+    # Rounded like format 1 colors are (reduce_precision) before they become float32
+    palette = np.round(np.asarray(value['palette'], dtype=np.float64), 3).astype(np.float32)
+    if len(indices) and (palette.ndim != 2 or palette.shape[1] != 4):
+        raise ValueError("Palette entries must be RGBA colors")
+    if len(indices) and (indices.min() < 0 or indices.max() >= len(palette)):
+        raise ValueError("Judgement index outside of the palette")
+    color = palette[indices] if len(indices) else np.empty((0, 4), dtype=np.float32)
+    return {'x': x, 'y': y, 'color': color}
+
+
+def decode_submission(data):
+    """Replace the columnar points of a format 2 submission with scatterplotData/lifebarInfo in place.
+    Raises ValueError for malformed points."""
+    try:
+        if 'scatter' in data:
+            data['scatterplotData'] = decode_scatter(data.pop('scatter'))
+        if 'lifebar' in data:
+            data['lifebarInfo'] = decode_lifebar(data.pop('lifebar'))
+    except (KeyError, TypeError, OverflowError) as e:
+        raise ValueError(f"Malformed point columns: {e}")
+    return data